@@ -10,3 +10,10 @@ LOG_MODE = DEV_MODE if DEV_MODE else "-l" in CLI_ARGS or "--log" in CLI_ARGS
 
 TELEGRAM_MODE = "-l" in CLI_ARGS or "--telegram" in CLI_ARGS
 NOSTR_MODE = "-n" in CLI_ARGS or "--nostr" in CLI_ARGS
+WEBHOOK_MODE = "--webhook" in CLI_ARGS
+
+BACKFILL_TOKENS_MODE = "--backfill-tokens" in CLI_ARGS
+BUCKET_HISTORY_MODE = "--bucket-history" in CLI_ARGS
+COMPACT_MESSAGES_MODE = "--compact-messages" in CLI_ARGS
+ROLLUP_PRICES_MODE = "--rollup-prices" in CLI_ARGS
+EXPLAIN_MODE = "--explain" in CLI_ARGS
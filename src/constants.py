@@ -2,6 +2,9 @@ from typing import List
 from os.path import abspath
 
 OPENAI_MODEL: str = "gpt-4-1106-preview"
+OPENAI_TIMEOUT_SEC: float = 60.0
+OPENAI_MAX_CONNECTIONS: int = 20
+OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 10
 THE_ARCHITECT_ID: int = 1711738045
 THE_ARCHITECT_USERNAME: str = "nonni_io"
 THE_ARCHITECT_HANDLE: str = f"@{THE_ARCHITECT_USERNAME}"
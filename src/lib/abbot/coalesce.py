@@ -0,0 +1,88 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List
+
+from telegram import Message
+from telegram.ext import ContextTypes
+
+from ..logger import debug_bot, error_bot
+from ..metrics import metrics
+from ..abbot.config import BOT_COALESCE_DEBOUNCE_SEC, BOT_COALESCE_MAX_BATCH
+
+FILE_NAME = __name__
+
+
+class PendingMention:
+    def __init__(self, message: Message, context: ContextTypes.DEFAULT_TYPE):
+        self.message: Message = message
+        self.context: ContextTypes.DEFAULT_TYPE = context
+
+    def to_dict(self):
+        return vars(self)
+
+
+class CompletionCoalescer:
+    """
+    Merges mentions of the bot in the same chat into one completion. The first mention starts a per-chat worker
+    that waits debounce_sec, then answers everything queued; mentions arriving while that completion is in
+    flight are answered together by the next pass. A failed batch is logged and the worker goes on with the next;
+    stop() answers whatever is still queued without waiting out the debounce
+    """
+
+    def __init__(self, debounce_sec: float = BOT_COALESCE_DEBOUNCE_SEC, max_batch: int = BOT_COALESCE_MAX_BATCH):
+        self.debounce_sec: float = debounce_sec
+        self.max_batch: int = max_batch
+        self.pending: Dict[int, List[PendingMention]] = dict()
+        self.workers: Dict[int, asyncio.Task] = dict()
+        self.stopping: bool = False
+
+    def to_dict(self):
+        return dict(debounce_sec=self.debounce_sec, pending={k: len(v) for k, v in self.pending.items()})
+
+    def submit(
+        self,
+        chat_id: int,
+        mention: PendingMention,
+        answer: Callable[[int, List[PendingMention]], Awaitable],
+    ) -> bool:
+        self.pending.setdefault(chat_id, []).append(mention)
+        metrics.incr("coalesce.mentions")
+        worker = self.workers.get(chat_id)
+        if worker and not worker.done():
+            return False
+        self.workers[chat_id] = asyncio.create_task(self.drain(chat_id, answer))
+        return True
+
+    async def drain(self, chat_id: int, answer: Callable[[int, List[PendingMention]], Awaitable]):
+        log_name: str = f"{FILE_NAME}: CompletionCoalescer.drain"
+        try:
+            while self.pending.get(chat_id):
+                if not self.stopping:
+                    await asyncio.sleep(self.debounce_sec)
+                queued: List[PendingMention] = self.pending.pop(chat_id, [])
+                batch, rest = queued[: self.max_batch], queued[self.max_batch :]
+                if rest:
+                    self.pending[chat_id] = rest
+                metrics.observe("coalesce.batch_size", len(batch))
+                metrics.incr("coalesce.completions_saved", len(batch) - 1)
+                debug_bot.log(log_name, f"chat_id={chat_id} batch_size={len(batch)} queued={len(rest)}")
+                try:
+                    await answer(chat_id, batch)
+                except Exception as exception:
+                    metrics.incr("coalesce.failed")
+                    error_bot.log(log_name, f"chat_id={chat_id} batch_size={len(batch)} exception={exception}")
+        finally:
+            self.workers.pop(chat_id, None)
+
+    async def stop(self):
+        """
+        Answers every mention still queued, skipping the debounce, and waits for the workers to finish
+        """
+        log_name: str = f"{FILE_NAME}: CompletionCoalescer.stop"
+        self.stopping = True
+        debug_bot.log(log_name, f"{self.to_dict()} workers={len(self.workers)}")
+        workers: List[asyncio.Task] = list(self.workers.values())
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+coalescer = CompletionCoalescer()
@@ -18,6 +18,9 @@ ORG_INPUT_TOKEN_COST = try_get(ORG_BUSINESS_MODEL, "input_token_cost")
 ORG_OUTPUT_TOKEN_COST = try_get(ORG_BUSINESS_MODEL, "output_token_cost")
 ORG_PER_TOKEN_COST_DIV = try_get(ORG_BUSINESS_MODEL, "per_token_cost_divisor")
 ORG_TOKEN_COST_MULT = try_get(ORG_BUSINESS_MODEL, "token_cost_multiplier")
+ORG_MODEL_TIERS = try_get(ORG_BUSINESS_MODEL, "tiers", default={})
+ORG_DEFAULT_TIER = try_get(ORG_BUSINESS_MODEL, "default_tier")
+ORG_ECONOMY_TIER = try_get(ORG_BUSINESS_MODEL, "economy_tier")
 ORG_CHAT_ID = try_get(ORG_CONFIG, "chat_id")
 ORG_CHAT_TITLE = try_get(ORG_CONFIG, "chat_title")
 ORG_BLOCK_HEIGHT = try_get(ORG_CONFIG, "block_height")
@@ -39,10 +42,118 @@ BOT_TELEGRAM_USERNAME = try_get(BOT_TELEGRAM, "username")
 BOT_TELEGRAM_USER_ID = try_get(BOT_TELEGRAM, "user_id")
 BOT_TELEGRAM_CONTEXT = try_get(BOT_TELEGRAM, "context")
 BOT_TELEGRAM_SUPPORT_CONTACT = try_get(BOT_TELEGRAM, "support_contact")
+BOT_TELEGRAM_UPDATE_WORKERS = try_get(BOT_TELEGRAM, "update_workers", default=16)
+BOT_TELEGRAM_MAX_PENDING_UPDATES = try_get(BOT_TELEGRAM, "max_pending_updates", default=1024)
+BOT_TELEGRAM_WEBHOOK = try_get(BOT_TELEGRAM, "webhook")
+BOT_TELEGRAM_WEBHOOK_HOST = try_get(BOT_TELEGRAM_WEBHOOK, "host", default="127.0.0.1")
+BOT_TELEGRAM_WEBHOOK_PORT = try_get(BOT_TELEGRAM_WEBHOOK, "port", default=8443)
+BOT_TELEGRAM_WEBHOOK_PATH = try_get(BOT_TELEGRAM_WEBHOOK, "path", default="/telegram/webhook")
+BOT_TELEGRAM_WEBHOOK_URL = try_get(BOT_TELEGRAM_WEBHOOK, "url", default="")
+BOT_TELEGRAM_WEBHOOK_MAX_CONNECTIONS = try_get(BOT_TELEGRAM_WEBHOOK, "max_connections", default=40)
+BOT_TELEGRAM_WEBHOOK_MAX_QUEUE = try_get(BOT_TELEGRAM_WEBHOOK, "max_queue", default=256)
+BOT_TELEGRAM_WEBHOOK_MAX_BODY_BYTES = try_get(BOT_TELEGRAM_WEBHOOK, "max_body_bytes", default=1048576)
+BOT_TELEGRAM_WEBHOOK_DROP_PENDING = try_get(BOT_TELEGRAM_WEBHOOK, "drop_pending_updates", default=False)
 
 BOT_LIGHTNING = try_get(BOT_CONFIG, "lightning")
 BOT_LIGHTNING_ADDRESS = try_get(BOT_LIGHTNING, "address")
 
+BOT_COMPLETIONS = try_get(BOT_CONFIG, "completions")
+BOT_STREAM_COMPLETIONS = try_get(BOT_COMPLETIONS, "stream", default=False)
+BOT_STREAM_EDIT_INTERVAL_SEC = try_get(BOT_COMPLETIONS, "stream_edit_interval_sec", default=3.0)
+BOT_COALESCE_DEBOUNCE_SEC = try_get(BOT_COMPLETIONS, "coalesce_debounce_sec", default=1.0)
+BOT_COALESCE_MAX_BATCH = try_get(BOT_COMPLETIONS, "coalesce_max_batch", default=8)
+
+BOT_ROUTING = try_get(BOT_CONFIG, "routing")
+BOT_ROUTING_ECONOMY_HANDLERS = try_get(BOT_ROUTING, "economy_handlers", default=["unleashed"])
+BOT_ROUTING_SHORT_MESSAGE_CHARS = try_get(BOT_ROUTING, "short_message_chars", default=0)
+BOT_ROUTING_LOW_BALANCE_SATS = try_get(BOT_ROUTING, "low_balance_sats", default=0)
+BOT_ROUTING_LATENCY_BUDGET_SEC = try_get(BOT_ROUTING, "latency_budget_sec", default=20.0)
+BOT_ROUTING_LATENCY_EWMA_ALPHA = try_get(BOT_ROUTING, "latency_ewma_alpha", default=0.2)
+
+BOT_LIMITER = try_get(BOT_CONFIG, "limiter")
+BOT_LIMITER_MAX_IN_FLIGHT = try_get(BOT_LIMITER, "max_in_flight", default=8)
+BOT_LIMITER_TOKENS_PER_MINUTE = try_get(BOT_LIMITER, "tokens_per_minute", default=300000)
+BOT_LIMITER_MAX_QUEUE_DEPTH = try_get(BOT_LIMITER, "max_queue_depth", default=32)
+
+BOT_STORAGE = try_get(BOT_CONFIG, "storage")
+BOT_STORAGE_HISTORY_WINDOW = try_get(BOT_STORAGE, "history_window", default=200)
+BOT_STORAGE_BUCKET_SIZE = try_get(BOT_STORAGE, "bucket_size", default=100)
+BOT_STORAGE_WRITE_BEHIND_INTERVAL_SEC = try_get(BOT_STORAGE, "write_behind_interval_sec", default=2.0)
+BOT_STORAGE_WRITE_BEHIND_MAX_ENTRIES = try_get(BOT_STORAGE, "write_behind_max_entries", default=500)
+BOT_STORAGE_WRITE_BEHIND_MAX_ATTEMPTS = try_get(BOT_STORAGE, "write_behind_max_attempts", default=3)
+BOT_STORAGE_COMPRESS_MESSAGES = try_get(BOT_STORAGE, "compress_messages", default=False)
+BOT_STORAGE_COMPRESS_MIN_BYTES = try_get(BOT_STORAGE, "compress_min_bytes", default=512)
+
+BOT_GROUP_CACHE = try_get(BOT_CONFIG, "group_cache")
+BOT_GROUP_CACHE_MAX_GROUPS = try_get(BOT_GROUP_CACHE, "max_groups", default=256)
+BOT_GROUP_CACHE_REVALIDATE_SEC = try_get(BOT_GROUP_CACHE, "revalidate_sec", default=1.0)
+BOT_GROUP_CACHE_CHANGE_STREAMS = try_get(BOT_GROUP_CACHE, "change_streams", default=True)
+
+BOT_DATABASE = try_get(BOT_CONFIG, "database")
+BOT_DATABASE_MAX_POOL_SIZE = try_get(BOT_DATABASE, "max_pool_size", default=50)
+BOT_DATABASE_MIN_POOL_SIZE = try_get(BOT_DATABASE, "min_pool_size", default=0)
+BOT_DATABASE_CONNECT_TIMEOUT_MS = try_get(BOT_DATABASE, "connect_timeout_ms", default=5000)
+BOT_DATABASE_SERVER_SELECTION_TIMEOUT_MS = try_get(BOT_DATABASE, "server_selection_timeout_ms", default=5000)
+BOT_DATABASE_SOCKET_TIMEOUT_MS = try_get(BOT_DATABASE, "socket_timeout_ms", default=10000)
+BOT_DATABASE_WAIT_QUEUE_TIMEOUT_MS = try_get(BOT_DATABASE, "wait_queue_timeout_ms", default=5000)
+BOT_DATABASE_EXECUTOR_WORKERS = try_get(BOT_DATABASE, "executor_workers", default=16)
+
+BOT_CONTEXT = try_get(BOT_CONFIG, "context")
+BOT_CONTEXT_BUDGET_TOKENS = try_get(BOT_CONTEXT, "budget_tokens", default=32000)
+BOT_CONTEXT_RESERVE_TOKENS = try_get(BOT_CONTEXT, "reserve_tokens", default=4096)
+BOT_CONTEXT_TOKEN_CACHE_SIZE = try_get(BOT_CONTEXT, "token_cache_size", default=8192)
+
+BOT_SUMMARY = try_get(BOT_CONFIG, "summary")
+BOT_SUMMARY_THRESHOLD_TOKENS = try_get(BOT_SUMMARY, "threshold_tokens", default=24000)
+BOT_SUMMARY_KEEP_RECENT_TOKENS = try_get(BOT_SUMMARY, "keep_recent_tokens", default=8000)
+BOT_SUMMARY_MAX_TOKENS = try_get(BOT_SUMMARY, "max_summary_tokens", default=1024)
+
+BOT_PRICES = try_get(BOT_CONFIG, "prices")
+BOT_PRICE_CACHE_TTL_SEC = try_get(BOT_PRICES, "cache_ttl_sec", default=60)
+BOT_PRICE_MAX_AGE_SEC = try_get(BOT_PRICES, "max_age_sec", default=900)
+BOT_PRICE_MAX_STALE_SEC = try_get(BOT_PRICES, "max_stale_sec", default=3600)
+BOT_PRICE_TICK_RETENTION_SEC = try_get(BOT_PRICES, "tick_retention_sec", default=604800)
+BOT_PRICE_MINUTE_RETENTION_SEC = try_get(BOT_PRICES, "minute_retention_sec", default=7776000)
+
+BOT_LEDGER = try_get(BOT_CONFIG, "ledger")
+BOT_LEDGER_STARTER_SATS = try_get(BOT_LEDGER, "starter_sats", default=5000)
+BOT_LEDGER_REFS_KEPT = try_get(BOT_LEDGER, "refs_kept", default=100)
+BOT_LEDGER_DEBIT_RETRIES = try_get(BOT_LEDGER, "debit_retries", default=5)
+
+BOT_INVOICES = try_get(BOT_CONFIG, "invoices")
+BOT_INVOICES_MIN_CHECK_INTERVAL_SEC = try_get(BOT_INVOICES, "min_check_interval_sec", default=1.0)
+BOT_INVOICES_MAX_CHECK_INTERVAL_SEC = try_get(BOT_INVOICES, "max_check_interval_sec", default=15.0)
+BOT_INVOICES_CHECK_BACKOFF = try_get(BOT_INVOICES, "check_backoff", default=1.5)
+BOT_INVOICES_STRIKE_PAGE_SIZE = try_get(BOT_INVOICES, "strike_page_size", default=100)
+
+BOT_PAYMENT_WEBHOOKS = try_get(BOT_CONFIG, "payment_webhooks")
+BOT_PAYMENT_WEBHOOKS_ENABLED = try_get(BOT_PAYMENT_WEBHOOKS, "enabled", default=False)
+BOT_PAYMENT_WEBHOOKS_HOST = try_get(BOT_PAYMENT_WEBHOOKS, "host", default="127.0.0.1")
+BOT_PAYMENT_WEBHOOKS_PORT = try_get(BOT_PAYMENT_WEBHOOKS, "port", default=8444)
+BOT_PAYMENT_WEBHOOKS_PATH = try_get(BOT_PAYMENT_WEBHOOKS, "path", default="/payments")
+BOT_PAYMENT_WEBHOOKS_URL = try_get(BOT_PAYMENT_WEBHOOKS, "url", default="")
+BOT_PAYMENT_WEBHOOKS_MAX_BODY_BYTES = try_get(BOT_PAYMENT_WEBHOOKS, "max_body_bytes", default=65536)
+BOT_PAYMENT_WEBHOOKS_FALLBACK_MIN_SEC = try_get(BOT_PAYMENT_WEBHOOKS, "fallback_min_check_interval_sec", default=15.0)
+BOT_PAYMENT_WEBHOOKS_FALLBACK_MAX_SEC = try_get(BOT_PAYMENT_WEBHOOKS, "fallback_max_check_interval_sec", default=60.0)
+
+BOT_OUTBOUND = try_get(BOT_CONFIG, "outbound")
+BOT_OUTBOUND_GLOBAL_PER_SEC = try_get(BOT_OUTBOUND, "global_per_sec", default=30)
+BOT_OUTBOUND_GROUP_PER_MIN = try_get(BOT_OUTBOUND, "group_per_min", default=20)
+BOT_OUTBOUND_PRIVATE_PER_SEC = try_get(BOT_OUTBOUND, "private_per_sec", default=1)
+BOT_OUTBOUND_CHAT_BURST = try_get(BOT_OUTBOUND, "chat_burst", default=3)
+BOT_OUTBOUND_MAX_RETRIES = try_get(BOT_OUTBOUND, "max_retries", default=3)
+BOT_OUTBOUND_MAX_CHATS = try_get(BOT_OUTBOUND, "max_chats", default=4096)
+BOT_OUTBOUND_SQUAWK_MERGE_SEC = try_get(BOT_OUTBOUND, "squawk_merge_sec", default=5.0)
+BOT_METRICS = try_get(BOT_CONFIG, "metrics")
+BOT_METRICS_LOG_INTERVAL_SEC = try_get(BOT_METRICS, "log_interval_sec", default=60)
+
+BOT_SEMANTIC_CACHE = try_get(BOT_CONFIG, "semantic_cache")
+BOT_SEMANTIC_CACHE_ENABLED = try_get(BOT_SEMANTIC_CACHE, "enabled", default=False)
+BOT_SEMANTIC_CACHE_THRESHOLD = try_get(BOT_SEMANTIC_CACHE, "similarity_threshold", default=0.9)
+BOT_SEMANTIC_CACHE_TTL_SEC = try_get(BOT_SEMANTIC_CACHE, "ttl_sec", default=86400)
+BOT_SEMANTIC_CACHE_MAX_ENTRIES = try_get(BOT_SEMANTIC_CACHE, "max_entries", default=1024)
+BOT_SEMANTIC_CACHE_MIN_CHARS = try_get(BOT_SEMANTIC_CACHE, "min_chars", default=12)
+
 BOT_NOSTR = try_get(BOT_CONFIG, "nostr")
 BOT_NOSTR_PK = try_get(BOT_NOSTR, "pk")
 BOT_NOSTR_NPUB = try_get(BOT_NOSTR, "npub")
@@ -0,0 +1,159 @@
+import tiktoken
+from abc import abstractmethod
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from constants import OPENAI_MODEL
+from ..utils import to_dict, try_get
+from ..abbot.exceptions.exception import AbbotException
+from ..abbot.config import (
+    BOT_CONTEXT_BUDGET_TOKENS,
+    BOT_CONTEXT_RESERVE_TOKENS,
+    BOT_CONTEXT_TOKEN_CACHE_SIZE,
+    BOT_SYSTEM_OBJECT_BLIXT,
+    BOT_SYSTEM_OBJECT_DMS,
+    BOT_SYSTEM_OBJECT_GROUPS,
+)
+
+encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+FILE_NAME = __name__
+
+SYSTEM_OBJECTS: Dict[str, Dict] = {
+    "dm": BOT_SYSTEM_OBJECT_DMS,
+    "group": BOT_SYSTEM_OBJECT_GROUPS,
+    "blixt": BOT_SYSTEM_OBJECT_BLIXT,
+}
+
+# every chat message costs a few tokens of framing (role, separators) on top of its content
+MESSAGE_OVERHEAD_TOKENS: int = 4
+
+
+@lru_cache(maxsize=BOT_CONTEXT_TOKEN_CACHE_SIZE)
+def count_content_tokens(content: str) -> int:
+    return len(encoding.encode(content, allowed_special="all"))
+
+
+def entry_tokens(entry: Dict) -> int:
+    """
+    Content tokens of one history entry, preferring a stored "tokens" count over re-encoding
+    """
+    tokens: Optional[int] = try_get(entry, "tokens")
+    if tokens is not None:
+        return tokens
+    content: Optional[str] = try_get(entry, "content")
+    return count_content_tokens(content) if content else 0
+
+
+def with_tokens(entry: Dict) -> Dict:
+    return {**entry, "tokens": entry_tokens(entry)}
+
+
+def new_history_entry(role: str, content: str) -> Dict:
+    """
+    History entries carry their token count from insert time so nothing re-encodes stored history
+    """
+    return with_tokens({"role": role, "content": content})
+
+
+def history_tokens(history: List[Dict]) -> int:
+    return sum(entry_tokens(entry) for entry in history)
+
+
+def system_scope_for(bot_type: str, chat_title: Optional[str] = None) -> str:
+    if bot_type == "dm":
+        return "dm"
+    if chat_title and "blixt" in chat_title.lower():
+        return "blixt"
+    return "group"
+
+
+def system_object_for(bot_type: str, chat_title: Optional[str] = None) -> Dict:
+    return SYSTEM_OBJECTS[system_scope_for(bot_type, chat_title)]
+
+
+@to_dict
+class ContextWindow:
+    def __init__(
+        self,
+        messages: List[Dict],
+        prompt_tokens: int,
+        reserve_tokens: int,
+        dropped_tokens: int,
+        dropped_messages: int,
+    ):
+        self.messages: List[Dict] = messages
+        self.prompt_tokens: int = prompt_tokens
+        self.reserve_tokens: int = reserve_tokens
+        self.dropped_tokens: int = dropped_tokens
+        self.dropped_messages: int = dropped_messages
+
+    @abstractmethod
+    def to_dict(self) -> Dict:
+        pass
+
+
+def summary_object_for(summary: Optional[Dict]) -> Optional[Dict]:
+    content: Optional[str] = try_get(summary, "content")
+    if not content:
+        return None
+    return {"role": "system", "content": f"Summary of the earlier conversation: {content}"}
+
+
+def truncate_content(content: str, max_tokens: int) -> str:
+    """
+    The first max_tokens tokens of content, marked as cut
+    """
+    tokens: List[int] = encoding.encode(content, allowed_special="all")
+    if len(tokens) <= max_tokens:
+        return content
+    return f"{encoding.decode(tokens[:max_tokens])} ..."
+
+
+def build_context_window(
+    history: List[Dict],
+    system_object: Dict,
+    summary: Optional[Dict] = None,
+    budget_tokens: int = BOT_CONTEXT_BUDGET_TOKENS,
+    reserve_tokens: int = BOT_CONTEXT_RESERVE_TOKENS,
+) -> ContextWindow:
+    """
+    Packs the newest history turns, newest first, into budget_tokens minus reserve_tokens (room for the answer)
+    minus the system prompt and running summary. Stored system entries are replaced by system_object and only
+    role/content are sent. The newest turn is always sent, cut down to fit when it alone is over the budget;
+    raises AbbotException when the system prompt and summary leave no room for it
+    """
+    system_messages: List[Dict] = [{"role": "system", "content": try_get(system_object, "content")}]
+    summary_object: Optional[Dict] = summary_object_for(summary)
+    if summary_object:
+        system_messages.append(summary_object)
+    system_tokens = sum(entry_tokens(system_message) + MESSAGE_OVERHEAD_TOKENS for system_message in system_messages)
+    available_tokens = budget_tokens - reserve_tokens - system_tokens
+    turns = [entry for entry in history if try_get(entry, "role") != "system" and try_get(entry, "content")]
+    packed: List[Dict] = []
+    packed_tokens = 0
+    dropped_tokens = 0
+    for index in range(len(turns) - 1, -1, -1):
+        entry = turns[index]
+        content: str = try_get(entry, "content")
+        tokens = entry_tokens(entry) + MESSAGE_OVERHEAD_TOKENS
+        if packed_tokens + tokens > available_tokens and packed:
+            dropped_tokens += sum(entry_tokens(dropped) + MESSAGE_OVERHEAD_TOKENS for dropped in turns[: index + 1])
+            break
+        if tokens > available_tokens:
+            # one trailing token of room for the cut marker
+            content_tokens: int = available_tokens - MESSAGE_OVERHEAD_TOKENS - 1
+            if content_tokens <= 0:
+                raise AbbotException(f"No room for the newest turn: available_tokens={available_tokens}")
+            content = truncate_content(content, content_tokens)
+            dropped_tokens += tokens - available_tokens
+            tokens = available_tokens
+        packed.append({"role": try_get(entry, "role"), "content": content})
+        packed_tokens += tokens
+    packed.reverse()
+    return ContextWindow(
+        messages=[*system_messages, *packed],
+        prompt_tokens=packed_tokens + system_tokens,
+        reserve_tokens=reserve_tokens,
+        dropped_tokens=dropped_tokens,
+        dropped_messages=len(turns) - len(packed),
+    )
@@ -1,14 +1,32 @@
 import time
+import httpx
 import tiktoken
-from openai import OpenAI, Stream
-from openai.types.chat import ChatCompletionChunk
+from openai import AsyncOpenAI, OpenAI, APITimeoutError
+from openai import AsyncStream
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
 from abc import abstractmethod
-from typing import List, Dict
+from typing import Awaitable, Callable, List, Dict, Optional, Tuple
 
-from constants import OPENAI_MODEL
+from constants import OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE_CONNECTIONS, OPENAI_MODEL, OPENAI_TIMEOUT_SEC
 from ..db.utils import successful_update_one
-from ..abbot.config import BOT_SYSTEM_OBJECT_BLIXT, BOT_SYSTEM_OBJECT_GROUPS
+from ..abbot.context import (
+    ContextWindow,
+    build_context_window,
+    count_content_tokens,
+    entry_tokens,
+    history_tokens,
+    new_history_entry,
+    system_object_for,
+    system_scope_for,
+    with_tokens,
+)
+from ..abbot.semantic_cache import cache_question, semantic_cache
+from ..abbot.router import ModelTier, model_router
+from ..abbot.limiter import admission_controller
+from ..abbot.env import OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_ORG_ID
+from ..abbot.exceptions.exception import AbbotException
 from ..utils import error, success, to_dict, try_get
+from ..metrics import metrics
 from ..db.mongo import GroupConfig, UpdateResult, mongo_abbot
 
 from ..logger import debug_bot, error_bot
@@ -17,24 +35,73 @@ encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
 FILE_NAME = __name__
 
 
-@to_dict
-class Abbot(GroupConfig):
-    from ..abbot.env import OPENAI_API_KEY, OPENAI_ORG_ID
+def new_client(base_url: Optional[str] = OPENAI_BASE_URL) -> OpenAI:
+    return OpenAI(organization=OPENAI_ORG_ID, api_key=OPENAI_API_KEY, base_url=base_url, timeout=OPENAI_TIMEOUT_SEC)
+
+
+def new_async_client(base_url: Optional[str] = OPENAI_BASE_URL) -> AsyncOpenAI:
+    """
+    One pooled AsyncOpenAI client is shared by every Abbot so concurrent chats reuse keep-alive
+    connections instead of opening a new one per completion
+    """
+    limits = httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    )
+    return AsyncOpenAI(
+        organization=OPENAI_ORG_ID,
+        api_key=OPENAI_API_KEY,
+        base_url=base_url,
+        timeout=OPENAI_TIMEOUT_SEC,
+        http_client=httpx.AsyncClient(limits=limits, timeout=OPENAI_TIMEOUT_SEC),
+    )
 
-    client: OpenAI = OpenAI(organization=OPENAI_ORG_ID, api_key=OPENAI_API_KEY)
 
-    def __init__(self, id: str, bot_type: str, history: List):
+@to_dict
+class Abbot(GroupConfig):
+    client: OpenAI = new_client()
+    async_client: AsyncOpenAI = new_async_client()
+
+    def __init__(
+        self,
+        id: str,
+        bot_type: str,
+        history: List,
+        history_tokens: Optional[int] = None,
+        summary: Optional[Dict] = None,
+        history_offset: int = 0,
+    ):
         log_name: str = f"{__name__}: Abbot.__init__():"
         self.id: str = id
         self.bot_type: str = bot_type
         self.history: List = history
-        self.history_len: int = len(history)
-        self.history_tokens: int = self.calculate_history_tokens(history)
+        self.summary: Optional[Dict] = summary
+        # history is the recent window of the chat; history_offset is the sequence number of its first entry
+        self.history_offset: int = history_offset
+        self.history_len: int = history_offset + len(history)
+        if history_tokens is None:
+            history_tokens = self.calculate_history_tokens(history)
+        self.history_tokens: int = history_tokens
+        self.tier: ModelTier = model_router.tier()
         if bot_type == "group":
             self.config: GroupConfig = GroupConfig()
 
+    @classmethod
+    def from_document(cls, id: str, bot_type: str, document: Optional[Dict]) -> "Abbot":
+        """
+        Abbot over a group or dm document: its recent history window, token total, summary and window offset
+        """
+        return cls(
+            id,
+            bot_type,
+            try_get(document, "history", default=[]),
+            try_get(document, "tokens"),
+            try_get(document, "summary"),
+            mongo_abbot.history_offset(document),
+        )
+
     def __str__(self) -> str:
-        return f"Abbot(model={OPENAI_MODEL}, id={self.id}, bot_type={self.bot_type}, history_len={self.history_len}, history_tokens={self.history_tokens}, config={self.config})"
+        return f"Abbot(model={self.tier.model}, id={self.id}, bot_type={self.bot_type}, history_len={self.history_len}, history_tokens={self.history_tokens}, config={self.config})"
 
     @abstractmethod
     def to_dict(self) -> dict:
@@ -105,19 +172,12 @@ class Abbot(GroupConfig):
         return encoding.encode(content, allowed_special="all")
 
     def calculate_tokens(self, content: str) -> int:
-        return len(self.tokenize(content))
+        return count_content_tokens(content)
 
     def calculate_history_tokens(self, history=None) -> int:
-        log_name: str = f"{FILE_NAME}: calculate_history_tokens"
-        total = 0
         if not history:
             history = self.history
-        for data in history:
-            content = try_get(data, "content")
-            if not content:
-                continue
-            total += self.calculate_tokens(content)
-        return total
+        return history_tokens(history)
 
     def update_db(self, update: Dict) -> Dict | UpdateResult:
         log_name: str = f"{FILE_NAME}: calculate_history_tokens"
@@ -128,38 +188,169 @@ class Abbot(GroupConfig):
         upsert_id = try_get(result, "upserted_id")
         return success(upsert_id)
 
-    def update_history_tokens(self, content: str) -> int:
+    def update_history(self, update: Dict) -> Dict:
+        entry: Dict = with_tokens(update)
+        self.history.append(entry)
         self.history_len += 1
-        self.history_tokens += len(self.tokenize(content))
-
-    def update_history(self, update: Dict) -> None:
-        self.history.append(update)
-        content = try_get(update, "content")
-        if not content:
-            return
-        self.update_history_tokens(content)
-
-    def chat_completion(self, chat_title: str | None = None) -> str:
-        log_name: str = f"{FILE_NAME}: chat_completion"
-        messages_history = self.history
-        if self.history_tokens >= 90000:
-            messages_history = self.history[self.history_len - 500 : self.history_len]
-            if "blixt" in chat_title:
-                messages_history = [BOT_SYSTEM_OBJECT_BLIXT, *messages_history]
-            else:
-                messages_history = [BOT_SYSTEM_OBJECT_GROUPS, *messages_history]
-        response: Stream[ChatCompletionChunk] = self.client.chat.completions.create(
-            messages=messages_history, model=OPENAI_MODEL
+        self.history_tokens += entry_tokens(entry)
+        return entry
+
+    def completion_messages(self, chat_title: str | None = None) -> List:
+        log_name: str = f"{FILE_NAME}: completion_messages"
+        system_object = system_object_for(self.bot_type, chat_title)
+        summarized_through: int = try_get(self.summary, "through", default=0) or 0
+        unsummarized_start: int = max(0, summarized_through - self.history_offset)
+        self.context_window: ContextWindow = build_context_window(
+            self.history[unsummarized_start:], system_object, self.summary, budget_tokens=self.tier.budget_tokens()
         )
+        prompt_tokens = self.context_window.prompt_tokens
+        dropped_tokens = self.context_window.dropped_tokens
+        metrics.observe("context.prompt_tokens", prompt_tokens)
+        metrics.observe("context.dropped_tokens", dropped_tokens)
+        debug_bot.log(log_name, f"id={self.id} prompt_tokens={prompt_tokens} dropped_tokens={dropped_tokens}")
+        return self.context_window.messages
+
+    def handle_completion(self, response: ChatCompletion) -> Tuple[str, int, int, int]:
+        log_name: str = f"{FILE_NAME}: handle_completion"
         answer = try_get(response, "choices", 0, "message", "content")
         input_tokens = try_get(response, "usage", "prompt_tokens")
         output_tokens = try_get(response, "usage", "completion_tokens")
         total_tokens = try_get(response, "usage", "total_tokens")
-        self.history_tokens += total_tokens
-        assistant_update = {"role": "assistant", "content": answer}
-        self.update_history(assistant_update)
+        self.update_history(new_history_entry("assistant", answer))
         if not answer:
             debug_bot.log(log_name, f"chat_completion response={response}")
             error_bot.log(log_name, f"chat_completion => answer={answer}")
             error(response)
         return answer, input_tokens, output_tokens, total_tokens
+
+    def use_tier(self, tier: Optional[ModelTier]) -> ModelTier:
+        """
+        Completions run on the routed tier when given, and their context is packed to its budget; self.tier is
+        what the caller bills against afterwards
+        """
+        if tier:
+            self.tier = tier
+        return self.tier
+
+    def default_priority_class(self, priority_class: Optional[str]) -> str:
+        if priority_class:
+            return priority_class
+        return "dm" if self.bot_type == "dm" else "mention"
+
+    def chat_completion(
+        self, chat_title: str | None = None, tier: Optional[ModelTier] = None
+    ) -> Tuple[str, int, int, int]:
+        tier = self.use_tier(tier)
+        messages_history = self.completion_messages(chat_title)
+        started_at = time.perf_counter()
+        response: ChatCompletion = self.client.chat.completions.create(
+            messages=messages_history, model=tier.model, max_tokens=self.context_window.reserve_tokens
+        )
+        model_router.observe_latency(tier, time.perf_counter() - started_at)
+        return self.handle_completion(response)
+
+    def cached_answer(self, chat_title: str | None = None) -> Optional[str]:
+        """
+        Answers the latest user turn from the semantic cache; a hit costs no tokens
+        """
+        self.cache_scope: str = system_scope_for(self.bot_type, chat_title)
+        self.cache_question: Optional[str] = None
+        last_entry: Optional[Dict] = try_get(self.history, -1)
+        if try_get(last_entry, "role") == "user":
+            self.cache_question = cache_question(try_get(last_entry, "content"))
+        answer: Optional[str] = semantic_cache.lookup(self.cache_scope, self.cache_question)
+        if answer:
+            self.update_history(new_history_entry("assistant", answer))
+        return answer
+
+    async def async_chat_completion(
+        self,
+        chat_title: str | None = None,
+        timeout: float = OPENAI_TIMEOUT_SEC,
+        tier: Optional[ModelTier] = None,
+        priority_class: Optional[str] = None,
+    ) -> Tuple[str, int, int, int]:
+        log_name: str = f"{FILE_NAME}: async_chat_completion"
+        tier = self.use_tier(tier)
+        cached_answer: Optional[str] = self.cached_answer(chat_title)
+        if cached_answer:
+            return cached_answer, 0, 0, 0
+        messages_history = self.completion_messages(chat_title)
+        priority_class = self.default_priority_class(priority_class)
+        async with admission_controller.admit(priority_class, self.context_window.prompt_tokens) as admission:
+            started_at = time.perf_counter()
+            try:
+                response: ChatCompletion = await self.async_client.chat.completions.create(
+                    messages=messages_history,
+                    model=tier.model,
+                    max_tokens=self.context_window.reserve_tokens,
+                    timeout=timeout,
+                )
+            except APITimeoutError as timeout_error:
+                error_bot.log(log_name, f"id={self.id} timeout={timeout} error={timeout_error}")
+                raise AbbotException(f"Chat completion timed out after {timeout}s: id={self.id}")
+            admission.used_tokens = try_get(response, "usage", "completion_tokens", default=0) or 0
+        model_router.observe_latency(tier, time.perf_counter() - started_at)
+        completion = self.handle_completion(response)
+        semantic_cache.store(self.cache_scope, self.cache_question, completion[0])
+        return completion
+
+    async def stream_chat_completion(
+        self,
+        chat_title: str | None = None,
+        on_delta: Optional[Callable[[str], Awaitable]] = None,
+        timeout: float = OPENAI_TIMEOUT_SEC,
+        tier: Optional[ModelTier] = None,
+        priority_class: Optional[str] = None,
+    ) -> Tuple[str, int, int, int]:
+        """
+        Streams the completion, awaiting on_delta for every content chunk. Streamed responses carry
+        no usage block, so prompt and completion tokens are counted locally with tiktoken
+        """
+        log_name: str = f"{FILE_NAME}: stream_chat_completion"
+        tier = self.use_tier(tier)
+        cached_answer: Optional[str] = self.cached_answer(chat_title)
+        if cached_answer:
+            if on_delta:
+                await on_delta(cached_answer)
+            return cached_answer, 0, 0, 0
+        messages_history = self.completion_messages(chat_title)
+        priority_class = self.default_priority_class(priority_class)
+        first_token_at = None
+        chunks: List[str] = []
+        async with admission_controller.admit(priority_class, self.context_window.prompt_tokens) as admission:
+            started_at = time.perf_counter()
+            try:
+                stream: AsyncStream[ChatCompletionChunk] = await self.async_client.chat.completions.create(
+                    messages=messages_history,
+                    model=tier.model,
+                    max_tokens=self.context_window.reserve_tokens,
+                    timeout=timeout,
+                    stream=True,
+                )
+                async for chunk in stream:
+                    delta = try_get(chunk, "choices", 0, "delta", "content")
+                    if not delta:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        metrics.observe("completion.ttft_sec", first_token_at - started_at, bot_type=self.bot_type)
+                    chunks.append(delta)
+                    if on_delta:
+                        await on_delta(delta)
+            except APITimeoutError as timeout_error:
+                error_bot.log(log_name, f"id={self.id} timeout={timeout} error={timeout_error}")
+                raise AbbotException(f"Chat completion timed out after {timeout}s: id={self.id}")
+            admission.used_tokens = self.calculate_tokens("".join(chunks))
+        metrics.observe("completion.stream_sec", time.perf_counter() - started_at, bot_type=self.bot_type)
+        model_router.observe_latency(tier, time.perf_counter() - started_at)
+        answer = "".join(chunks)
+        input_tokens = self.context_window.prompt_tokens
+        output_tokens = self.calculate_tokens(answer)
+        total_tokens = input_tokens + output_tokens
+        debug_bot.log(log_name, f"id={self.id} input_tokens={input_tokens} output_tokens={output_tokens}")
+        if not answer:
+            error_bot.log(log_name, f"stream_chat_completion => answer={answer}")
+        self.update_history(new_history_entry("assistant", answer))
+        semantic_cache.store(self.cache_scope, self.cache_question, answer)
+        return answer, input_tokens, output_tokens, total_tokens
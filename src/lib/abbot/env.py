@@ -7,11 +7,13 @@ env: dict = dotenv_values()
 
 BOT_TELEGRAM_TOKEN: str = try_get(env, "BOT_TELEGRAM_TOKEN")
 TEST_BOT_TELEGRAM_HANDLE: Optional[str] = try_get(env, "TEST_BOT_TELEGRAM_TOKEN")
+BOT_TELEGRAM_WEBHOOK_SECRET: Optional[str] = try_get(env, "BOT_TELEGRAM_WEBHOOK_SECRET")
 
 BOT_NOSTR_SK: str = try_get(env, "BOT_NOSTR_SK")
 
 PAYMENT_PROCESSOR_KIND: str = try_get(env, "PAYMENT_PROCESSOR_KIND")
 PAYMENT_PROCESSOR_TOKEN: str = try_get(env, "PAYMENT_PROCESSOR_TOKEN")
+PAYMENT_WEBHOOK_SECRET: Optional[str] = try_get(env, "PAYMENT_WEBHOOK_SECRET")
 
 PRICE_PROVIDER_KIND: str = try_get(env, "PRICE_PROVIDER_KIND", default=PAYMENT_PROCESSOR_KIND)
 
@@ -19,6 +21,7 @@ LNBITS_BASE_URL: Optional[str] = try_get(env, "LNBITS_BASE_URL")
 
 OPENAI_API_KEY: str = try_get(env, "OPENAI_API_KEY")
 OPENAI_ORG_ID: str = try_get(env, "OPENAI_ORG_ID")
+OPENAI_BASE_URL: Optional[str] = try_get(env, "OPENAI_BASE_URL") or None
 
 VECTOR_DATABASE_KIND: Optional[str] = try_get(env, "VECTOR_DATABASE_KIND")
 VECTOR_DATABASE_API_KEY: Optional[str] = try_get(env, "VECTOR_DATABASE_API_KEY")
@@ -21,6 +21,21 @@ class AbbotException(Exception):
         self.custom_stack = custom_stack
 
 
+class CompletionShedError(AbbotException):
+    def __init__(self, priority_class: str, queue_depth: int):
+        super().__init__(f"Completion shed: priority_class={priority_class} queue_depth={queue_depth}")
+        self.priority_class = priority_class
+        self.queue_depth = queue_depth
+
+
+class PartialAppendError(AbbotException):
+    def __init__(self, bot_type: str, unwritten: list, documents: dict, cause: Exception):
+        super().__init__(f"Append failed: bot_type={bot_type} unwritten={unwritten} cause={cause}")
+        self.bot_type = bot_type
+        self.unwritten = unwritten
+        self.documents = documents
+
+
 def try_except(fn):
     log_name = f"{FILE_NAME}: try_except"
 
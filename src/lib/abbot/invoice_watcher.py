@@ -0,0 +1,250 @@
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from telegram import Message
+from telegram.ext import ContextTypes
+
+from ..logger import debug_bot, error_bot
+from ..metrics import metrics
+from ..payments import PaymentProcessor
+from ..abbot.config import (
+    BOT_INVOICES_CHECK_BACKOFF,
+    BOT_INVOICES_MAX_CHECK_INTERVAL_SEC,
+    BOT_INVOICES_MIN_CHECK_INTERVAL_SEC,
+)
+
+FILE_NAME = __name__
+
+
+class PendingInvoice:
+    def __init__(
+        self,
+        chat_id: int,
+        chat_title: str,
+        invoice_id: str,
+        sats: int,
+        expiration_in_sec: float,
+        message: Optional[Message],
+        context: ContextTypes.DEFAULT_TYPE,
+        description: str = "",
+        correlation_id: Optional[str] = None,
+    ):
+        self.chat_id: int = chat_id
+        self.chat_title: str = chat_title
+        self.invoice_id: str = invoice_id
+        self.sats: int = sats
+        self.message: Optional[Message] = message
+        self.context: ContextTypes.DEFAULT_TYPE = context
+        self.description: str = description
+        self.correlation_id: Optional[str] = correlation_id
+        self.watched_at: float = time.monotonic()
+        self.expires_at: float = self.watched_at + expiration_in_sec
+        # wall clock, for the persisted record
+        self.expires_at_ts: float = time.time() + expiration_in_sec
+        self.next_check_at: float = self.watched_at
+        self.interval_sec: float = 0.0
+
+    def to_dict(self):
+        return dict(chat_id=self.chat_id, invoice_id=self.invoice_id, sats=self.sats, interval_sec=self.interval_sec)
+
+    def to_record(self) -> Dict:
+        """
+        What outlives a restart: enough to check, credit or expire the invoice without the /fund message
+        """
+        return dict(
+            invoice_id=self.invoice_id,
+            correlation_id=self.correlation_id,
+            chat_id=self.chat_id,
+            chat_title=self.chat_title,
+            sats=self.sats,
+            description=self.description,
+            expires_at=self.expires_at_ts,
+        )
+
+    @classmethod
+    def from_record(cls, record: Dict, context: ContextTypes.DEFAULT_TYPE) -> "PendingInvoice":
+        """
+        An invoice persisted before a restart; it has no message to reply to, and one already past its expiry is
+        checked once more before it is expired
+        """
+        return cls(
+            record["chat_id"],
+            record.get("chat_title", ""),
+            record["invoice_id"],
+            record["sats"],
+            max(0.0, record["expires_at"] - time.time()),
+            None,
+            context,
+            record.get("description", ""),
+            correlation_id=record.get("correlation_id"),
+        )
+
+
+InvoiceCallback = Callable[[PendingInvoice], Awaitable]
+
+
+class InvoiceWatcher:
+    """
+    Settles open invoices from one background task instead of a polling loop per /fund. Each pass checks every
+    invoice due within min_interval_sec in one batch (PaymentProcessor.invoices_paid), then pushes each unpaid
+    invoice's next check out from min_interval_sec by backoff up to max_interval_sec, never past its expiry. A
+    newly watched invoice wakes the task. Paid invoices go to on_paid; one still unpaid at its expiry goes to
+    on_expired. The task exits when nothing is left to watch. With payment webhooks the intervals are long and
+    polling is only a fallback: settle_webhook credits an invoice as soon as its webhook arrives
+    """
+
+    def __init__(
+        self,
+        processor: PaymentProcessor,
+        min_interval_sec: float = BOT_INVOICES_MIN_CHECK_INTERVAL_SEC,
+        max_interval_sec: float = BOT_INVOICES_MAX_CHECK_INTERVAL_SEC,
+        backoff: float = BOT_INVOICES_CHECK_BACKOFF,
+    ):
+        self.processor: PaymentProcessor = processor
+        self.min_interval_sec: float = min_interval_sec
+        self.max_interval_sec: float = max_interval_sec
+        self.backoff: float = backoff
+        self.invoices: Dict[str, PendingInvoice] = dict()
+        self.callbacks: Dict[str, Tuple[InvoiceCallback, InvoiceCallback]] = dict()
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def to_dict(self):
+        return dict(watching=[invoice.to_dict() for invoice in self.invoices.values()], running=self.running())
+
+    def running(self) -> bool:
+        return bool(self.task and not self.task.done())
+
+    def watching(self, chat_id: int) -> bool:
+        return any(invoice.chat_id == chat_id for invoice in self.invoices.values())
+
+    def watch(self, invoice: PendingInvoice, on_paid: InvoiceCallback, on_expired: InvoiceCallback):
+        self.invoices[invoice.invoice_id] = invoice
+        self.callbacks[invoice.invoice_id] = (on_paid, on_expired)
+        metrics.gauge("invoices.watching", len(self.invoices))
+        self.wake.set()
+        if not self.running():
+            self.task = asyncio.create_task(self.run())
+
+    def forget(self, invoice_id: str) -> Optional[PendingInvoice]:
+        self.callbacks.pop(invoice_id, None)
+        invoice: Optional[PendingInvoice] = self.invoices.pop(invoice_id, None)
+        metrics.gauge("invoices.watching", len(self.invoices))
+        return invoice
+
+    def find(self, invoice_id: Optional[str] = None, correlation_id: Optional[str] = None) -> Optional[PendingInvoice]:
+        if invoice_id in self.invoices:
+            return self.invoices[invoice_id]
+        if correlation_id is None:
+            return None
+        return next((i for i in self.invoices.values() if i.correlation_id == correlation_id), None)
+
+    async def settle_webhook(
+        self,
+        invoice_id: Optional[str],
+        correlation_id: Optional[str] = None,
+        confirmed: bool = True,
+    ) -> bool:
+        """
+        Settles the invoice a payment webhook reported paid. Unless the webhook itself carried the paid state
+        (confirmed), the processor is asked first. A correlation_id, when given, must be the matched invoice's.
+        False when the invoice is unknown, unpaid or already settled; raises when crediting it failed
+        """
+        log_name: str = f"{FILE_NAME}: InvoiceWatcher.settle_webhook"
+        invoice: Optional[PendingInvoice] = self.find(invoice_id, correlation_id)
+        if not invoice:
+            debug_bot.log(log_name, f"Not watching invoice_id={invoice_id} correlation_id={correlation_id}")
+            return False
+        if correlation_id is not None and invoice.correlation_id != correlation_id:
+            mismatch = f"invoice_id={invoice.invoice_id} correlation_id={invoice.correlation_id} != {correlation_id}"
+            error_bot.log(log_name, f"Webhook for another invoice: {mismatch}")
+            return False
+        if not confirmed and not await self.processor.invoice_is_paid(invoice.invoice_id):
+            return False
+        if invoice.invoice_id not in self.callbacks:
+            return False
+        metrics.incr("invoices.paid", source="webhook")
+        metrics.observe("invoices.settle_sec", time.monotonic() - invoice.watched_at)
+        await self.settle(invoice, paid=True)
+        return True
+
+    def due(self, now: float) -> List[PendingInvoice]:
+        return [invoice for invoice in self.invoices.values() if invoice.next_check_at <= now + self.min_interval_sec]
+
+    def reschedule(self, invoice: PendingInvoice, now: float):
+        interval_sec = invoice.interval_sec * self.backoff if invoice.interval_sec else self.min_interval_sec
+        invoice.interval_sec = min(self.max_interval_sec, interval_sec)
+        invoice.next_check_at = min(now + invoice.interval_sec, invoice.expires_at)
+
+    async def run(self):
+        log_name: str = f"{FILE_NAME}: InvoiceWatcher.run"
+        debug_bot.log(log_name, f"Watching {len(self.invoices)} invoices")
+        while self.invoices:
+            self.wake.clear()
+            due: List[PendingInvoice] = self.due(time.monotonic())
+            try:
+                await self.check(due)
+            except Exception as exception:
+                error_bot.log(log_name, f"exception={exception}")
+                for invoice in due:
+                    self.reschedule(invoice, time.monotonic())
+            if not self.invoices:
+                break
+            next_check_at: float = min(invoice.next_check_at for invoice in self.invoices.values())
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=max(0.0, next_check_at - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+        debug_bot.log(log_name, "No open invoices, watcher idle")
+
+    async def check(self, due: List[PendingInvoice]):
+        if not due:
+            return
+        metrics.incr("invoices.checks")
+        metrics.observe("invoices.batch_size", len(due))
+        paid_ids: Set[str] = await self.processor.invoices_paid(invoice.invoice_id for invoice in due)
+        now = time.monotonic()
+        for invoice in due:
+            if invoice.invoice_id not in self.callbacks:
+                continue
+            try:
+                if invoice.invoice_id in paid_ids:
+                    metrics.incr("invoices.paid", source="poll")
+                    metrics.observe("invoices.settle_sec", now - invoice.watched_at)
+                    await self.settle(invoice, paid=True)
+                elif now >= invoice.expires_at:
+                    metrics.incr("invoices.expired")
+                    await self.settle(invoice, paid=False)
+                else:
+                    self.reschedule(invoice, now)
+            except Exception:
+                # settle logged it and is watching the invoice again; the rest of the batch still settles
+                pass
+
+    async def settle(self, invoice: PendingInvoice, paid: bool):
+        """
+        Runs the paid or expired callback and stops watching the invoice once it succeeded. While it runs the
+        invoice has no callbacks, so a webhook or poll arriving meanwhile leaves it alone. A failed callback puts
+        the invoice back to be checked again and raises, so a webhook is answered 500 and redelivered
+        """
+        log_name: str = f"{FILE_NAME}: InvoiceWatcher.settle"
+        on_paid, on_expired = self.callbacks.pop(invoice.invoice_id)
+        callback: InvoiceCallback = on_paid if paid else on_expired
+        try:
+            await callback(invoice)
+        except Exception as exception:
+            error_bot.log(log_name, f"invoice_id={invoice.invoice_id} paid={paid} exception={exception}")
+            self.reschedule(invoice, time.monotonic())
+            self.watch(invoice, on_paid, on_expired)
+            raise
+        self.forget(invoice.invoice_id)
+
+    async def stop(self):
+        if self.running():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
@@ -0,0 +1,182 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+from ..logger import debug_bot
+from ..metrics import metrics
+from ..abbot.config import BOT_LIMITER_MAX_IN_FLIGHT, BOT_LIMITER_MAX_QUEUE_DEPTH, BOT_LIMITER_TOKENS_PER_MINUTE
+from ..abbot.exceptions.exception import CompletionShedError
+
+FILE_NAME = __name__
+
+# lower runs first
+PRIORITY_CLASSES: Dict[str, int] = {
+    "dm": 0,
+    "mention": 1,
+    "reply": 1,
+    "start": 1,
+    "unleashed": 2,
+    "summary": 3,
+}
+
+
+class TokenBucket:
+    """
+    Tokens-per-minute bucket refilled continuously. Admission takes the prompt tokens up front and the
+    completion tokens are charged afterwards, so the level can go negative and delay whatever is next
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity: float = float(tokens_per_minute)
+        self.rate_per_sec: float = tokens_per_minute / 60.0
+        self.level: float = self.capacity
+        self.updated_at: float = time.monotonic()
+
+    def to_dict(self):
+        return dict(capacity=self.capacity, level=self.refill())
+
+    def refill(self) -> float:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate_per_sec)
+        self.updated_at = now
+        return self.level
+
+    def wait_sec(self, tokens: int) -> float:
+        needed = min(float(tokens), self.capacity) - self.refill()
+        return max(0.0, needed / self.rate_per_sec)
+
+    def charge(self, tokens: int):
+        self.refill()
+        self.level -= tokens
+
+
+class Admission:
+    def __init__(self, priority_class: str, tokens: int, future: asyncio.Future):
+        self.priority_class: str = priority_class
+        self.priority: int = PRIORITY_CLASSES.get(priority_class, max(PRIORITY_CLASSES.values()))
+        self.tokens: int = tokens
+        self.future: asyncio.Future = future
+        self.used_tokens: int = 0
+        self.enqueued_at: float = time.perf_counter()
+
+    def to_dict(self):
+        return dict(priority_class=self.priority_class, tokens=self.tokens, enqueued_at=self.enqueued_at)
+
+
+class AdmissionController:
+    """
+    Gates every LLM call behind a max-in-flight limit and a tokens-per-minute bucket. Waiting calls are
+    admitted by priority class (dm before mention/reply before unleashed before summary), FIFO within a
+    class. When the queue is full the lowest priority, newest waiter is shed with CompletionShedError
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = BOT_LIMITER_MAX_IN_FLIGHT,
+        tokens_per_minute: int = BOT_LIMITER_TOKENS_PER_MINUTE,
+        max_queue_depth: int = BOT_LIMITER_MAX_QUEUE_DEPTH,
+    ):
+        self.max_in_flight: int = max_in_flight
+        self.max_queue_depth: int = max_queue_depth
+        self.bucket: TokenBucket = TokenBucket(tokens_per_minute)
+        self.in_flight: int = 0
+        self.queue: List = []
+        self.sequence = itertools.count()
+        self.refill_timer: Optional[asyncio.TimerHandle] = None
+
+    def to_dict(self):
+        return dict(in_flight=self.in_flight, queue_depth=self.queue_depth(), bucket=self.bucket.to_dict())
+
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, admission in self.queue if not admission.future.done())
+
+    def record_gauges(self):
+        metrics.gauge("limiter.in_flight", self.in_flight)
+        metrics.gauge("limiter.queue_depth", self.queue_depth())
+
+    def shed(self, incoming: Admission) -> Optional[Admission]:
+        """
+        Makes room for incoming in a full queue; returns whichever admission lost, possibly incoming itself
+        """
+        waiting = [entry for entry in self.queue if not entry[2].future.done()]
+        if len(waiting) < self.max_queue_depth:
+            return None
+        worst = max(waiting, key=lambda entry: (entry[0], entry[1]))
+        if worst[0] <= incoming.priority:
+            return incoming
+        worst[2].future.set_exception(CompletionShedError(worst[2].priority_class, len(waiting)))
+        return worst[2]
+
+    def dispatch(self):
+        self.refill_timer = None
+        while self.queue and self.in_flight < self.max_in_flight:
+            _, _, admission = self.queue[0]
+            if admission.future.done():
+                heapq.heappop(self.queue)
+                continue
+            wait_sec = self.bucket.wait_sec(admission.tokens)
+            if wait_sec > 0:
+                self.refill_timer = asyncio.get_running_loop().call_later(wait_sec, self.dispatch)
+                break
+            heapq.heappop(self.queue)
+            self.grant(admission)
+        self.record_gauges()
+
+    def grant(self, admission: Admission):
+        self.in_flight += 1
+        self.bucket.charge(admission.tokens)
+        wait_sec = time.perf_counter() - admission.enqueued_at
+        metrics.observe("limiter.queue_wait_sec", wait_sec, priority_class=admission.priority_class)
+        if not admission.future.done():
+            admission.future.set_result(True)
+
+    async def acquire(self, priority_class: str, tokens: int) -> Admission:
+        log_name: str = f"{FILE_NAME}: AdmissionController.acquire"
+        admission = Admission(priority_class, tokens, asyncio.get_running_loop().create_future())
+        if not self.queue and self.in_flight < self.max_in_flight and not self.bucket.wait_sec(tokens):
+            self.grant(admission)
+            self.record_gauges()
+            return admission
+        shed: Optional[Admission] = self.shed(admission)
+        if shed:
+            metrics.incr("limiter.shed", priority_class=shed.priority_class)
+            debug_bot.log(log_name, f"shed priority_class={shed.priority_class} queue_depth={self.queue_depth()}")
+            if shed is admission:
+                raise CompletionShedError(priority_class, self.queue_depth())
+        heapq.heappush(self.queue, (admission.priority, next(self.sequence), admission))
+        self.record_gauges()
+        if not self.refill_timer:
+            self.dispatch()
+        try:
+            await admission.future
+        except asyncio.CancelledError:
+            granted = admission.future.done() and not admission.future.cancelled()
+            if granted and admission.future.exception() is None:
+                self.release(admission)
+            raise
+        return admission
+
+    def release(self, admission: Admission, used_tokens: int = 0):
+        self.in_flight -= 1
+        if used_tokens:
+            self.bucket.charge(used_tokens)
+        if not self.refill_timer:
+            self.dispatch()
+        self.record_gauges()
+
+    @asynccontextmanager
+    async def admit(self, priority_class: str, tokens: int) -> AsyncIterator[Admission]:
+        """
+        Holds an in-flight slot for the body; set admission.used_tokens to charge the completion tokens on exit
+        """
+        admission: Admission = await self.acquire(priority_class, tokens)
+        try:
+            yield admission
+        finally:
+            self.release(admission, admission.used_tokens)
+
+
+admission_controller = AdmissionController()
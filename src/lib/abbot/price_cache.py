@@ -0,0 +1,95 @@
+import time
+import asyncio
+from typing import Dict, Optional
+
+from ..logger import debug_bot, error_bot
+from ..metrics import metrics
+from ..utils import try_get
+from ..db.async_mongo import async_mongo_abbot
+from ..payments import Provider
+from ..abbot.config import BOT_PRICE_CACHE_TTL_SEC, BOT_PRICE_MAX_AGE_SEC, BOT_PRICE_MAX_STALE_SEC
+
+FILE_NAME = __name__
+
+
+class PriceCache:
+    """
+    Latest BTCUSD price: from memory for ttl_sec, then the newest stored price while it is younger than
+    max_age_sec, then a live fetch from the provider (which stores it). Only one lookup past memory runs at a
+    time. When the live fetch fails a stored price up to max_stale_sec old is served; past that there is none
+    """
+
+    def __init__(
+        self,
+        provider: Provider,
+        ttl_sec: float = BOT_PRICE_CACHE_TTL_SEC,
+        max_age_sec: float = BOT_PRICE_MAX_AGE_SEC,
+        max_stale_sec: float = BOT_PRICE_MAX_STALE_SEC,
+    ):
+        self.provider: Provider = provider
+        self.ttl_sec: float = ttl_sec
+        self.max_age_sec: float = max_age_sec
+        self.max_stale_sec: float = max_stale_sec
+        self.price: Optional[Dict] = None
+        self.cached_at: float = 0.0
+        self.lock = asyncio.Lock()
+
+    def to_dict(self):
+        return dict(price=self.price, cached_at=self.cached_at, ttl_sec=self.ttl_sec, max_age_sec=self.max_age_sec)
+
+    def age_sec(self, price: Optional[Dict]) -> float:
+        """
+        Seconds since the price was fetched; stored prices use the fetch time in epoch seconds as _id
+        """
+        return time.time() - try_get(price, "_id", default=0)
+
+    def cached(self) -> Optional[Dict]:
+        if self.price and time.monotonic() - self.cached_at < self.ttl_sec:
+            metrics.incr("price.lookups", source="memory")
+            return self.price
+        return None
+
+    def remember(self, price: Dict, source: str) -> Dict:
+        self.price = price
+        self.cached_at = time.monotonic()
+        metrics.incr("price.lookups", source=source)
+        return price
+
+    async def fetch_live(self) -> Optional[Dict]:
+        log_name: str = f"{FILE_NAME}: PriceCache.fetch_live"
+        try:
+            response: Dict = await self.provider.get_bitcoin_price()
+        except Exception as exception:
+            error_bot.log(log_name, f"exception={exception}")
+            return None
+        price: Optional[Dict] = try_get(response, "data")
+        if try_get(price, "amount") is None:
+            error_bot.log(log_name, f"response={response}")
+            return None
+        return price
+
+    async def latest(self) -> Optional[Dict]:
+        log_name: str = f"{FILE_NAME}: PriceCache.latest"
+        price: Optional[Dict] = self.cached()
+        if price:
+            return price
+        async with self.lock:
+            price = self.cached()
+            if price:
+                return price
+            stored: Optional[Dict] = await async_mongo_abbot.find_latest_price()
+            stored_age_sec: float = self.age_sec(stored)
+            if try_get(stored, "amount") is not None and stored_age_sec < self.max_age_sec:
+                return self.remember(stored, "db")
+            live: Optional[Dict] = await self.fetch_live()
+            if live:
+                return self.remember(live, "live")
+            if try_get(stored, "amount") is not None and stored_age_sec < self.max_stale_sec:
+                debug_bot.log(log_name, f"live fetch failed, serving stale price age_sec={int(stored_age_sec)}")
+                return self.remember(stored, "stale")
+            metrics.incr("price.lookups", source="none")
+            return None
+
+    async def amount(self) -> Optional[float]:
+        amount = try_get(await self.latest(), "amount")
+        return None if amount is None else float(amount)
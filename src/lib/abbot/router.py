@@ -0,0 +1,139 @@
+from typing import Dict, List, Optional
+
+from constants import OPENAI_MODEL
+from ..logger import debug_bot
+from ..metrics import metrics
+from ..utils import try_get
+from ..abbot.config import (
+    BOT_CONTEXT_BUDGET_TOKENS,
+    BOT_ROUTING_ECONOMY_HANDLERS,
+    BOT_ROUTING_LATENCY_BUDGET_SEC,
+    BOT_ROUTING_LATENCY_EWMA_ALPHA,
+    BOT_ROUTING_LOW_BALANCE_SATS,
+    BOT_ROUTING_SHORT_MESSAGE_CHARS,
+    ORG_DEFAULT_TIER,
+    ORG_ECONOMY_TIER,
+    ORG_INPUT_TOKEN_COST,
+    ORG_MODEL_TIERS,
+    ORG_OUTPUT_TOKEN_COST,
+    ORG_PER_TOKEN_COST_DIV,
+    ORG_TOKEN_COST_MULT,
+)
+
+FILE_NAME = __name__
+
+
+class ModelTier:
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        input_token_cost: float,
+        output_token_cost: float,
+        context_tokens: int = BOT_CONTEXT_BUDGET_TOKENS,
+    ):
+        self.name: str = name
+        self.model: str = model
+        self.input_token_cost: float = input_token_cost
+        self.output_token_cost: float = output_token_cost
+        self.context_tokens: int = context_tokens
+
+    def to_dict(self):
+        return vars(self)
+
+    def budget_tokens(self) -> int:
+        """
+        Prompt plus answer tokens a completion on this tier may use: bot.context.budget_tokens, capped by the
+        model's context window
+        """
+        return min(BOT_CONTEXT_BUDGET_TOKENS, self.context_tokens)
+
+    def cost_usd(self, input_tokens: int, output_tokens: int) -> float:
+        cost_input_tokens = (input_tokens / ORG_PER_TOKEN_COST_DIV) * (self.input_token_cost * ORG_TOKEN_COST_MULT)
+        cost_output_tokens = (output_tokens / ORG_PER_TOKEN_COST_DIV) * (self.output_token_cost * ORG_TOKEN_COST_MULT)
+        return cost_input_tokens + cost_output_tokens
+
+
+def load_tiers(tiers_config: Optional[Dict]) -> Dict[str, ModelTier]:
+    """
+    Tiers from org.business_model.tiers; without any, one tier with the flat business_model prices and OPENAI_MODEL
+    """
+    if not tiers_config:
+        return {"default": ModelTier("default", OPENAI_MODEL, ORG_INPUT_TOKEN_COST, ORG_OUTPUT_TOKEN_COST)}
+    return {
+        name: ModelTier(
+            name,
+            try_get(tier, "model", default=OPENAI_MODEL),
+            try_get(tier, "input_token_cost", default=ORG_INPUT_TOKEN_COST),
+            try_get(tier, "output_token_cost", default=ORG_OUTPUT_TOKEN_COST),
+            try_get(tier, "context_tokens", default=BOT_CONTEXT_BUDGET_TOKENS),
+        )
+        for name, tier in tiers_config.items()
+    }
+
+
+class ModelRouter:
+    """
+    Picks a model tier per completion from the handler type, message length, remaining balance and the
+    default tier's recent latency (an EWMA of completion durations). Anything that doesn't trip a rule
+    goes to the default tier. While the default tier is over its latency budget its EWMA decays on every
+    diverted request, so it gets probed again once the decay brings it back under budget
+    """
+
+    def __init__(
+        self,
+        tiers: Dict[str, ModelTier] = load_tiers(ORG_MODEL_TIERS),
+        default_tier: Optional[str] = ORG_DEFAULT_TIER,
+        economy_tier: Optional[str] = ORG_ECONOMY_TIER,
+        economy_handlers: List[str] = BOT_ROUTING_ECONOMY_HANDLERS,
+        short_message_chars: int = BOT_ROUTING_SHORT_MESSAGE_CHARS,
+        low_balance_sats: int = BOT_ROUTING_LOW_BALANCE_SATS,
+        latency_budget_sec: float = BOT_ROUTING_LATENCY_BUDGET_SEC,
+        latency_ewma_alpha: float = BOT_ROUTING_LATENCY_EWMA_ALPHA,
+    ):
+        self.tiers: Dict[str, ModelTier] = tiers
+        first_tier: str = next(iter(tiers))
+        self.default_tier: str = default_tier if default_tier in tiers else first_tier
+        self.economy_tier: str = economy_tier if economy_tier in tiers else self.default_tier
+        self.economy_handlers: List[str] = economy_handlers
+        self.short_message_chars: int = short_message_chars
+        self.low_balance_sats: int = low_balance_sats
+        self.latency_budget_sec: float = latency_budget_sec
+        self.latency_ewma_alpha: float = latency_ewma_alpha
+        self.latency_sec: Dict[str, float] = dict()
+
+    def to_dict(self):
+        return dict(default_tier=self.default_tier, economy_tier=self.economy_tier, latency_sec=self.latency_sec)
+
+    def tier(self, name: Optional[str] = None) -> ModelTier:
+        return self.tiers.get(name) or self.tiers[self.default_tier]
+
+    def economy_reason(self, handler: str, message_text: Optional[str], balance: Optional[int]) -> Optional[str]:
+        if handler in self.economy_handlers:
+            return "handler"
+        if balance is not None and balance < self.low_balance_sats:
+            return "balance"
+        if message_text and len(message_text) <= self.short_message_chars:
+            return "short"
+        if self.latency_sec.get(self.default_tier, 0.0) > self.latency_budget_sec:
+            return "latency"
+        return None
+
+    def route(self, handler: str, message_text: Optional[str] = None, balance: Optional[int] = None) -> ModelTier:
+        log_name: str = f"{FILE_NAME}: ModelRouter.route"
+        reason: Optional[str] = self.economy_reason(handler, message_text, balance)
+        tier: ModelTier = self.tier(self.economy_tier if reason else self.default_tier)
+        if reason == "latency":
+            self.latency_sec[self.default_tier] *= 1 - self.latency_ewma_alpha
+        metrics.incr("router.routed", tier=tier.name, handler=handler)
+        debug_bot.log(log_name, f"handler={handler} balance={balance} reason={reason} tier={tier.name}")
+        return tier
+
+    def observe_latency(self, tier: ModelTier, seconds: float):
+        previous: Optional[float] = self.latency_sec.get(tier.name)
+        alpha = self.latency_ewma_alpha
+        self.latency_sec[tier.name] = seconds if previous is None else alpha * seconds + (1 - alpha) * previous
+        metrics.observe("router.latency_sec", seconds, tier=tier.name)
+
+
+model_router = ModelRouter()
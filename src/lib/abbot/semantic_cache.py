@@ -0,0 +1,139 @@
+import re
+import time
+import zlib
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from ..logger import debug_bot
+from ..metrics import metric_key, metrics
+from ..abbot.config import (
+    BOT_SEMANTIC_CACHE_ENABLED,
+    BOT_SEMANTIC_CACHE_MAX_ENTRIES,
+    BOT_SEMANTIC_CACHE_MIN_CHARS,
+    BOT_SEMANTIC_CACHE_THRESHOLD,
+    BOT_SEMANTIC_CACHE_TTL_SEC,
+)
+
+FILE_NAME = __name__
+EMBEDDING_DIMENSIONS: int = 512
+SAID_PREFIX = re.compile(r"^\S+ said: ", re.IGNORECASE)
+WORD = re.compile(r"[a-z0-9']+")
+# an answer in a DM may carry what that user told the bot, so it is never replayed to anyone else
+PRIVATE_SCOPES = {"dm"}
+
+
+def cache_question(content: Optional[str]) -> Optional[str]:
+    """
+    The user text of a history entry without the "@username said: " prefix handlers add in groups
+    """
+    if not content:
+        return None
+    return SAID_PREFIX.sub("", content, count=1).strip()
+
+
+def embed_text(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> np.ndarray:
+    """
+    Local feature-hashing embedding over words and character trigrams; no network and well under a millisecond
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    words: List[str] = WORD.findall(text.lower())
+    features: List[str] = [*words, *[f"{a} {b}" for a, b in zip(words, words[1:])]]
+    for word in words:
+        padded = f"#{word}#"
+        features.extend(padded[i : i + 3] for i in range(len(padded) - 2))
+    for feature in features:
+        digest = zlib.crc32(feature.encode())
+        vector[digest % dimensions] += 1.0 if digest & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class CachedAnswer:
+    def __init__(self, question: str, answer: str, vector: np.ndarray):
+        self.question: str = question
+        self.answer: str = answer
+        self.vector: np.ndarray = vector
+        self.created_at: float = time.monotonic()
+
+    def to_dict(self):
+        return dict(question=self.question, answer=self.answer, created_at=self.created_at)
+
+
+class SemanticCache:
+    """
+    Per system prompt scope (group, blixt) answer cache keyed by question similarity, with TTL and LRU eviction.
+    Entries are shared by every chat in a scope, so an answer given in one group is replayed in any other group
+    asking a similar question. DMs are never cached
+    """
+
+    def __init__(
+        self,
+        enabled: bool = BOT_SEMANTIC_CACHE_ENABLED,
+        threshold: float = BOT_SEMANTIC_CACHE_THRESHOLD,
+        ttl_sec: float = BOT_SEMANTIC_CACHE_TTL_SEC,
+        max_entries: int = BOT_SEMANTIC_CACHE_MAX_ENTRIES,
+        min_chars: int = BOT_SEMANTIC_CACHE_MIN_CHARS,
+    ):
+        self.enabled: bool = enabled
+        self.threshold: float = threshold
+        self.ttl_sec: float = ttl_sec
+        self.max_entries: int = max_entries
+        self.min_chars: int = min_chars
+        self.scopes: Dict[str, OrderedDict[str, CachedAnswer]] = dict()
+
+    def to_dict(self):
+        return dict(enabled=self.enabled, threshold=self.threshold, sizes={k: len(v) for k, v in self.scopes.items()})
+
+    def cacheable(self, scope: str, question: Optional[str]) -> bool:
+        if not self.enabled or scope in PRIVATE_SCOPES:
+            return False
+        return bool(question) and len(question) >= self.min_chars
+
+    def expire(self, scope: str):
+        entries = self.scopes.get(scope, OrderedDict())
+        now = time.monotonic()
+        for key in [key for key, entry in entries.items() if now - entry.created_at > self.ttl_sec]:
+            del entries[key]
+            metrics.incr("semantic_cache.expired", scope=scope)
+
+    def lookup(self, scope: str, question: Optional[str]) -> Optional[str]:
+        log_name: str = f"{FILE_NAME}: SemanticCache.lookup"
+        if not self.cacheable(scope, question):
+            return None
+        started_at = time.perf_counter()
+        self.expire(scope)
+        entries = self.scopes.get(scope)
+        if not entries:
+            metrics.incr("semantic_cache.misses", scope=scope)
+            return None
+        keys = list(entries.keys())
+        similarities = np.stack([entries[key].vector for key in keys]) @ embed_text(question)
+        best = int(np.argmax(similarities))
+        metrics.observe("semantic_cache.lookup_sec", time.perf_counter() - started_at)
+        if similarities[best] < self.threshold:
+            metrics.incr("semantic_cache.misses", scope=scope)
+            return None
+        entries.move_to_end(keys[best])
+        metrics.incr("semantic_cache.hits", scope=scope)
+        debug_bot.log(log_name, f"scope={scope} similarity={similarities[best]:.3f} question={question}")
+        return entries[keys[best]].answer
+
+    def store(self, scope: str, question: Optional[str], answer: Optional[str]):
+        if not self.cacheable(scope, question) or not answer:
+            return
+        entries = self.scopes.setdefault(scope, OrderedDict())
+        key = question.lower()
+        entries.pop(key, None)
+        entries[key] = CachedAnswer(question, answer, embed_text(question))
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            metrics.incr("semantic_cache.evicted", scope=scope)
+
+    def hit_rate(self, scope: str) -> float:
+        hits = metrics.counters.get(metric_key("semantic_cache.hits", scope=scope), 0)
+        misses = metrics.counters.get(metric_key("semantic_cache.misses", scope=scope), 0)
+        return hits / (hits + misses) if hits + misses else 0.0
+
+
+semantic_cache = SemanticCache()
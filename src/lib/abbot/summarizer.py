@@ -0,0 +1,148 @@
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from openai.types.chat import ChatCompletion
+
+from constants import OPENAI_MODEL
+from ..logger import debug_bot, error_bot
+from ..metrics import metrics
+from ..utils import error, success, try_get
+from ..db.cache import group_cache
+from ..db.async_mongo import async_mongo_abbot
+from ..abbot.core import Abbot
+from ..abbot.limiter import admission_controller
+from ..abbot.context import count_content_tokens, entry_tokens, history_tokens
+from ..abbot.config import BOT_SUMMARY_KEEP_RECENT_TOKENS, BOT_SUMMARY_MAX_TOKENS, BOT_SUMMARY_THRESHOLD_TOKENS
+
+FILE_NAME = __name__
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a Telegram conversation for a chat assistant. "
+    "Fold the new messages into the existing summary. Keep names, handles, questions still open, "
+    "decisions, facts people shared about themselves and anything the assistant promised. "
+    "Drop greetings and small talk. Reply with the updated summary only."
+)
+
+
+class Summarizer:
+    """
+    Folds turns that aged out of the recent window into a running summary stored on the group or dm document.
+    summary.through is the sequence number of the first history entry not folded yet, so each pass only
+    summarizes the new span
+    """
+
+    def __init__(
+        self,
+        threshold_tokens: int = BOT_SUMMARY_THRESHOLD_TOKENS,
+        keep_recent_tokens: int = BOT_SUMMARY_KEEP_RECENT_TOKENS,
+        max_summary_tokens: int = BOT_SUMMARY_MAX_TOKENS,
+    ):
+        self.threshold_tokens: int = threshold_tokens
+        self.keep_recent_tokens: int = keep_recent_tokens
+        self.max_summary_tokens: int = max_summary_tokens
+        # the event loop only holds weak references to tasks, so a running compaction is kept here
+        self.tasks: Dict[Tuple[str, int], asyncio.Task] = dict()
+
+    def to_dict(self):
+        return dict(
+            threshold_tokens=self.threshold_tokens,
+            keep_recent_tokens=self.keep_recent_tokens,
+            max_summary_tokens=self.max_summary_tokens,
+            running=list(self.tasks),
+        )
+
+    def needs_compaction(self, document: Optional[Dict]) -> bool:
+        tokens: int = try_get(document, "tokens", default=0) or 0
+        summarized_tokens: int = try_get(document, "summary", "through_tokens", default=0) or 0
+        return tokens - summarized_tokens >= self.threshold_tokens
+
+    def schedule(self, bot_type: str, chat_id: int, document: Optional[Dict]) -> Optional[asyncio.Task]:
+        """
+        Starts a background compaction when the unsummarized history passed the threshold; never blocks the reply
+        """
+        key = (bot_type, chat_id)
+        if key in self.tasks or not self.needs_compaction(document):
+            return None
+        task = asyncio.create_task(self.compact(bot_type, chat_id))
+        self.tasks[key] = task
+        task.add_done_callback(lambda _: self.tasks.pop(key, None))
+        return task
+
+    def aged_out_cutoff(self, window: List[Dict], offset: int, through: int) -> int:
+        recent_tokens = 0
+        for index in range(len(window) - 1, max(0, through - offset) - 1, -1):
+            recent_tokens += entry_tokens(window[index])
+            if recent_tokens >= self.keep_recent_tokens:
+                return offset + index
+        return max(through, offset)
+
+    async def history_span(
+        self, bot_type: str, chat_id: int, window: List[Dict], offset: int, through: int, cutoff: int
+    ) -> List[Dict]:
+        """
+        Entries through..cutoff from the document's recent window, or from the history buckets when the span
+        starts before the window
+        """
+        if through >= offset:
+            return window[through - offset : cutoff - offset]
+        return await async_mongo_abbot.find_history_range(bot_type, chat_id, through, cutoff)
+
+    async def summarize(self, summary_content: Optional[str], span: List[Dict]) -> str:
+        transcript = "\n".join(f"{try_get(entry, 'role')}: {try_get(entry, 'content')}" for entry in span)
+        prompt = f"Existing summary:\n{summary_content or '(none)'}\n\nNew messages:\n{transcript}"
+        async with admission_controller.admit("summary", count_content_tokens(prompt)) as admission:
+            response: ChatCompletion = await Abbot.async_client.chat.completions.create(
+                messages=[{"role": "system", "content": SUMMARY_INSTRUCTIONS}, {"role": "user", "content": prompt}],
+                model=OPENAI_MODEL,
+                max_tokens=self.max_summary_tokens,
+            )
+            admission.used_tokens = try_get(response, "usage", "completion_tokens", default=0) or 0
+        metrics.incr("summary.prompt_tokens", try_get(response, "usage", "prompt_tokens", default=0) or 0)
+        return try_get(response, "choices", 0, "message", "content")
+
+    async def compact(self, bot_type: str, chat_id: int) -> Dict:
+        log_name: str = f"{FILE_NAME}: Summarizer.compact"
+        try:
+            chat_id_filter = {"id": chat_id}
+            fields: List[str] = ["history", "history_count", "summary"]
+            if bot_type == "dm":
+                document: Optional[Dict] = await async_mongo_abbot.find_one_dm(chat_id_filter, fields)
+            else:
+                document: Optional[Dict] = await group_cache.find_one_group(chat_id_filter, fields)
+            window: List[Dict] = try_get(document, "history", default=[])
+            offset: int = async_mongo_abbot.history_offset(document)
+            summary: Dict = try_get(document, "summary", default={}) or {}
+            through: int = try_get(summary, "through", default=0)
+            cutoff: int = self.aged_out_cutoff(window, offset, through)
+            history: List[Dict] = await self.history_span(bot_type, chat_id, window, offset, through, cutoff)
+            span: List[Dict] = [entry for entry in history if try_get(entry, "role") != "system"]
+            if not span:
+                return success("Nothing to compact", through=through)
+            content: Optional[str] = await self.summarize(try_get(summary, "content"), span)
+            if not content:
+                error_bot.log(log_name, f"bot_type={bot_type} chat_id={chat_id} empty summary")
+                return error("Empty summary", through=through)
+            through_tokens: int = try_get(summary, "through_tokens", default=0) or 0
+            through_tokens += history_tokens(history)
+            new_summary = {
+                "content": content,
+                "tokens": count_content_tokens(content),
+                "through": cutoff,
+                "through_tokens": through_tokens,
+                "updated_at": datetime.now().isoformat(),
+            }
+            if bot_type == "dm":
+                await async_mongo_abbot.update_one_dm(chat_id_filter, {"$set": {"summary": new_summary}}, upsert=False)
+            else:
+                await group_cache.update_one_group(chat_id_filter, {"$set": {"summary": new_summary}}, upsert=False)
+            metrics.incr("summary.compactions", bot_type=bot_type)
+            metrics.observe("summary.folded_entries", len(span))
+            debug_bot.log(log_name, f"bot_type={bot_type} chat_id={chat_id} through={through}->{cutoff}")
+            return success("Compacted", through=cutoff)
+        except Exception as exception:
+            error_bot.log(log_name, f"bot_type={bot_type} chat_id={chat_id} exception={exception}")
+            return error("Compaction failed", data=exception)
+
+
+summarizer = Summarizer()
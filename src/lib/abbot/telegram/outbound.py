@@ -0,0 +1,258 @@
+import time
+import heapq
+import asyncio
+import itertools
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Coroutine, Dict, Iterable, List, Optional, Tuple
+
+from telegram import Bot
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from constants import ABBOT_SQUAWKS, THE_ARCHITECT_ID
+
+from lib.utils import try_get
+from lib.logger import debug_bot, error_bot
+from lib.metrics import metrics
+from lib.abbot.config import (
+    BOT_OUTBOUND_CHAT_BURST,
+    BOT_OUTBOUND_GLOBAL_PER_SEC,
+    BOT_OUTBOUND_GROUP_PER_MIN,
+    BOT_OUTBOUND_MAX_CHATS,
+    BOT_OUTBOUND_MAX_RETRIES,
+    BOT_OUTBOUND_PRIVATE_PER_SEC,
+    BOT_OUTBOUND_SQUAWK_MERGE_SEC,
+)
+
+FILE_NAME = __name__
+
+# lower goes first
+PRIORITY_REPLY: int = 0
+PRIORITY_EDIT: int = 1
+PRIORITY_SQUAWK: int = 2
+PRIORITY_NAMES: Dict[int, str] = {PRIORITY_REPLY: "reply", PRIORITY_EDIT: "edit", PRIORITY_SQUAWK: "squawk"}
+
+# Bot API methods that put a message in a chat and count against its send limits
+LIMITED_ENDPOINT_PREFIXES: Tuple[str, ...] = ("send", "edit", "copy", "forward")
+THROTTLED_SEC: float = 0.05
+SQUAWK_SEPARATOR = "\n\n---\n\n"
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate_per_sec: float = rate_per_sec
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.updated_at: float = time.monotonic()
+        self.paused_until: float = 0.0
+
+    def to_dict(self):
+        return dict(tokens=self.tokens, rate_per_sec=self.rate_per_sec, paused_until=self.paused_until)
+
+    def wait_sec(self, now: float) -> float:
+        """
+        Seconds until a token can be taken: none while one is left, else until the next refill or the end of
+        a retry-after pause, whichever is later
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_sec)
+        self.updated_at = now
+        refill_sec: float = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate_per_sec
+        return max(refill_sec, self.paused_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class ChatLane:
+    def __init__(self, bucket: TokenBucket):
+        self.bucket: TokenBucket = bucket
+        self.lock = asyncio.Lock()
+
+
+class OutboundRateLimiter(BaseRateLimiter[Dict]):
+    """
+    Paces every message the bot sends through Telegram's limits, for PTB's ApplicationBuilder.rate_limiter:
+    a token bucket per chat (group_per_min in groups, private_per_sec in DMs, both bursting to chat_burst) and
+    one global bucket (global_per_sec). A send waits for its chat, in order, then for a global token, which goes
+    to the highest priority waiting: user replies, then edits, then squawks. A 429 pauses that chat for its
+    retry_after and the send is retried up to max_retries times. Other Bot API calls pass straight through.
+    rate_limit_args may override priority and max_retries per call
+    """
+
+    def __init__(
+        self,
+        global_per_sec: float = BOT_OUTBOUND_GLOBAL_PER_SEC,
+        group_per_min: float = BOT_OUTBOUND_GROUP_PER_MIN,
+        private_per_sec: float = BOT_OUTBOUND_PRIVATE_PER_SEC,
+        chat_burst: float = BOT_OUTBOUND_CHAT_BURST,
+        max_retries: int = BOT_OUTBOUND_MAX_RETRIES,
+        max_chats: int = BOT_OUTBOUND_MAX_CHATS,
+        squawk_chat_ids: Iterable[int] = (ABBOT_SQUAWKS, THE_ARCHITECT_ID),
+    ):
+        # no burst globally: any one second then carries at most global_per_sec sends
+        self.global_bucket = TokenBucket(global_per_sec, 1)
+        self.group_per_sec: float = group_per_min / 60
+        self.private_per_sec: float = private_per_sec
+        self.chat_burst: float = chat_burst
+        self.max_retries: int = max_retries
+        self.max_chats: int = max_chats
+        self.squawk_chat_ids = set(squawk_chat_ids)
+        self.lanes: OrderedDict[int, ChatLane] = OrderedDict()
+        self.waiting: List[Tuple[int, int]] = []
+        self.sequence = itertools.count()
+        self.changed = asyncio.Condition()
+
+    def to_dict(self):
+        return dict(chats=len(self.lanes), waiting=len(self.waiting), global_bucket=self.global_bucket.to_dict())
+
+    async def initialize(self) -> None:
+        log_name: str = f"{FILE_NAME}: OutboundRateLimiter.initialize"
+        debug_bot.log(log_name, f"{self.to_dict()}")
+
+    async def shutdown(self) -> None:
+        log_name: str = f"{FILE_NAME}: OutboundRateLimiter.shutdown"
+        debug_bot.log(log_name, f"{self.to_dict()}")
+
+    def lane(self, chat_id: int) -> ChatLane:
+        """
+        The chat's bucket and send order; the least recently used chat is dropped past max_chats, which at
+        worst hands it a full bucket again
+        """
+        lane: Optional[ChatLane] = self.lanes.get(chat_id)
+        if lane:
+            self.lanes.move_to_end(chat_id)
+            return lane
+        rate_per_sec: float = self.private_per_sec if chat_id > 0 else self.group_per_sec
+        lane = self.lanes[chat_id] = ChatLane(TokenBucket(rate_per_sec, self.chat_burst))
+        if len(self.lanes) > self.max_chats:
+            self.lanes.popitem(last=False)
+        return lane
+
+    def priority(self, endpoint: str, chat_id: int, rate_limit_args: Optional[Dict]) -> int:
+        if try_get(rate_limit_args, "priority") is not None:
+            return rate_limit_args["priority"]
+        if chat_id in self.squawk_chat_ids:
+            return PRIORITY_SQUAWK
+        if endpoint.startswith("edit"):
+            return PRIORITY_EDIT
+        return PRIORITY_REPLY
+
+    async def acquire(self, lane: ChatLane, priority: int):
+        async with lane.lock:
+            while (wait_sec := lane.bucket.wait_sec(time.monotonic())) > 0:
+                await asyncio.sleep(wait_sec)
+            lane.bucket.take()
+        ticket: Tuple[int, int] = (priority, next(self.sequence))
+        async with self.changed:
+            heapq.heappush(self.waiting, ticket)
+            metrics.gauge("outbound.queue_depth", len(self.waiting))
+            try:
+                while True:
+                    wait_sec: float = self.global_bucket.wait_sec(time.monotonic())
+                    is_next: bool = self.waiting[0] == ticket
+                    if is_next and wait_sec <= 0:
+                        self.global_bucket.take()
+                        return
+                    try:
+                        await asyncio.wait_for(self.changed.wait(), timeout=wait_sec if is_next else None)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                metrics.gauge("outbound.queue_depth", len(self.waiting))
+                self.changed.notify_all()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict],
+    ) -> Any:
+        log_name: str = f"{FILE_NAME}: OutboundRateLimiter.process_request"
+        chat_id = try_get(data, "chat_id")
+        if not isinstance(chat_id, int) or not endpoint.startswith(LIMITED_ENDPOINT_PREFIXES):
+            return await callback(*args, **kwargs)
+        lane: ChatLane = self.lane(chat_id)
+        priority: int = self.priority(endpoint, chat_id, rate_limit_args)
+        priority_name: str = PRIORITY_NAMES.get(priority, "custom")
+        max_retries: int = try_get(rate_limit_args, "max_retries", default=self.max_retries)
+        attempt: int = 0
+        while True:
+            enqueued_at = time.monotonic()
+            await self.acquire(lane, priority)
+            started_at = time.monotonic()
+            metrics.observe("outbound.wait_sec", started_at - enqueued_at, priority=priority_name)
+            if started_at - enqueued_at > THROTTLED_SEC:
+                metrics.incr("outbound.throttled", priority=priority_name)
+            try:
+                result = await callback(*args, **kwargs)
+                metrics.observe("outbound.send_sec", time.monotonic() - started_at, priority=priority_name)
+                metrics.incr("outbound.sent", priority=priority_name)
+                return result
+            except RetryAfter as retry_after:
+                metrics.incr("outbound.retry_after", priority=priority_name)
+                lane.bucket.pause(retry_after.retry_after)
+                debug_bot.log(log_name, f"{endpoint} chat_id={chat_id} retry_after={retry_after.retry_after}")
+                if attempt >= max_retries:
+                    raise
+                attempt += 1
+
+
+def merge_squawks(squawks: List[str]) -> str:
+    """
+    One message for squawks queued together: repeats are counted instead of resent, and the result is cut to
+    Telegram's message length
+    """
+    counts: Counter = Counter(squawks)
+    merged: List[str] = [squawk if counts[squawk] == 1 else f"{squawk}\n\n(x{counts[squawk]})" for squawk in counts]
+    text: str = SQUAWK_SEPARATOR.join(merged)
+    if len(text) <= MessageLimit.MAX_TEXT_LENGTH:
+        return text
+    return f"{text[: MessageLimit.MAX_TEXT_LENGTH - 4]} ..."
+
+
+class SquawkMerger:
+    """
+    Sends a chat's squawks at most once every interval_sec. A squawk to a quiet chat goes out right away; those
+    arriving while it is sent and for interval_sec after are merged into the next message, so an error storm
+    costs one send per interval instead of one per error
+    """
+
+    def __init__(self, interval_sec: float = BOT_OUTBOUND_SQUAWK_MERGE_SEC):
+        self.interval_sec: float = interval_sec
+        self.pending: Dict[int, List[str]] = dict()
+        self.workers: Dict[int, asyncio.Task] = dict()
+
+    def to_dict(self):
+        return dict(interval_sec=self.interval_sec, pending={k: len(v) for k, v in self.pending.items()})
+
+    def submit(self, bot: Bot, chat_id: int, text: str):
+        self.pending.setdefault(chat_id, []).append(text)
+        worker: Optional[asyncio.Task] = self.workers.get(chat_id)
+        if worker and not worker.done():
+            metrics.incr("outbound.squawks_merged")
+            return
+        self.workers[chat_id] = asyncio.create_task(self.drain(bot, chat_id))
+
+    async def drain(self, bot: Bot, chat_id: int):
+        log_name: str = f"{FILE_NAME}: SquawkMerger.drain"
+        try:
+            while self.pending.get(chat_id):
+                squawks: List[str] = self.pending.pop(chat_id)
+                await bot.send_message(chat_id=chat_id, text=merge_squawks(squawks))
+                await asyncio.sleep(self.interval_sec)
+        except Exception as exception:
+            error_bot.log(log_name, f"chat_id={chat_id} exception={exception}")
+        finally:
+            self.workers.pop(chat_id, None)
+
+
+squawk_merger = SquawkMerger()
@@ -0,0 +1,123 @@
+import time
+import asyncio
+from typing import Any, Awaitable, Dict, Hashable, Optional
+
+from telegram.ext import BaseUpdateProcessor
+
+from lib.logger import debug_bot
+from lib.metrics import metrics
+from lib.abbot.config import BOT_TELEGRAM_MAX_PENDING_UPDATES, BOT_TELEGRAM_UPDATE_WORKERS
+
+FILE_NAME = __name__
+
+
+def update_key(update: object) -> Optional[Hashable]:
+    """
+    What an update is serialized on: its chat, else its user; None (no ordering) for anything else
+    """
+    chat_id: Optional[int] = getattr(getattr(update, "effective_chat", None), "id", None)
+    if chat_id is not None:
+        return ("chat", chat_id)
+    user_id: Optional[int] = getattr(getattr(update, "effective_user", None), "id", None)
+    if user_id is not None:
+        return ("user", user_id)
+    return None
+
+
+class ChatQueue:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth: int = 0
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Handles updates from different chats concurrently, at most workers at a time, while updates from the same
+    chat run one after another in the order they arrived, so a chat's history is never written out of order.
+    PTB's own limit (max_pending) only bounds how many updates are waiting; a chat's queue is its lock, whose
+    waiters are woken first in, first out. Emits chats queued, per-chat queue depth, queue wait and handler
+    latency
+    """
+
+    def __init__(
+        self,
+        workers: int = BOT_TELEGRAM_UPDATE_WORKERS,
+        max_pending: int = BOT_TELEGRAM_MAX_PENDING_UPDATES,
+    ):
+        super().__init__(max_concurrent_updates=max_pending)
+        self.workers: int = workers
+        self.worker_slots = asyncio.Semaphore(workers)
+        self.queues: Dict[Hashable, ChatQueue] = dict()
+        self.in_flight: int = 0
+        self.pending: int = 0
+
+    def to_dict(self):
+        return dict(
+            workers=self.workers, pending=self.pending, in_flight=self.in_flight, chats_waiting=len(self.queues)
+        )
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """
+        Counts every update handed over and not yet handled, including those still waiting on max_pending:
+        PTB starts a task per update as soon as it is fetched, so its update queue stays near empty and this
+        is the backlog to shed load on
+        """
+        self.pending += 1
+        metrics.gauge("updates.pending", self.pending)
+        try:
+            await super().process_update(update, coroutine)
+        finally:
+            self.pending -= 1
+            metrics.gauge("updates.pending", self.pending)
+
+    def queue_depth(self, key: Hashable) -> int:
+        queue: Optional[ChatQueue] = self.queues.get(key)
+        return queue.depth if queue else 0
+
+    def report_depth(self, depth: int):
+        """
+        One gauge for how many chats have updates queued, not one per chat: chats come and go and their gauges
+        would never be dropped. Per-chat depth goes into a single observation window
+        """
+        metrics.gauge("updates.chats_queued", len(self.queues))
+        metrics.observe("updates.chat_queue_depth", depth)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key: Optional[Hashable] = update_key(update)
+        enqueued_at = time.perf_counter()
+        if key is None:
+            async with self.worker_slots:
+                return await self.run(update, coroutine, enqueued_at)
+        queue: ChatQueue = self.queues.setdefault(key, ChatQueue())
+        queue.depth += 1
+        self.report_depth(queue.depth)
+        try:
+            async with queue.lock:
+                async with self.worker_slots:
+                    await self.run(update, coroutine, enqueued_at)
+        finally:
+            queue.depth -= 1
+            if not queue.depth:
+                self.queues.pop(key, None)
+            self.report_depth(queue.depth)
+
+    async def run(self, update: object, coroutine: Awaitable[Any], enqueued_at: float):
+        started_at = time.perf_counter()
+        metrics.observe("updates.queue_wait_sec", started_at - enqueued_at)
+        self.in_flight += 1
+        metrics.gauge("updates.in_flight", self.in_flight)
+        try:
+            await coroutine
+        finally:
+            self.in_flight -= 1
+            metrics.gauge("updates.in_flight", self.in_flight)
+            metrics.observe("updates.handler_sec", time.perf_counter() - started_at)
+            metrics.incr("updates.processed")
+
+    async def initialize(self) -> None:
+        log_name: str = f"{FILE_NAME}: ChatOrderedUpdateProcessor.initialize"
+        debug_bot.log(log_name, f"workers={self.workers} max_pending={self.max_concurrent_updates}")
+
+    async def shutdown(self) -> None:
+        log_name: str = f"{FILE_NAME}: ChatOrderedUpdateProcessor.shutdown"
+        debug_bot.log(log_name, f"{self.to_dict()}")
@@ -0,0 +1,108 @@
+import time
+from typing import Dict, Optional
+
+from telegram import Message
+from telegram.constants import ChatAction
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.ext import ContextTypes
+
+from lib.logger import debug_bot, error_bot
+from lib.abbot.config import BOT_STREAM_EDIT_INTERVAL_SEC
+from lib.abbot.utils import has_markdown, sanitize_md_v2
+
+FILE_NAME = __name__
+PLACEHOLDER_TEXT = "🤖 ..."
+# a rate limited edit is skipped rather than retried; the next one carries the newer text
+NO_RETRIES = dict(max_retries=0)
+
+
+class StreamedReply:
+    """
+    Renders a streamed completion as one placeholder reply that is edited in throttled chunks.
+    Telegram rate limits edits per chat, so at most one edit is sent every edit_interval_sec.
+    Answers containing markdown stop the progressive edits and are sent once with reply_markdown_v2.
+    The placeholder is deleted whenever it does not end up holding the answer, see abandon
+    """
+
+    def __init__(
+        self,
+        message: Message,
+        context: ContextTypes.DEFAULT_TYPE,
+        edit_interval_sec: float = BOT_STREAM_EDIT_INTERVAL_SEC,
+    ):
+        self.message: Message = message
+        self.context: ContextTypes.DEFAULT_TYPE = context
+        self.edit_interval_sec: float = edit_interval_sec
+        self.placeholder: Optional[Message] = None
+        self.text: str = ""
+        self.rendered_text: str = PLACEHOLDER_TEXT
+        self.markdown: bool = False
+        self.next_edit_at: float = 0.0
+        self.delivered: bool = False
+
+    async def start(self) -> Message:
+        await self.context.bot.send_chat_action(chat_id=self.message.chat_id, action=ChatAction.TYPING)
+        self.placeholder = await self.message.reply_text(PLACEHOLDER_TEXT, disable_web_page_preview=True)
+        self.next_edit_at = time.monotonic() + self.edit_interval_sec
+        return self.placeholder
+
+    async def on_delta(self, delta: str):
+        self.text += delta
+        if self.markdown or has_markdown(self.text):
+            self.markdown = True
+            return
+        if time.monotonic() < self.next_edit_at:
+            return
+        await self.edit(f"{self.text} ...")
+
+    async def edit(self, text: str, final: bool = False) -> bool:
+        """
+        Progressive edits give up on a rate limit; the final one is retried by the rate limiter like any reply
+        """
+        log_name: str = f"{FILE_NAME}: StreamedReply.edit"
+        if not self.placeholder or text == self.rendered_text:
+            return False
+        rate_limit_args: Optional[Dict] = None if final else NO_RETRIES
+        try:
+            await self.placeholder.edit_text(text, disable_web_page_preview=True, rate_limit_args=rate_limit_args)
+            self.rendered_text = text
+            self.next_edit_at = time.monotonic() + self.edit_interval_sec
+            return True
+        except RetryAfter as retry_after:
+            debug_bot.log(log_name, f"retry_after={retry_after.retry_after}")
+            self.next_edit_at = time.monotonic() + retry_after.retry_after
+        except BadRequest as bad_request:
+            error_bot.log(log_name, f"chat_id={self.message.chat_id} bad_request={bad_request}")
+        return False
+
+    async def finish(self, answer: str) -> Optional[Message]:
+        """
+        Puts answer in the placeholder, or sends it as a new reply and deletes the placeholder when that fails
+        or answer needs markdown. An empty answer, which Telegram would reject, only deletes the placeholder
+        """
+        if not answer or not answer.strip():
+            await self.abandon()
+            return None
+        if not self.markdown and not has_markdown(answer):
+            if self.rendered_text == answer or await self.edit(answer, final=True):
+                self.delivered = True
+                return self.placeholder
+            await self.abandon()
+            return await self.message.reply_text(answer, disable_web_page_preview=True)
+        await self.abandon()
+        return await self.message.reply_markdown_v2(sanitize_md_v2(answer), disable_web_page_preview=True)
+
+    async def abandon(self):
+        """
+        Deletes the placeholder, so a failed completion or billing step does not leave "🤖 ..." in the chat.
+        A no-op once finish has put the answer in the placeholder
+        """
+        log_name: str = f"{FILE_NAME}: StreamedReply.abandon"
+        placeholder: Optional[Message] = self.placeholder
+        if not placeholder or self.delivered:
+            return
+        self.placeholder = None
+        try:
+            await placeholder.delete()
+        except TelegramError as telegram_error:
+            error_bot.log(log_name, f"chat_id={self.message.chat_id} telegram_error={telegram_error}")
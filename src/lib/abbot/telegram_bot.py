@@ -1,6 +1,6 @@
 # core
 import json
-import time
+import asyncio
 import uuid
 import tiktoken
 import traceback
@@ -12,7 +12,15 @@ from typing import Any, Dict, List, Optional
 # packages
 from telegram.constants import MessageEntityType, ParseMode
 from telegram import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Update, Message, Chat, User
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler
+from telegram.ext import (
+    Application,
+    ApplicationBuilder,
+    CallbackContext,
+    ContextTypes,
+    CommandHandler,
+    MessageHandler,
+    CallbackQueryHandler,
+)
 from telegram.ext.filters import (
     ChatType,
     StatusUpdate,
@@ -52,17 +60,19 @@ from constants import (
 from ..abbot.config import (
     BOT_GROUP_CONFIG_DEFAULT,
     BOT_GROUP_CONFIG_STARTED,
+    BOT_LEDGER_STARTER_SATS,
     BOT_LIGHTNING_ADDRESS,
+    BOT_METRICS_LOG_INTERVAL_SEC,
     BOT_SYSTEM_OBJECT_GROUPS,
     BOT_NAME,
+    BOT_PAYMENT_WEBHOOKS_ENABLED,
+    BOT_PAYMENT_WEBHOOKS_FALLBACK_MAX_SEC,
+    BOT_PAYMENT_WEBHOOKS_FALLBACK_MIN_SEC,
     BOT_TELEGRAM_HANDLE,
     BOT_TELEGRAM_SUPPORT_CONTACT,
     BOT_TELEGRAM_USERNAME,
     BOT_SYSTEM_OBJECT_DMS,
-    ORG_INPUT_TOKEN_COST,
-    ORG_OUTPUT_TOKEN_COST,
-    ORG_PER_TOKEN_COST_DIV,
-    ORG_TOKEN_COST_MULT,
+    BOT_STREAM_COMPLETIONS,
 )
 
 MARKDOWN_V2 = ParseMode.MARKDOWN_V2
@@ -84,9 +94,19 @@ MEDIA = VIDEO | PHOTO | Document.ALL
 
 # local
 from ..logger import debug_bot, error_bot
+from ..metrics import metrics
 from ..utils import error, qr_code, try_get, successful
-from ..db.mongo import TelegramDM, TelegramGroup, mongo_abbot
+from ..db.mongo import CHAT_STATE_FIELDS, COUNTER_FIELDS, TelegramDM, TelegramGroup
+from ..db.async_mongo import async_mongo_abbot
+from ..db.cache import group_cache
+from ..db.buffer import write_buffer
 from ..abbot.core import Abbot
+from ..abbot.context import new_history_entry, with_tokens
+from ..abbot.summarizer import summarizer
+from ..abbot.price_cache import PriceCache
+from ..abbot.coalesce import PendingMention, coalescer
+from ..abbot.invoice_watcher import InvoiceWatcher, PendingInvoice
+from ..abbot.router import ModelTier, model_router
 from ..abbot.utils import (
     bot_squawk,
     bot_squawk_error,
@@ -100,13 +120,28 @@ from ..abbot.utils import (
     parse_update_data,
     to_int,
     get_chat_admins,
+    sanitize_md_v2,
 )
-from ..payments import Coinbase, CoinbasePrice, init_payment_processor, init_price_provider
+from ..payments import Coinbase, init_payment_processor, init_price_provider
 from ..abbot.exceptions.exception import AbbotException
 from ..abbot.telegram.filter_abbot_reply import FilterAbbotReply
+from ..abbot.telegram.streamed_reply import StreamedReply
+from ..abbot.telegram.scheduler import ChatOrderedUpdateProcessor
+from ..abbot.telegram.outbound import OutboundRateLimiter
+from ..api.payment_webhooks import PaymentWebhooks
 
 payment_processor = init_payment_processor()
 price_provider: Coinbase = init_price_provider()
+price_cache: PriceCache = PriceCache(price_provider)
+invoice_watcher: InvoiceWatcher = InvoiceWatcher(payment_processor)
+payment_webhooks: Optional[PaymentWebhooks] = None
+if BOT_PAYMENT_WEBHOOKS_ENABLED:
+    invoice_watcher = InvoiceWatcher(
+        payment_processor,
+        min_interval_sec=BOT_PAYMENT_WEBHOOKS_FALLBACK_MIN_SEC,
+        max_interval_sec=BOT_PAYMENT_WEBHOOKS_FALLBACK_MAX_SEC,
+    )
+    payment_webhooks = PaymentWebhooks(invoice_watcher.settle_webhook)
 
 encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
 
@@ -132,63 +167,44 @@ ERR_NO_SATS = f"No sats left 😢 Please run /fund to topup{DNL}*Examples*{NL}/f
 # ---------------------------------------------------------------------------------------
 
 
-async def get_live_price() -> int:
-    log_name: str = f"{FILE_NAME}: get_live_price"
-    response: Dict[CoinbasePrice] = await price_provider.get_bitcoin_price()
-    debug_bot.log(log_name, f"response={response}")
-    data = try_get(response, "data")
-    amount = try_get(data, "amount")
-    if not data or not amount:
-        error_message = try_get(response, "msg")
-        error_data = try_get(response, "data")
-        error_bot.log(log_name, f"response={response} error_message={error_message} error_data={error_data}")
-        return error(error_message, data=error_data)
-    debug_bot.log(log_name, f"data={data} \n amount={amount}")
-    return int(amount)
+async def btcusd_price() -> float:
+    btc_price_usd: Optional[float] = await price_cache.amount()
+    if not btc_price_usd:
+        raise AbbotException(f"No BTCUSD price within the last {price_cache.max_stale_sec} seconds")
+    return btc_price_usd
 
 
 async def usd_to_sat(usd_amount: int) -> int:
-    price_dict: Dict[CoinbasePrice] = mongo_abbot.find_prices()[-1]
-    btc_price_usd: int = try_get(price_dict, "amount")
-    if btc_price_usd:
-        if type(btc_price_usd) != int:
-            btc_price_usd: int = int(btc_price_usd)
-    else:
-        btc_price_usd: int = await get_live_price()
-    amount_calculation = int((usd_amount / int(btc_price_usd)) * SATOSHIS_PER_BTC)
+    btc_price_usd: int = int(await btcusd_price())
+    amount_calculation = int((usd_amount / btc_price_usd) * SATOSHIS_PER_BTC)
     return amount_calculation if amount_calculation > 0 else 0
 
 
 async def sat_to_usd(sats_amount: int) -> int:
-    price_dict: Dict[CoinbasePrice] = mongo_abbot.find_prices()[-1]
-    btc_price_usd: int = try_get(price_dict, "amount")
-    if btc_price_usd:
-        if type(btc_price_usd) != int:
-            btc_price_usd: int = int(btc_price_usd)
-    else:
-        btc_price_usd: int = await get_live_price()
-    amount_calculation = round(float((sats_amount / SATOSHIS_PER_BTC) * int(btc_price_usd)), 2)
+    btc_price_usd: int = int(await btcusd_price())
+    amount_calculation = round(float((sats_amount / SATOSHIS_PER_BTC) * btc_price_usd), 2)
     return amount_calculation if amount_calculation > 0 else 0
 
 
-async def calculate_completion_cost(input_tokens: int, output_tokens: int):
+async def grant_starter_sats(chat_id: int, group: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Credits a new group's free sats through the ledger (at most once per group); returns group with the new balance
+    """
+    credit: Optional[Dict] = await group_cache.credit_group(chat_id, BOT_LEDGER_STARTER_SATS, "starter", "starter")
+    if group is None or not credit:
+        return group
+    return {**group, "balance": credit["balance"]}
+
+
+async def calculate_completion_cost(input_tokens: int, output_tokens: int, tier: Optional[ModelTier] = None):
     try:
         log_name: str = f"{FILE_NAME}: calculate_completion_cost"
-        btcusd_doc = mongo_abbot.find_prices()[-1]
-        debug_bot.log(log_name, f"btcusd_doc={btcusd_doc}")
-        timestamp: int = try_get(btcusd_doc, "_id", default=0)
-        debug_bot.log(log_name, f"timestamp={timestamp}")
-        btcusd_price: float = try_get(btcusd_doc, "amount")
+        btcusd_price: Optional[float] = await price_cache.amount()
         debug_bot.log(log_name, f"btcusd_price={btcusd_price}")
-        now: int = int(time.time())
-        debug_bot.log(log_name, f"now={now}")
-        if btcusd_doc or now - timestamp >= 900:
-            debug_bot.log(log_name, f"now - timestamp={now - timestamp}")
-            btcusd_price: int = await get_live_price()
-        btcusd_price = float(btcusd_price)
-        cost_input_tokens = (input_tokens / ORG_PER_TOKEN_COST_DIV) * (ORG_INPUT_TOKEN_COST * ORG_TOKEN_COST_MULT)
-        cost_output_tokens = (output_tokens / ORG_PER_TOKEN_COST_DIV) * (ORG_OUTPUT_TOKEN_COST * ORG_TOKEN_COST_MULT)
-        total_token_cost_usd = cost_input_tokens + cost_output_tokens
+        if not btcusd_price:
+            return error("No BTCUSD price", max_stale_sec=price_cache.max_stale_sec)
+        tier: ModelTier = tier or model_router.tier()
+        total_token_cost_usd = tier.cost_usd(input_tokens, output_tokens)
         total_token_cost_sats = int((total_token_cost_usd / btcusd_price) * SATOSHIS_PER_BTC)
 
         return dict(status="success", cost_usd=total_token_cost_usd, cost_sats=total_token_cost_sats)
@@ -196,13 +212,6 @@ async def calculate_completion_cost(input_tokens: int, output_tokens: int):
         raise dict(status="error", data=abbot_exception)
 
 
-def sanitize_md_v2(text):
-    escape_chars = "_[]()~>#+-=|{}.!^@$%&;:?/<,"
-    return "".join(
-        "\\" + char if char in escape_chars else char for char in text if not (0xD800 <= ord(char) <= 0xDFFF)
-    )
-
-
 def get_balance_message(chat_title, sat_balance, usd_balance):
     group = f"💬 *{chat_title}* 💬"
     satoshis = f"⚖️ *Balance in Satoshis* {sat_balance} sats ⚡️"
@@ -252,7 +261,7 @@ async def handle_group_adds_abbot(update: Update, context: ContextTypes.DEFAULT_
             if BOT_TELEGRAM_HANDLE not in [username for username in new_chat_members]:
                 return debug_bot.log(log_name, "Abbot not added to group")
         chat_id_filter = {"id": chat_id}
-        default_history = [BOT_SYSTEM_OBJECT_GROUPS]
+        default_history = [with_tokens(BOT_SYSTEM_OBJECT_GROUPS)]
         token_count: int = calculate_tokens(default_history)
         group_update = {
             "$set": {
@@ -261,17 +270,17 @@ async def handle_group_adds_abbot(update: Update, context: ContextTypes.DEFAULT_
                 "type": chat_type,
                 "admins": admins,
                 "created_at": datetime.now().isoformat(),
-                "balance": 5000,
-                "messages": [],
-                "history": default_history,
                 "config": BOT_GROUP_CONFIG_DEFAULT,
                 "tokens": token_count,
             }
         }
-        group: TelegramGroup = mongo_abbot.group_does_exist(chat_id_filter)
+        group: TelegramGroup = await group_cache.group_does_exist(chat_id_filter)
         if group:
             group_update = {"$set": {"title": chat_title, "id": chat_id, "type": chat_type, "admins": admins}}
-        group: TelegramGroup = mongo_abbot.find_one_group_and_update(chat_id_filter, group_update)
+            default_history = []
+        await write_buffer.append_group(chat_id, group_update, history=default_history, fields=[])
+        if not group:
+            await grant_starter_sats(chat_id)
         squawk_msg = f"{THE_ARCHITECT_HANDLE} New group added Abbot!\n\ntitle={chat_title}\nchat_id={chat_id}"
         await bot_squawk(log_name, squawk_msg, context)
     except AbbotException as abbot_exception:
@@ -373,38 +382,37 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not username:
             username = user_id
             is_handle = False
-        intro_history_dict = {"role": "assistant", "content": INTRODUCTION}
-        new_history_dict = {"role": "user", "content": f"@{username} said: {message_text}"}
+        intro_history_dict = new_history_entry("assistant", INTRODUCTION)
+        new_history_dict = new_history_entry("user", f"@{username} said: {message_text}")
         if not username:
-            new_history_dict = {"role": "user", "content": f"someone said: {message_text}"}
+            new_history_dict = new_history_entry("user", f"someone said: {message_text}")
         elif not is_handle:
-            new_history_dict = {"role": "user", "content": f"{username} said: {message_text}"}
+            new_history_dict = new_history_entry("user", f"{username} said: {message_text}")
         if chat_type not in ("group", "supergroup", "channel"):
             return await message.reply_text(f"{BOT_START_COMMAND} is disabled in DMs. Feel free to chat at will!")
         chat_id_filter = {"id": chat_id}
         new_message_dict = message.to_dict()
-        group: TelegramGroup = mongo_abbot.find_one_group(chat_id_filter)
+        group: TelegramGroup = await write_buffer.find_one_group(chat_id_filter)
         if not group:
             debug_bot.log(log_name, f"no group found chat_id={chat_id} chat_title={chat_title}")
             await bot_squawk(log_name, f"no group found chat_id={chat_id} chat_title={chat_title}", context)
-            group: TelegramGroup = mongo_abbot.find_one_group_and_update(
-                chat_id_filter,
+            start_history = [with_tokens(BOT_SYSTEM_OBJECT_GROUPS), intro_history_dict, new_history_dict]
+            group: TelegramGroup = await write_buffer.append_group(
+                chat_id,
                 {
                     "$set": {
                         "created_at": datetime.now().isoformat(),
                         "title": chat_title,
                         "id": chat_id,
                         "type": chat_type,
-                        "balance": 5000,
-                        "messages": [new_message_dict],
-                        "history": [BOT_SYSTEM_OBJECT_GROUPS, intro_history_dict, new_history_dict],
+                        "tokens": calculate_tokens(start_history),
                         "config": BOT_GROUP_CONFIG_STARTED,
                     }
                 },
+                history=start_history,
+                messages=[new_message_dict],
             )
-
-        group_history: List = try_get(group, "history")
-        group_history = [*group_history, new_history_dict]
+            group: TelegramGroup = await grant_starter_sats(chat_id, group)
 
         group_config: Dict = try_get(group, "config")
         debug_bot.log(log_name, f"group_config={group_config}")
@@ -432,30 +440,31 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await bot_squawk(log_name, already_started, context)
             return await message.reply_markdown_v2(already_started, disable_web_page_preview=True)
         elif not introduced:
-            group: TelegramGroup = mongo_abbot.find_one_group_and_update(
-                chat_id_filter,
+            await write_buffer.append_group(
+                chat_id,
                 {
                     "$set": {
                         "title": chat_title,
                         "id": chat_id,
-                        "balance": group_balance,
                         "config.started": True,
                         "config.introduced": True,
                     },
-                    "$push": {
-                        "messages": new_message_dict,
-                        "history": new_history_dict,
-                    },
+                    "$inc": {"tokens": new_history_dict["tokens"]},
                 },
+                history=[new_history_dict],
+                messages=[new_message_dict],
+                fields=[],
             )
             await message.reply_photo(MATRIX_IMG_FILEPATH, f"Please wait while {BOT_NAME} is unplugged from the Matrix")
-            time.sleep(3)
+            await asyncio.sleep(3)
             return await message.reply_markdown_v2(INTRODUCTION, disable_web_page_preview=True)
 
-        abbot = Abbot(chat_id, "group", group_history)
-        answer, input_tokens, output_tokens, _ = abbot.chat_completion(chat_title)
+        abbot = Abbot.from_document(chat_id, "group", group)
+        abbot.update_history(new_history_dict)
+        tier: ModelTier = model_router.route("start", message_text, group_balance)
+        answer, input_tokens, output_tokens, _ = await abbot.async_chat_completion(chat_title, tier=tier)
 
-        response: Dict = await calculate_completion_cost(input_tokens, output_tokens)
+        response: Dict = await calculate_completion_cost(input_tokens, output_tokens, tier)
         if not successful(response):
             err_msg = f"{log_name}: calculate_completion_cost: not successful"
             bal_msg = f"group_balance={group_balance}"
@@ -465,34 +474,32 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await bot_squawk(log_name, squawk_msg, context)
 
         cost_sats: int = try_get(response, "cost_sats", default=500)
-        group_balance -= cost_sats
-        balance_is_below_zero = group_balance < 0
-        if balance_is_below_zero:
-            group_balance = 0
+        debit: Optional[Dict] = await group_cache.debit_group(chat_id, cost_sats, "completion")
+        group_balance = try_get(debit, "balance", default=0)
+        if group_balance <= 0:
             squawk_msg = f"Group balance: {group_balance}\n\chat_id={chat_id}\chat_title={chat_title}"
             answer = f"{answer}\n\n{WARN_GROUP_NOSATS}"
             debug_bot.log(log_name, squawk_msg)
             await bot_squawk(log_name, squawk_msg, context)
 
         debug_bot.log(log_name, f"group_balance={group_balance}")
-        group_history = abbot.get_history()
+        assistant_history_update = new_history_entry("assistant", answer)
 
-        group: TelegramGroup = mongo_abbot.find_one_group_and_update(
-            chat_id_filter,
+        group: TelegramGroup = await write_buffer.append_group(
+            chat_id,
             {
                 "$set": {
                     "title": chat_title,
                     "id": chat_id,
-                    "balance": group_balance,
-                    "tokens": abbot.history_tokens,
                     "config.started": True,
                 },
-                "$push": {
-                    "messages": new_message_dict,
-                    "history": new_history_dict,
-                },
+                "$inc": {"tokens": new_history_dict["tokens"] + assistant_history_update["tokens"]},
             },
+            history=[new_history_dict, assistant_history_update],
+            messages=[new_message_dict],
+            fields=CHAT_STATE_FIELDS,
         )
+        summarizer.schedule("group", chat_id, group)
         if "`" in answer or "**" in answer:
             return await message.reply_markdown_v2(sanitize_md_v2(answer), disable_web_page_preview=True)
         return await message.reply_text(answer, disable_web_page_preview=True)
@@ -522,10 +529,10 @@ async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user: User = try_get(update_data, "user")
         user_id, username, first_name = parse_user_data(user)
         username: str = username or first_name or user_id or "someone"
-        new_history_dict = {"role": "user", "content": f"@{username} said: {message_text}"}
+        new_history_dict = new_history_entry("user", f"@{username} said: {message_text}")
         debug_bot.log(log_name, f"user={user}")
 
-        group_exists: bool = mongo_abbot.group_does_exist(chat_id_filter)
+        group_exists: bool = await group_cache.group_does_exist(chat_id_filter)
         if not group_exists:
             squawk = f"Group does not exist"
             reply_msg = f"There is no group 🥄👀 Try running /start or contact {THE_ARCHITECT_HANDLE} for help."
@@ -534,19 +541,19 @@ async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await bot_squawk(log_name, abbot_squawk, context)
         debug_bot.log(log_name, f"group_exists={group_exists}")
 
-        group: TelegramGroup = mongo_abbot.find_one_group_and_update(
-            chat_id_filter,
+        group: TelegramGroup = await write_buffer.append_group(
+            chat_id,
             {
                 "$set": {
                     "title": chat_title,
                     "id": chat_id,
                     "config.started": False,
                 },
-                "$push": {
-                    "messages": new_message_dict,
-                    "history": new_history_dict,
-                },
+                "$inc": {"tokens": new_history_dict["tokens"]},
             },
+            history=[new_history_dict],
+            messages=[new_message_dict],
+            fields=["config"],
         )
         still_running: bool = try_get(group, "config", "started")
         if still_running:
@@ -579,14 +586,10 @@ async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return await message.reply_text("/balance is disabled in DMs. Feel free to chat at will!")
 
         chat_id_filter = {"id": chat_id}
-        group: TelegramGroup = mongo_abbot.find_one_group(chat_id_filter)
+        group: TelegramGroup = await write_buffer.find_one_group(chat_id_filter, ["balance"])
 
-        group_balance = try_get(group, "balance", default=0)
-        if group_balance and type(group_balance) == float:
-            group: TelegramGroup = mongo_abbot.find_one_dm_and_update(
-                chat_id_filter, {"$set": {"balance": int(group_balance)}}
-            )
-            group_balance = try_get(group, "balance", default=0)
+        # balances from before the ledger can be floats
+        group_balance = int(try_get(group, "balance", default=0) or 0)
         usd_balance = await sat_to_usd(group_balance)
         balance_message: str = sanitize_md_v2(get_balance_message(chat_title, group_balance, usd_balance))
         return await message.reply_markdown_v2(balance_message)
@@ -618,13 +621,13 @@ async def unleash(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not new_count or new_count <= 0:
             new_count: int = 5
         chat_id_filter = {"id": chat_id}
-        group: TelegramGroup = mongo_abbot.find_one_group(chat_id_filter)
+        group: TelegramGroup = await write_buffer.find_one_group(chat_id_filter, ["balance"])
         if not group:
             return await message.reply_text(f"{ERR_NO_GROUP} - Did you run /start{BOT_TELEGRAM_HANDLE}?")
         current_sats: int = try_get(group, "balance")
         if current_sats == 0:
             return await message.reply_text(ERR_NO_SATS)
-        group: TelegramGroup = mongo_abbot.find_one_group_and_update(
+        await group_cache.update_one_group(
             chat_id_filter, {"$set": {"config.unleashed": True, "config.count": new_count}}
         )
         await message.reply_text(f"Abbot has been unleashed to respond every {new_count} messages")
@@ -646,15 +649,13 @@ async def leash(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if chat_type == "private":
             return await message.reply_text("/leash is disabled in DMs. Feel free to chat at will!")
         chat_id_filter = {"id": chat_id}
-        group: TelegramGroup = mongo_abbot.find_one_group(chat_id_filter)
+        group: TelegramGroup = await write_buffer.find_one_group(chat_id_filter, ["config"])
         if not group:
             return await message.reply_text(f"{ERR_NO_GROUP} - Did you run /start{BOT_TELEGRAM_HANDLE}?")
-        group_config: Dict = mongo_abbot.get_group_config(chat_id_filter)
+        group_config: Dict = try_get(group, "config")
         unleashed: bool = try_get(group_config, "unleashed")
         if unleashed:
-            group: TelegramGroup = mongo_abbot.find_one_group_and_update(
-                chat_id_filter, {"$set": {"config.unleashed": False}}
-            )
+            await group_cache.update_one_group(chat_id_filter, {"$set": {"config.unleashed": False}})
         await message.reply_text(f"Abbot has been leashed to not respond on message count")
     except AbbotException as abbot_exception:
         await bot_squawk_error(log_name, abbot_exception, context)
@@ -676,7 +677,7 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if chat_type == "private":
             return await message.reply_text("/status is disabled in DMs. Feel free to chat at will!")
         chat_id_filter = {"id": chat_id}
-        group_config: Dict = mongo_abbot.get_group_config(chat_id_filter)
+        group_config: Dict = await group_cache.get_group_config(chat_id_filter)
         if not group_config:
             abbot_squawk = f"{log_name}: {ERR_NO_GROUP_CONF}:"
             error_msg = f"id={chat_id}, title={chat_title}, group_config={group_config}"
@@ -716,8 +717,9 @@ async def count(update: Update, context: ContextTypes.DEFAULT_TYPE):
         debug_bot.log(log_name, f"chat={chat}")
         chat_id, chat_title, chat_type = parse_group_chat_data(chat)
         chat_id_filter = {"id": chat_id}
-        group_history: Dict = mongo_abbot.get_group_history(chat_id_filter)
-        group_config: Dict = mongo_abbot.get_group_config(chat_id_filter)
+        group: TelegramGroup = await write_buffer.find_one_group(chat_id_filter, ["config"], history_window=1)
+        group_history: List[Dict] = try_get(group, "history", default=[])
+        group_config: Dict = try_get(group, "config")
         if not group_history or not group_config:
             abbot_squawk = f"{log_name}: {ERR_NO_GROUP_CONF}:"
             error_msg = f"id={chat_id}, title={chat_title}, group_history={group_history}"
@@ -727,7 +729,7 @@ async def count(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await bot_squawk(log_name, abbot_squawk, context)
             return await message.reply_text(reply_text_err)
         unleashed_count: int = try_get(group_config, "count", default=0)
-        history_count: int = len(group_history)
+        history_count: int = try_get(group, "history_count", default=0)
         counts_msg = f"🧛‍♀️ *Unleashed Count*: {unleashed_count}\n💬 *History Count*: {history_count}"
         remaining = unleashed_count - (history_count % unleashed_count)
         full_msg = sanitize_md_v2(f"{counts_msg}\n\n🤖 Abbot responds in {remaining}")
@@ -750,7 +752,7 @@ async def fund(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat: Chat = try_get(update_data, "chat")
         debug_bot.log(log_name, f"chat={chat}")
         chat_id, chat_title, chat_type = parse_group_chat_data(chat)
-        if payment_processor.CHAT_ID_INVOICE_ID_MAP.get(chat_id, None):
+        if invoice_watcher.watching(chat_id):
             return await message.reply_text("Active invoice already issued")
         chat_type: str = chat_type.capitalize()
         if chat_type == "Private":
@@ -821,35 +823,53 @@ async def fund(update: Update, context: ContextTypes.DEFAULT_TYPE):
         description = f"{description}\n{expires_msg}"
         await message.reply_photo(photo=qr_code(invoice), caption=sanitize_md_v2(description), parse_mode=MARKDOWN_V2)
         await message.reply_markdown_v2(f"`{invoice}`")
-        cancel_squawk = f"{ERR_INV_CANCEL}: description={description}, invoice_id={invoice_id}"
-        is_paid = False
-        while expiration_in_sec >= 0 and not is_paid:
-            debug_bot.log(log_name, f"expiration_in_sec={expiration_in_sec}")
-            is_paid = await payment_processor.invoice_is_paid(invoice_id)
-            debug_bot.log(log_name, f"is_paid={is_paid}")
-            expiration_in_sec -= 1
-            if expiration_in_sec == 0:
-                debug_bot.log(log_name, f"expiration_in_sec == 0, invoice_id={invoice_id}")
-                break
-            time.sleep(1)
-        if is_paid:
-            group: TelegramGroup = mongo_abbot.find_one_group_and_update(
-                {"id": chat_id}, {"$inc": {"balance": sats_balance}}
-            )
-            if not group:
-                error_bot.log(log_name, f"not group")
-                return await bot_squawk(log_name, group, context)
-            balance: int = try_get(group, "balance", default=amount)
-            await message.reply_text(f"Invoice Paid! ⚡️ {chat_title} balance: {balance} sats ⚡️")
-        else:
-            keyboard = [[InlineKeyboardButton("Yes", callback_data="1"), InlineKeyboardButton("No", callback_data="2")]]
-            await bot_squawk(log_name, cancel_squawk, context)
-            keyboard_markup = InlineKeyboardMarkup(keyboard)
-            await message.reply_text(f"Invoice expired! Try again?", reply_markup=keyboard_markup)
+        pending_invoice = PendingInvoice(
+            chat_id,
+            chat_title,
+            invoice_id,
+            int(sats_balance),
+            expiration_in_sec,
+            message,
+            context,
+            description,
+            correlation_id=cid,
+        )
+        await async_mongo_abbot.insert_one_invoice(pending_invoice.to_record())
+        invoice_watcher.watch(pending_invoice, credit_paid_invoice, offer_new_invoice)
     except AbbotException as abbot_exception:
         await bot_squawk_error(log_name, abbot_exception, context)
 
 
+async def credit_paid_invoice(invoice: PendingInvoice):
+    log_name: str = f"{FILE_NAME}: credit_paid_invoice"
+    chat_id, invoice_id = invoice.chat_id, invoice.invoice_id
+    payment_processor.CHAT_ID_INVOICE_ID_MAP.pop(chat_id, None)
+    credit: Optional[Dict] = await group_cache.credit_group(chat_id, invoice.sats, "fund", invoice_id)
+    await async_mongo_abbot.close_invoice(invoice_id, "paid")
+    if not credit:
+        not_credited = f"invoice_id={invoice_id} not credited: no group or already credited chat_id={chat_id}"
+        error_bot.log(log_name, not_credited)
+        return await bot_squawk(log_name, not_credited, invoice.context)
+    balance: int = try_get(credit, "balance", default=invoice.sats)
+    paid_msg = f"Invoice Paid! ⚡️ {invoice.chat_title} balance: {balance} sats ⚡️"
+    if not invoice.message:
+        return await invoice.context.bot.send_message(chat_id=chat_id, text=paid_msg)
+    await invoice.message.reply_text(paid_msg)
+
+
+async def offer_new_invoice(invoice: PendingInvoice):
+    log_name: str = f"{FILE_NAME}: offer_new_invoice"
+    cancel_squawk = f"{ERR_INV_CANCEL}: description={invoice.description}, invoice_id={invoice.invoice_id}"
+    keyboard = [[InlineKeyboardButton("Yes", callback_data="1"), InlineKeyboardButton("No", callback_data="2")]]
+    await async_mongo_abbot.close_invoice(invoice.invoice_id, "expired")
+    await bot_squawk(log_name, cancel_squawk, invoice.context)
+    # "Yes" re-runs /fund from the message it replies to, which an invoice restored after a restart no longer has
+    if not invoice.message:
+        return
+    keyboard_markup = InlineKeyboardMarkup(keyboard)
+    await invoice.message.reply_text(f"Invoice expired! Try again?", reply_markup=keyboard_markup)
+
+
 async def fund_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         log_name: str = f"{FILE_NAME}: fund_button"
@@ -882,6 +902,77 @@ async def fund_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await bot_squawk_error(log_name, abbot_exception, context)
 
 
+async def answer_group_mentions(chat_id: int, mentions: List[PendingMention]):
+    """
+    Answers every mention or reply the coalescer queued for chat_id with one completion, replying to the latest
+    """
+    latest: PendingMention = mentions[-1]
+    message: Message = latest.message
+    context: ContextTypes.DEFAULT_TYPE = latest.context
+    streamed_reply: Optional[StreamedReply] = None
+    try:
+        log_name: str = f"{FILE_NAME}: answer_group_mentions"
+        chat_title: str = try_get(message, "chat", "title")
+        chat_id_filter = {"id": chat_id}
+        # the mentions were logged when they arrived, so the buffered read already ends with them
+        group: TelegramGroup = await write_buffer.find_one_group(chat_id_filter)
+        group_balance: int = try_get(group, "balance", default=0)
+        abbot = Abbot.from_document(chat_id, "group", group)
+        message_text: str = " ".join(try_get(mention, "message", "text", default="") for mention in mentions)
+        tier: ModelTier = model_router.route("mention", message_text, group_balance)
+        if BOT_STREAM_COMPLETIONS:
+            streamed_reply = StreamedReply(message, context)
+            await streamed_reply.start()
+            answer, input_tokens, output_tokens, total_tokens = await abbot.stream_chat_completion(
+                chat_title, on_delta=streamed_reply.on_delta, tier=tier
+            )
+        else:
+            answer, input_tokens, output_tokens, total_tokens = await abbot.async_chat_completion(chat_title, tier=tier)
+        abbot_squawk = f"chat_id={chat_id} chat_title={chat_title} mentions={len(mentions)} total_tokens={total_tokens}"
+        await bot_squawk(log_name, abbot_squawk, context)
+        response: Dict = await calculate_completion_cost(input_tokens, output_tokens, tier)
+        if not successful(response):
+            sub_log_name = f"{log_name}: calculate_completion_cost"
+            error_bot.log(log_name, f"response={response}")
+            msg = f"{sub_log_name}: Failed to calculate remaining sats"
+            msg = f"{msg}: group_balance={group_balance}\nresponse={response}\nchat=(id={chat_id}\ntitle=({chat_title})"
+            error_bot.log(log_name, msg)
+            await bot_squawk(log_name, msg, context)
+        cost_sats: int = try_get(response, "cost_sats", default=500)
+        debit: Optional[Dict] = await group_cache.debit_group(chat_id, cost_sats, "completion")
+        group_balance = try_get(debit, "balance", default=0)
+        if group_balance <= 0:
+            abbot_squawk = f"Group balance: {group_balance}\n\ngroup_id={chat_id}\ngroup_title={chat_title}"
+            answer = f"{answer}\n\n{WARN_GROUP_NOSATS}"
+            debug_bot.log(log_name, abbot_squawk)
+            await bot_squawk(log_name, abbot_squawk, context)
+        debug_bot.log(log_name, f"group_balance={group_balance}")
+        answer_entry: Dict = new_history_entry("assistant", answer)
+        group: TelegramGroup = await write_buffer.append_group(
+            chat_id,
+            {
+                "$set": {
+                    "title": chat_title,
+                    "id": chat_id,
+                },
+                "$inc": {"tokens": answer_entry["tokens"]},
+            },
+            history=[answer_entry],
+            fields=CHAT_STATE_FIELDS,
+        )
+        summarizer.schedule("group", chat_id, group)
+        if streamed_reply:
+            return await streamed_reply.finish(answer)
+        if "`" in answer or "**" in answer:
+            return await message.reply_markdown_v2(sanitize_md_v2(answer), disable_web_page_preview=True)
+        return await message.reply_text(answer, disable_web_page_preview=True)
+    except AbbotException as abbot_exception:
+        await bot_squawk_error(log_name, abbot_exception, context)
+    finally:
+        if streamed_reply:
+            await streamed_reply.abandon()
+
+
 async def handle_group_mention(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         log_name: str = f"{FILE_NAME}: handle_group_mention"
@@ -908,7 +999,9 @@ async def handle_group_mention(update: Update, context: ContextTypes.DEFAULT_TYP
             debug_bot.log(log_name, f"chat_type={chat_type}")
         chat_id_filter = {"id": chat_id}
         stopped_err = f"{BOT_NAME} not started - Please run /start{BOT_TELEGRAM_HANDLE}"
-        group: TelegramGroup = mongo_abbot.find_one_group(chat_id_filter)
+        group: TelegramGroup = await write_buffer.find_one_group(
+            chat_id_filter, ["config", "balance"], history_window=1
+        )
         group_config: Dict = try_get(group, "config")
         group_balance: int = try_get(group, "balance")
         if not group or not group_config:
@@ -925,15 +1018,14 @@ async def handle_group_mention(update: Update, context: ContextTypes.DEFAULT_TYP
             error_bot.log(log_name, abbot_squawk)
             await bot_squawk(log_name, abbot_squawk, context)
             return await message.reply_text(stopped_err)
-        new_history_dict = {"role": "user", "content": f"@{username} said: {message_text}"}
         if not message_text:
             message_text_err = f"{log_name}: No message text: message={message} update={update}"
             return await bot_squawk(log_name, message_text_err, context)
         if not username:
-            new_history_dict = {"role": "user", "content": f"someone said: {message_text}"}
+            new_history_dict = new_history_entry("user", f"someone said: {message_text}")
         else:
-            new_history_dict = {"role": "user", "content": f"@{username} said: {message_text}"}
-        group_history: List[Dict] = [*try_get(group, "history", default=[]), new_history_dict]
+            new_history_dict = new_history_entry("user", f"@{username} said: {message_text}")
+        group_history: List[Dict] = try_get(group, "history", default=[])
         if not group or not group_history:
             abbot_squawk = f"{log_name}: {ERR_NO_GROUP}: id={chat_id}, title={chat_title}"
             error_msg = f"{ERR_NO_GROUP}: group={group} group_config={group_config}"
@@ -949,43 +1041,10 @@ async def handle_group_mention(update: Update, context: ContextTypes.DEFAULT_TYP
             abbot_squawk = f"Group balance: {group_balance}\n\ngroup_id={chat_id}\ngroup_title={chat_title}"
             await bot_squawk(log_name, abbot_squawk, context)
             return await message.reply_markdown_v2(sanitize_md_v2(reply_msg))
-        abbot = Abbot(chat_id, "group", group_history)
-        answer, input_tokens, output_tokens, total_tokens = abbot.chat_completion(chat_title)
-        await bot_squawk(log_name, f"chat_id={chat_id} chat_title={chat_title} total_tokens={total_tokens}", context)
-        response: Dict = await calculate_completion_cost(input_tokens, output_tokens)
-        if not successful(response):
-            sub_log_name = f"{log_name}: calculate_completion_cost"
-            error_bot.log(log_name, f"response={response}")
-            msg = f"{sub_log_name}: Failed to calculate remaining sats"
-            msg = f"{msg}: group_balance={group_balance}\nresponse={response}\nchat=(id={chat_id}\ntitle=({chat_title})"
-            error_bot.log(log_name, msg)
-            await bot_squawk(log_name, msg, context)
-        cost_sats: int = try_get(response, "cost_sats", default=500)
-        group_balance = 0 if group_balance < 0 else group_balance - cost_sats
-        if group_balance == 0:
-            abbot_squawk = f"Group balance: {group_balance}\n\ngroup_id={chat_id}\ngroup_title={chat_title}"
-            answer = f"{answer}\n\n{WARN_GROUP_NOSATS}"
-            debug_bot.log(log_name, abbot_squawk)
-            await bot_squawk(log_name, abbot_squawk, context)
-        debug_bot.log(log_name, f"group_balance={group_balance}")
-        assistant_history_update = {"role": "assistant", "content": answer}
-        group_history = abbot.get_history()
-        new_message_dict = message.to_dict()
-        group: TelegramGroup = mongo_abbot.find_one_group_and_update(
-            chat_id_filter,
-            {
-                "$set": {
-                    "title": chat_title,
-                    "id": chat_id,
-                    "balance": group_balance,
-                    "tokens": abbot.history_tokens,
-                },
-                "$push": {"messages": new_message_dict, "history": assistant_history_update},
-            },
-        )
-        if "`" in answer or "**" in answer:
-            return await message.reply_markdown_v2(sanitize_md_v2(answer), disable_web_page_preview=True)
-        return await message.reply_text(answer, disable_web_page_preview=True)
+        # logged on arrival, in order with the chat's other messages, so a failed completion keeps the turn
+        group_update = {"$set": {"title": chat_title, "id": chat_id}, "$inc": {"tokens": new_history_dict["tokens"]}}
+        write_buffer.buffer_group(chat_id, group_update, history=[new_history_dict], messages=[message.to_dict()])
+        coalescer.submit(chat_id, PendingMention(message, context), answer_group_mentions)
     except AbbotException as abbot_exception:
         await bot_squawk_error(log_name, abbot_exception, context)
 
@@ -1041,7 +1100,9 @@ async def handle_group_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return await bot_squawk(log_name, "Group reply not to Abbot: chat_id={} chat_title={}", context)
 
         chat_id_filter = {"id": chat_id}
-        group: TelegramGroup = mongo_abbot.find_one_group(chat_id_filter)
+        group: TelegramGroup = await write_buffer.find_one_group(
+            chat_id_filter, ["config", "balance"], history_window=1
+        )
         group_balance: Dict = try_get(group, "balance")
         group_history: List[Dict] = try_get(group, "history")
         group_config: Dict = try_get(group, "config")
@@ -1059,68 +1120,23 @@ async def handle_group_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
             admins = await get_chat_admins(chat_id, context)
             debug_bot.log(log_name, f"admins={admins}")
 
-        new_history_dict = {"role": "user", "content": f"@{username} said: {message_text}"}
+        new_history_dict = new_history_entry("user", f"@{username} said: {message_text}")
         if not username:
-            new_history_dict = {"role": "user", "content": f"{username} said: {message_text}"}
+            new_history_dict = new_history_entry("user", f"{username} said: {message_text}")
 
-        new_message_dict = message.to_dict()
-        group: TelegramGroup = mongo_abbot.find_one_group_and_update(
-            chat_id_filter,
-            {
-                "$set": {
-                    "title": chat_title,
-                    "id": chat_id,
-                    "admins": admins,
-                },
-                "$push": {"messages": new_message_dict, "history": new_history_dict},
-            },
-        )
-        group_id: str = try_get(group, "id")
-        group_title: str = try_get(group, "title")
-        group_created_at: str = try_get(group, "created_at")
-        debug_bot.log(log_name, f"group_id={group_id} group_title={group_title} group_created_at={group_created_at}")
+        # logged on arrival, in order with the chat's other messages; answer_group_mentions only adds the answer
+        group_update: Dict = {
+            "$set": {"title": chat_title, "id": chat_id, "admins": admins},
+            "$inc": {"tokens": new_history_dict["tokens"]},
+        }
+        write_buffer.buffer_group(chat_id, group_update, history=[new_history_dict], messages=[message.to_dict()])
         if group_balance == 0:
             abbot_squawk = f"Group balance: {group_balance}\n\ngroup_id={chat_id}\ngroup_title={chat_title}"
             await bot_squawk(log_name, abbot_squawk, context)
             return await message.reply_text(ERR_NO_SATS)
-        if replied_to_abbot:
-            if started:
-                abbot = Abbot(chat_id, "group", group_history)
-                answer, input_tokens, output_tokens, _ = abbot.chat_completion(chat_title)
-                response: Dict = await calculate_completion_cost(input_tokens, output_tokens)
-                if not successful(response):
-                    error_bot.log(log_name, f"response={response}")
-                    sub_log_name = f"{log_name}: calculate_completion_cost"
-                    calc_failed_msg = f"{sub_log_name}: Failed to calculate remaining sats"
-                    abbot_squawk = f"{calc_failed_msg}: group_id={chat_id}\ngroup_title=({chat_title})"
-                    abbot_squawk = f"{abbot_squawk}: group_balance={group_balance}\nresponse={response}\n"
-                    error_bot.log(log_name, abbot_squawk)
-                    await bot_squawk(log_name, abbot_squawk, context)
-                debug_bot.log(log_name, f"response={response}")
-                cost_sats: int = try_get(response, "cost_sats", default=500)
-                group_balance = 0 if group_balance < 0 else group_balance - cost_sats
-                if group_balance == 0:
-                    abbot_squawk = f"Group balance: {group_balance}\n\ngroup_id={chat_id}\ngroup_title={chat_title}"
-                    answer = f"{answer}\n\n{WARN_GROUP_NOSATS}"
-                    debug_bot.log(log_name, abbot_squawk)
-                    await bot_squawk(log_name, abbot_squawk, context)
-                debug_bot.log(log_name, f"cost_sats={cost_sats}")
-                debug_bot.log(log_name, f"group_balance={group_balance}")
-                assistant_history_update = {"role": "assistant", "content": answer}
-                group_history = abbot.get_history()
-                token_count: int = calculate_tokens(group_history)
-                group: TelegramGroup = mongo_abbot.find_one_group_and_update(
-                    chat_id_filter,
-                    {
-                        "$set": {"balance": group_balance, "tokens": token_count},
-                        "$push": {"history": assistant_history_update},
-                    },
-                )
-                if "`" in answer or "**" in answer:
-                    return await message.reply_markdown_v2(sanitize_md_v2(answer), disable_web_page_preview=True)
-                await message.reply_text(answer, disable_web_page_preview=True)
-            else:
-                await message.reply_text(reply_msg)
+        if not started:
+            return await message.reply_text(reply_msg)
+        coalescer.submit(chat_id, PendingMention(message, context), answer_group_mentions)
     except AbbotException as abbot_exception:
         await bot_squawk_error(log_name, abbot_exception, context)
 
@@ -1143,36 +1159,40 @@ async def handle_dm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # sender: User = try_get(update_data, "user")
         # sender_id, sender_username, sender_first_name = parse_user_data(sender)
         new_message_dict = message.to_dict()
+        new_history_dict = new_history_entry("user", message_text)
         chat_id_filter = {"id": chat_id}
+        dm_history: List = [with_tokens(BOT_SYSTEM_OBJECT_DMS), new_history_dict]
         dm_update = {
             "$set": {
                 "created_at": datetime.now().isoformat(),
                 "id": chat_id,
                 "username": username,
                 "type": "dm",
-                "messages": [new_message_dict],
-                "history": [BOT_SYSTEM_OBJECT_DMS],
+                "tokens": calculate_tokens(dm_history),
             }
         }
-        dm_exists: bool = mongo_abbot.find_one_dm(chat_id_filter)
+        dm_exists: bool = await async_mongo_abbot.dm_does_exist(chat_id_filter)
         if dm_exists:
             dm_update = {
                 "$set": {"id": chat_id, "username": username},
-                "$push": {
-                    "messages": new_message_dict,
-                    "history": {"role": "user", "content": message_text},
-                },
+                "$inc": {"tokens": new_history_dict["tokens"]},
             }
-        dm: TelegramDM = mongo_abbot.find_one_dm_and_update(chat_id_filter, dm_update)
+            dm_history = [new_history_dict]
+        dm: TelegramDM = await async_mongo_abbot.append_dm(
+            chat_id, dm_update, history=dm_history, messages=[new_message_dict]
+        )
         debug_bot.log(log_name, f"chat_id={chat_id}")
-        dm_history: List = try_get(dm, "history")
-        abbot = Abbot(chat_id, "dm", dm_history)
-        answer, _, _, _ = abbot.chat_completion(chat_title)
-        dm_history = abbot.get_history()
-        dm: TelegramDM = mongo_abbot.find_one_dm_and_update(
-            chat_id_filter,
-            {"$set": {"tokens": abbot.history_tokens}, "$push": {"history": {"role": "assistant", "content": answer}}},
+        abbot = Abbot.from_document(chat_id, "dm", dm)
+        tier: ModelTier = model_router.route("dm", message_text)
+        answer, _, _, _ = await abbot.async_chat_completion(chat_title, tier=tier)
+        assistant_history_update = new_history_entry("assistant", answer)
+        dm: TelegramDM = await async_mongo_abbot.append_dm(
+            chat_id,
+            {"$inc": {"tokens": assistant_history_update["tokens"]}},
+            history=[assistant_history_update],
+            fields=CHAT_STATE_FIELDS,
         )
+        summarizer.schedule("dm", chat_id, dm)
         if "`" in answer or "**" in answer:
             return await message.reply_markdown_v2(sanitize_md_v2(answer), disable_web_page_preview=True)
         return await message.reply_text(answer, disable_web_page_preview=True)
@@ -1222,11 +1242,11 @@ async def handle_group_default(update: Update, context: ContextTypes.DEFAULT_TYP
         user: User = try_get(update_data, "user")
         debug_bot.log(log_name, f"user={user}")
         user_id, username, first_name = parse_user_data(user)
-        new_history_dict = {"role": "user", "content": f"@{username} said: {message_text}"}
+        new_history_dict = new_history_entry("user", f"@{username} said: {message_text}")
 
         if not username:
             username: str = first_name or user_id or "someone"
-            new_history_dict = {"role": "user", "content": f"{username} said: {message_text}"}
+            new_history_dict = new_history_entry("user", f"{username} said: {message_text}")
         debug_bot.log(log_name, f"username={username}")
 
         if not message_text:
@@ -1236,49 +1256,46 @@ async def handle_group_default(update: Update, context: ContextTypes.DEFAULT_TYP
 
         chat_id_filter = {"id": chat_id}
         new_message_dict = message.to_dict()
-        group: TelegramGroup = mongo_abbot.find_one_group(chat_id_filter)
+        group_fields: List[str] = [*CHAT_STATE_FIELDS, *COUNTER_FIELDS]
+        group: TelegramGroup = await write_buffer.find_one_group(chat_id_filter, group_fields)
         group_detail_msg: str = f"chat_id={chat_id}\nchat_title={chat_title}"
         if not group:
+            default_history = [with_tokens(BOT_SYSTEM_OBJECT_GROUPS)]
             group_update = {
                 "$set": {
                     "created_at": datetime.now().isoformat(),
                     "title": chat_title,
                     "id": chat_id,
                     "type": chat_type,
-                    "balance": 5000,
-                    "messages": [new_message_dict],
-                    "history": [BOT_SYSTEM_OBJECT_GROUPS],
+                    "tokens": calculate_tokens(default_history),
                     "config": BOT_GROUP_CONFIG_DEFAULT,
                 }
             }
-            squawk_msg = f"New group created:\n\n{group_detail_msg}"
+            await bot_squawk(log_name, f"New group created:\n\n{group_detail_msg}", context)
+            group: TelegramGroup = await write_buffer.append_group(
+                chat_id, group_update, history=default_history, messages=[new_message_dict], fields=CHAT_STATE_FIELDS
+            )
+            group: TelegramGroup = await grant_starter_sats(chat_id, group)
         else:
+            # plain chatter is only logged, so it goes through the write-behind buffer
+            group_update = {"$set": {"title": chat_title, "id": chat_id, "type": chat_type}}
+            new_history = []
             if new_history_dict:
-                group_update = {
-                    "$set": {"title": chat_title, "id": chat_id, "type": chat_type},
-                    "$push": {
-                        "messages": new_message_dict,
-                        "history": new_history_dict,
-                    },
-                }
-            else:
-                group_update = {
-                    "$set": {"title": chat_title, "id": chat_id, "type": chat_type},
-                    "$push": {"messages": new_message_dict},
-                }
-                squawk_msg = f"Existing group updated:\n\n{group_detail_msg}"
-        await bot_squawk(log_name, squawk_msg, context)
-        group: TelegramGroup = mongo_abbot.find_one_group_and_update(chat_id_filter, group_update)
+                group_update["$inc"] = {"tokens": new_history_dict["tokens"]}
+                new_history = [new_history_dict]
+            group: TelegramGroup = write_buffer.buffer_group(
+                chat_id, group_update, history=new_history, messages=[new_message_dict], document=group
+            )
+        summarizer.schedule("group", chat_id, group)
         group_balance: int = try_get(group, "balance")
-        group_history: List = try_get(group, "history")
         group_config: Dict = try_get(group, "config")
         unleashed: Dict = try_get(group_config, "unleashed")
         count: Dict = try_get(group_config, "count")
         if unleashed and count > 0:
-            abbot = Abbot(chat_id, chat_type, group_history)
-            debug_bot.log(log_name, f"abbot.history_len={abbot.history_len}")
+            history_count: int = try_get(group, "history_count", default=0)
+            debug_bot.log(log_name, f"history_count={history_count}")
             debug_bot.log(log_name, f"count={count}")
-            if abbot.history_len % count == 0:
+            if history_count % count == 0:
                 if group_balance == 0:
                     # DM an admin?
                     # send message, and set unleashed = False and count = 0? or set started = False?
@@ -1286,16 +1303,21 @@ async def handle_group_default(update: Update, context: ContextTypes.DEFAULT_TYP
                     debug_bot.log(log_name, f"group_balance={group_balance}")
                     return await bot_squawk(log_name, f"No SATS! {chat_title} {chat_id} {chat_type}", context)
                 debug_bot.log(log_name, f"group_balance={group_balance}")
+                group: TelegramGroup = await write_buffer.find_one_group(chat_id_filter)
+                abbot = Abbot.from_document(chat_id, chat_type, group)
                 chat_title_completion: str = chat_title.lower()
-                answer, input_tokens, output_tokens, total_tokens = abbot.chat_completion(chat_title_completion)
-                group: TelegramGroup = mongo_abbot.find_one_group_and_update(
-                    chat_id_filter,
-                    {
-                        "$inc": {"tokens": total_tokens},
-                        "$push": {"history": {"role": "assistant", "content": answer}},
-                    },
+                tier: ModelTier = model_router.route("unleashed", message_text, group_balance)
+                answer, input_tokens, output_tokens, total_tokens = await abbot.async_chat_completion(
+                    chat_title_completion, tier=tier, priority_class="unleashed"
+                )
+                assistant_history_update = new_history_entry("assistant", answer)
+                await write_buffer.append_group(
+                    chat_id,
+                    {"$inc": {"tokens": assistant_history_update["tokens"]}},
+                    history=[assistant_history_update],
+                    fields=[],
                 )
-                response: Dict = await calculate_completion_cost(input_tokens, output_tokens)
+                response: Dict = await calculate_completion_cost(input_tokens, output_tokens, tier)
                 if not successful(response):
                     sub_log_name = f"{log_name}: calculate_completion_cost"
                     error_bot.log(log_name, f"response={response}")
@@ -1304,19 +1326,14 @@ async def handle_group_default(update: Update, context: ContextTypes.DEFAULT_TYP
                     error_bot.log(log_name, abbot_squawk)
                     await bot_squawk(log_name, abbot_squawk, context)
                 cost_sats: int = try_get(response, "cost_sats", default=100)
-                group_balance -= cost_sats
-                balance_is_below_zero = group_balance < 0
-                if balance_is_below_zero:
-                    group_balance = 0
+                debit: Optional[Dict] = await group_cache.debit_group(chat_id, cost_sats, "completion")
+                group_balance = try_get(debit, "balance", default=0)
+                if group_balance <= 0:
                     abbot_squawk = f"Group balance: {group_balance}\n\ngroup_id={chat_id}\ngroup_title={chat_title}"
                     answer = f"{answer}\n\n{WARN_GROUP_NOSATS}"
                     debug_bot.log(log_name, abbot_squawk)
                     await bot_squawk(log_name, abbot_squawk, context)
                 debug_bot.log(log_name, f"group_balance={group_balance}")
-                group: TelegramGroup = mongo_abbot.find_one_group_and_update(
-                    chat_id_filter,
-                    {"$dec": {"balance": group_balance}},
-                )
                 if "`" in answer or "**" in answer:
                     return await message.reply_markdown_v2(sanitize_md_v2(answer), disable_web_page_preview=True)
                 return await message.reply_text(answer, disable_web_page_preview=True)
@@ -1345,7 +1362,16 @@ class TelegramBotBuilder:
     def __init__(self):
         log_name: str = f"{FILE_NAME}: TelegramBotBuilder.__init__()"
         debug_bot.log(log_name, f"Telegram abbot initializing: name={BOT_NAME} handle={BOT_TELEGRAM_HANDLE}")
-        telegram_bot = ApplicationBuilder().token(self.BOT_TELEGRAM_TOKEN).build()
+        telegram_bot = (
+            ApplicationBuilder()
+            .token(self.BOT_TELEGRAM_TOKEN)
+            .concurrent_updates(ChatOrderedUpdateProcessor())
+            .rate_limiter(OutboundRateLimiter())
+            .post_init(self.post_init)
+            .post_stop(self.post_stop)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
         debug_bot.log(log_name, f"Telegram abbot initialized")
 
         # Add command handlers
@@ -1387,7 +1413,56 @@ class TelegramBotBuilder:
         telegram_bot.add_error_handler(error_handler)
         self.telegram_bot = telegram_bot
 
-    def run(self):
+    @staticmethod
+    async def restore_open_invoices(application: Application):
+        """
+        Watches the invoices still open when the bot last stopped, so one paid meanwhile is credited on its
+        first check and its payment webhook still finds it
+        """
+        log_name: str = f"{FILE_NAME}: TelegramBotBuilder.restore_open_invoices"
+        context: ContextTypes.DEFAULT_TYPE = CallbackContext(application)
+        open_invoices: List[Dict] = await async_mongo_abbot.find_open_invoices()
+        for record in open_invoices:
+            invoice_watcher.watch(PendingInvoice.from_record(record, context), credit_paid_invoice, offer_new_invoice)
+        debug_bot.log(log_name, f"Restored {len(open_invoices)} open invoices")
+
+    @staticmethod
+    async def post_init(application: Application):
+        group_cache.start()
+        write_buffer.start()
+        metrics.start(BOT_METRICS_LOG_INTERVAL_SEC)
+        await TelegramBotBuilder.restore_open_invoices(application)
+        if payment_webhooks:
+            await payment_webhooks.start()
+            await payment_processor.register_webhook()
+
+    @staticmethod
+    async def post_stop(application: Application):
+        # queued mentions are answered while the bot can still send; post_shutdown runs after its client closed
+        await coalescer.stop()
+
+    @staticmethod
+    async def post_shutdown(application: Application):
+        log_name: str = f"{FILE_NAME}: TelegramBotBuilder.post_shutdown"
+        # a no-op after post_stop; the mentions' turns are already logged, so only their answers could be lost
+        await coalescer.stop()
+        flushed_chats: int = await write_buffer.stop()
+        debug_bot.log(log_name, f"write buffer flushed_chats={flushed_chats}")
+        if payment_webhooks:
+            await payment_webhooks.stop()
+        debug_bot.log(log_name, f"invoice watcher {invoice_watcher.to_dict()}")
+        await invoice_watcher.stop()
+        await group_cache.stop()
+        debug_bot.log(log_name, f"group cache {group_cache.to_dict()}")
+        await metrics.stop()
+
+    def run(self, webhook: bool = False):
         log_name: str = f"{FILE_NAME}: TelegramBotBuilder.run"
+        if webhook:
+            from lib.api.telegram_webhook import TelegramWebhook
+
+            debug_bot.log(log_name, f"Telegram abbot serving webhook")
+            asyncio.run(TelegramWebhook(self.telegram_bot).serve())
+            return
         debug_bot.log(log_name, f"Telegram abbot polling")
         self.telegram_bot.run_polling()
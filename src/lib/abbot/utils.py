@@ -1,16 +1,15 @@
 from typing import Any, Dict, List, Optional
 
-import tiktoken
 from json import dumps
 from telegram.ext import ContextTypes
 from telegram import Message, Update, Chat, User
 
-from constants import ABBOT_SQUAWKS, OPENAI_MODEL, THE_ARCHITECT_HANDLE, THE_ARCHITECT_ID
+from constants import ABBOT_SQUAWKS, THE_ARCHITECT_HANDLE, THE_ARCHITECT_ID
 
 from ..utils import success, successful, try_get, error
 from ..logger import debug_bot, error_bot
-
-encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+from ..abbot.context import history_tokens
+from ..abbot.telegram.outbound import squawk_merger
 
 FILE_NAME = __name__
 
@@ -150,28 +149,33 @@ async def bot_squawk_architect(error_message: str, context: ContextTypes.DEFAULT
     return await context.bot.send_message(chat_id=THE_ARCHITECT_ID, text=error_message)
 
 
-async def bot_squawk(location: str, squawk: str, context: ContextTypes.DEFAULT_TYPE) -> Message:
+async def bot_squawk(location: str, squawk: str, context: ContextTypes.DEFAULT_TYPE) -> None:
     log_name: str = f"{FILE_NAME}: bot_squawk"
     error_bot.log(log_name, f"{squawk}")
     final_squawk = f"SQUAWK\n\nLocation\n{location}\n\nException\n{squawk}"
-    await context.bot.send_message(chat_id=ABBOT_SQUAWKS, text=final_squawk)
+    squawk_merger.submit(context.bot, ABBOT_SQUAWKS, final_squawk)
 
 
-async def bot_squawk_error(location: str, squawk: str, context: ContextTypes.DEFAULT_TYPE) -> Message:
+async def bot_squawk_error(location: str, squawk: str, context: ContextTypes.DEFAULT_TYPE) -> None:
     log_name: str = f"{FILE_NAME}: bot_squawk"
     error_bot.log(log_name, f"{squawk}")
     final_squawk = f"{THE_ARCHITECT_HANDLE} ERROR\n\nLocation\n{location}\n\nException\n{squawk}"
-    await context.bot.send_message(chat_id=ABBOT_SQUAWKS, text=final_squawk)
+    squawk_merger.submit(context.bot, ABBOT_SQUAWKS, final_squawk)
 
 
 def calculate_tokens(history: List) -> int:
-    total = 0
-    for data in history:
-        content = try_get(data, "content")
-        if not content:
-            continue
-        total += len(encoding.encode(content, allowed_special="all"))
-    return total
+    return history_tokens(history)
+
+
+def sanitize_md_v2(text):
+    escape_chars = "_[]()~>#+-=|{}.!^@$%&;:?/<,"
+    return "".join(
+        "\\" + char if char in escape_chars else char for char in text if not (0xD800 <= ord(char) <= 0xDFFF)
+    )
+
+
+def has_markdown(text: str) -> bool:
+    return "`" in text or "**" in text
 
 
 def to_int(x: Any) -> int:
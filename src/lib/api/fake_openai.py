@@ -0,0 +1,171 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint, streaming and non-streaming, with configurable
+latency, token usage and error rate. Point Abbot at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1 in src/.env
+
+Run from the repo root:
+    PYTHONPATH=src python -m lib.api.fake_openai --port 8765 --latency 0.5 --error-rate 0.01
+"""
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import tiktoken
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from constants import OPENAI_MODEL
+
+encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+FILE_NAME = __name__
+
+FAKE_ANSWER_WORDS: List[str] = "gm! Lightning is a layer two payment network built on top of Bitcoin".split()
+MESSAGE_OVERHEAD_TOKENS: int = 4
+
+
+class FakeOpenAI:
+    """
+    latency_sec (plus up to jitter_sec) is the time to the first token, then tokens arrive at tokens_per_sec.
+    A non-streaming response is returned once the whole answer would have been generated. error_rate of the
+    requests fail with error_status before any latency
+    """
+
+    def __init__(
+        self,
+        latency_sec: float = 0.5,
+        jitter_sec: float = 0.0,
+        tokens_per_sec: float = 50.0,
+        completion_tokens: int = 64,
+        error_rate: float = 0.0,
+        error_status: int = 429,
+    ):
+        self.latency_sec: float = latency_sec
+        self.jitter_sec: float = jitter_sec
+        self.tokens_per_sec: float = tokens_per_sec
+        self.completion_tokens: int = completion_tokens
+        self.error_rate: float = error_rate
+        self.error_status: int = error_status
+        self.requests: int = 0
+        self.errors: int = 0
+
+    def to_dict(self):
+        return vars(self)
+
+    def prompt_tokens(self, messages: List[Dict]) -> int:
+        content_tokens = sum(len(encoding.encode(message.get("content") or "")) for message in messages)
+        return content_tokens + MESSAGE_OVERHEAD_TOKENS * len(messages)
+
+    def answer_tokens(self, max_tokens: Optional[int]) -> List[str]:
+        count = min(self.completion_tokens, max_tokens or self.completion_tokens)
+        return [f" {FAKE_ANSWER_WORDS[index % len(FAKE_ANSWER_WORDS)]}" for index in range(count)]
+
+    def error_response(self) -> Optional[web.Response]:
+        if random.random() >= self.error_rate:
+            return None
+        self.errors += 1
+        error = {"message": "Fake OpenAI injected error", "type": "fake_error", "code": self.error_status}
+        return web.json_response({"error": error}, status=self.error_status)
+
+    async def first_token_delay(self):
+        await asyncio.sleep(self.latency_sec + random.uniform(0, self.jitter_sec))
+
+    def chunk(self, completion_id: str, model: str, delta: Dict, finish_reason: Optional[str] = None) -> bytes:
+        body = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(body)}\n\n".encode()
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        body: Dict = await request.json()
+        error_response: Optional[web.Response] = self.error_response()
+        if error_response:
+            return error_response
+        model: str = body.get("model", OPENAI_MODEL)
+        messages: List[Dict] = body.get("messages", [])
+        tokens: List[str] = self.answer_tokens(body.get("max_tokens"))
+        completion_id = f"chatcmpl-fake-{uuid.uuid4().hex[:12]}"
+        await self.first_token_delay()
+        if not body.get("stream"):
+            await asyncio.sleep(len(tokens) / self.tokens_per_sec)
+            prompt_tokens = self.prompt_tokens(messages)
+            return web.json_response(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": len(tokens),
+                        "total_tokens": prompt_tokens + len(tokens),
+                    },
+                }
+            )
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        await response.write(self.chunk(completion_id, model, {"role": "assistant", "content": ""}))
+        for token in tokens:
+            await response.write(self.chunk(completion_id, model, {"content": token}))
+            await asyncio.sleep(1 / self.tokens_per_sec)
+        await response.write(self.chunk(completion_id, model, {}, "stop"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": OPENAI_MODEL, "object": "model"}]})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/v1/models", self.models)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> web.AppRunner:
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds to first token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random seconds to first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--completion-tokens", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=429)
+    return parser.parse_args()
+
+
+def fake_openai_from_args(args: argparse.Namespace) -> FakeOpenAI:
+    return FakeOpenAI(
+        latency_sec=args.latency,
+        jitter_sec=args.jitter,
+        tokens_per_sec=args.tokens_per_sec,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    web.run_app(fake_openai_from_args(args).app(), host=args.host, port=args.port)
@@ -0,0 +1,166 @@
+"""
+Settlement webhooks from the payment processor, so a paid /fund invoice is credited as soon as it is paid
+instead of on the next poll. Each processor authenticates differently:
+    strike    X-Webhook-Signature is the HMAC-SHA256 of the body keyed by PAYMENT_WEBHOOK_SECRET, the secret the
+              subscription was created with; the event only says the invoice changed, so its state is fetched
+    lnbits    unsigned; the webhook url set on each invoice carries a token derived from the correlation id
+              with PAYMENT_WEBHOOK_SECRET, which only authenticates that correlation id: the body must name
+              the same invoice and LNbits is asked whether it is paid
+    opennode  hashed_order is the HMAC-SHA256 of the charge id keyed by the API key; status says whether it is paid
+
+Set bot.payment_webhooks in src/data/config.json (url is the public base the processor calls, the processor
+kind is appended) and the bot serves this next to polling or the Telegram webhook
+"""
+import json
+import hmac
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiohttp import web
+
+from lib.logger import debug_bot, error_bot
+from lib.metrics import metrics
+from lib.utils import try_get
+from lib.payments import hmac_hex
+from lib.abbot.env import PAYMENT_PROCESSOR_KIND, PAYMENT_PROCESSOR_TOKEN, PAYMENT_WEBHOOK_SECRET
+from lib.abbot.config import (
+    BOT_PAYMENT_WEBHOOKS_HOST,
+    BOT_PAYMENT_WEBHOOKS_MAX_BODY_BYTES,
+    BOT_PAYMENT_WEBHOOKS_PATH,
+    BOT_PAYMENT_WEBHOOKS_PORT,
+)
+from lib.abbot.exceptions.exception import AbbotException
+
+FILE_NAME = __name__
+
+STRIKE_SIGNATURE_HEADER = "X-Webhook-Signature"
+STRIKE_INVOICE_UPDATED = "invoice.updated"
+OPENNODE_PAID = "paid"
+
+# (invoice_id, correlation_id, confirmed) -> whether an invoice was credited
+PaidCallback = Callable[[Optional[str], Optional[str], bool], Awaitable[bool]]
+
+
+def strike_signature_valid(body: bytes, signature: str, secret: str) -> bool:
+    return hmac.compare_digest(hmac_hex(secret, body), signature.lower())
+
+
+def lnbits_token_valid(correlation_id: str, token: str, secret: str) -> bool:
+    return hmac.compare_digest(hmac_hex(secret, correlation_id), token)
+
+
+def opennode_signature_valid(charge_id: str, hashed_order: str, api_key: str) -> bool:
+    return hmac.compare_digest(hmac_hex(api_key, charge_id), hashed_order)
+
+
+class PaymentWebhooks:
+    """
+    Serves POST <path>/<processor_kind> for the configured processor. Once a request is authenticated it is
+    answered 200 whether or not it matched an open invoice, so the processor stops redelivering; open invoices
+    are persisted and watched again after a restart, so an unmatched one was already settled or never issued by
+    this bot. Only a failure while crediting answers 500 so it tries again
+    """
+
+    def __init__(
+        self,
+        on_paid: PaidCallback,
+        processor_kind: str = PAYMENT_PROCESSOR_KIND,
+        secret: Optional[str] = PAYMENT_WEBHOOK_SECRET,
+        api_key: Optional[str] = PAYMENT_PROCESSOR_TOKEN,
+        host: str = BOT_PAYMENT_WEBHOOKS_HOST,
+        port: int = BOT_PAYMENT_WEBHOOKS_PORT,
+        path: str = BOT_PAYMENT_WEBHOOKS_PATH,
+        max_body_bytes: int = BOT_PAYMENT_WEBHOOKS_MAX_BODY_BYTES,
+    ):
+        handlers = dict(strike=self.strike, lnbits=self.lnbits, opennode=self.opennode)
+        if processor_kind not in handlers:
+            raise AbbotException(f"No payment webhook for processor_kind={processor_kind}")
+        if processor_kind in ("strike", "lnbits") and not secret:
+            raise AbbotException(f"PAYMENT_WEBHOOK_SECRET required for {processor_kind} payment webhooks")
+        self.on_paid: PaidCallback = on_paid
+        self.processor_kind: str = processor_kind
+        self.handler = handlers[processor_kind]
+        self.secret: Optional[str] = secret
+        self.api_key: Optional[str] = api_key
+        self.host: str = host
+        self.port: int = port
+        self.path: str = path
+        self.max_body_bytes: int = max_body_bytes
+        self.runner: Optional[web.AppRunner] = None
+
+    def to_dict(self):
+        return dict(processor_kind=self.processor_kind, host=self.host, port=self.port, path=self.path)
+
+    def reject(self, reason: str) -> web.Response:
+        metrics.incr("payment_webhooks.rejected", processor=self.processor_kind, reason=reason)
+        return web.Response(status=401 if reason == "signature" else 400)
+
+    def ignore(self) -> web.Response:
+        metrics.incr("payment_webhooks.ignored", processor=self.processor_kind)
+        return web.Response()
+
+    async def paid(self, invoice_id: Optional[str], correlation_id: Optional[str], confirmed: bool) -> web.Response:
+        log_name: str = f"{FILE_NAME}: PaymentWebhooks.paid"
+        credited: bool = await self.on_paid(invoice_id, correlation_id, confirmed)
+        outcome: str = "credited" if credited else "unmatched"
+        metrics.incr(f"payment_webhooks.{outcome}", processor=self.processor_kind)
+        debug_bot.log(log_name, f"invoice_id={invoice_id} correlation_id={correlation_id} credited={credited}")
+        return web.Response()
+
+    async def strike(self, request: web.Request) -> web.Response:
+        body: bytes = await request.read()
+        if not strike_signature_valid(body, request.headers.get(STRIKE_SIGNATURE_HEADER, ""), self.secret):
+            return self.reject("signature")
+        try:
+            event: Dict = json.loads(body)
+        except ValueError:
+            return self.reject("body")
+        if try_get(event, "eventType") != STRIKE_INVOICE_UPDATED:
+            return self.ignore()
+        return await self.paid(try_get(event, "data", "entityId"), None, confirmed=False)
+
+    async def lnbits(self, request: web.Request) -> web.Response:
+        correlation_id: str = request.query.get("correlation_id", "")
+        if not lnbits_token_valid(correlation_id, request.query.get("token", ""), self.secret):
+            return self.reject("signature")
+        try:
+            payment: Dict = await request.json()
+        except ValueError:
+            return self.reject("body")
+        return await self.paid(try_get(payment, "payment_hash"), correlation_id, confirmed=False)
+
+    async def opennode(self, request: web.Request) -> web.Response:
+        charge: Dict = dict(await request.post())
+        charge_id: str = try_get(charge, "id", default="")
+        if not opennode_signature_valid(charge_id, try_get(charge, "hashed_order", default=""), self.api_key):
+            return self.reject("signature")
+        if try_get(charge, "status") != OPENNODE_PAID:
+            return self.ignore()
+        return await self.paid(charge_id, try_get(charge, "order_id"), confirmed=True)
+
+    async def received(self, request: web.Request) -> web.Response:
+        log_name: str = f"{FILE_NAME}: PaymentWebhooks.received"
+        metrics.incr("payment_webhooks.received", processor=self.processor_kind)
+        try:
+            return await self.handler(request)
+        except web.HTTPException:
+            raise
+        except Exception as exception:
+            error_bot.log(log_name, f"processor={self.processor_kind} exception={exception}")
+            return web.Response(status=500)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=self.max_body_bytes)
+        app.router.add_post(f"{self.path}/{self.processor_kind}", self.received)
+        return app
+
+    async def start(self):
+        log_name: str = f"{FILE_NAME}: PaymentWebhooks.start"
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        debug_bot.log(log_name, f"Listening on http://{self.host}:{self.port}{self.path}/{self.processor_kind}")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
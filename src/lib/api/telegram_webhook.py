@@ -0,0 +1,197 @@
+"""
+Webhook ingestion for the Telegram bot, an alternative to long polling. An embedded aiohttp server receives
+updates from Telegram, checks the secret token and puts them on the Application's update queue, so they go
+through the same handlers and ChatOrderedUpdateProcessor as polled updates. Several processes can sit behind
+one load balancer as long as they share BOT_TELEGRAM_WEBHOOK_SECRET (src/.env)
+
+Run from the repo root:
+    python src/main.py --telegram --webhook
+"""
+import re
+import hmac
+import signal
+import asyncio
+from typing import Dict, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from lib.logger import debug_bot, error_bot
+from lib.metrics import metrics
+from lib.abbot.env import BOT_TELEGRAM_WEBHOOK_SECRET
+from lib.abbot.config import (
+    BOT_TELEGRAM_WEBHOOK_DROP_PENDING,
+    BOT_TELEGRAM_WEBHOOK_HOST,
+    BOT_TELEGRAM_WEBHOOK_MAX_BODY_BYTES,
+    BOT_TELEGRAM_WEBHOOK_MAX_CONNECTIONS,
+    BOT_TELEGRAM_WEBHOOK_MAX_QUEUE,
+    BOT_TELEGRAM_WEBHOOK_PATH,
+    BOT_TELEGRAM_WEBHOOK_PORT,
+    BOT_TELEGRAM_WEBHOOK_URL,
+)
+from lib.abbot.exceptions.exception import AbbotException
+
+FILE_NAME = __name__
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# what Telegram accepts as a secret_token in setWebhook
+SECRET_TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,256}$")
+
+
+class TelegramWebhook:
+    """
+    Accepts POSTs on path that carry secret_token, and answers 503 with Retry-After once max_queue updates are
+    pending (on the Application's update queue or handed to the update processor and not yet handled), so
+    Telegram backs off and redelivers instead of the process buffering without bound. max_connections caps how
+    many requests Telegram has open at once and max_body_bytes caps a single request. url, when set, is
+    registered with setWebhook on start; leave it empty when another process or the deploy already registered it
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        secret_token: Optional[str] = BOT_TELEGRAM_WEBHOOK_SECRET,
+        host: str = BOT_TELEGRAM_WEBHOOK_HOST,
+        port: int = BOT_TELEGRAM_WEBHOOK_PORT,
+        path: str = BOT_TELEGRAM_WEBHOOK_PATH,
+        url: str = BOT_TELEGRAM_WEBHOOK_URL,
+        max_connections: int = BOT_TELEGRAM_WEBHOOK_MAX_CONNECTIONS,
+        max_queue: int = BOT_TELEGRAM_WEBHOOK_MAX_QUEUE,
+        max_body_bytes: int = BOT_TELEGRAM_WEBHOOK_MAX_BODY_BYTES,
+        drop_pending_updates: bool = BOT_TELEGRAM_WEBHOOK_DROP_PENDING,
+    ):
+        if not secret_token or not SECRET_TOKEN_PATTERN.match(secret_token):
+            raise AbbotException("BOT_TELEGRAM_WEBHOOK_SECRET must be 1-256 characters of A-Z, a-z, 0-9, _ or -")
+        self.application: Application = application
+        self.secret_token: str = secret_token
+        self.host: str = host
+        self.port: int = port
+        self.path: str = path
+        self.url: str = url
+        self.max_connections: int = max_connections
+        self.max_queue: int = max_queue
+        self.max_body_bytes: int = max_body_bytes
+        self.drop_pending_updates: bool = drop_pending_updates
+        self.runner: Optional[web.AppRunner] = None
+        self.received: int = 0
+        self.rejected: int = 0
+        self.shed: int = 0
+
+    def to_dict(self):
+        return dict(
+            host=self.host,
+            port=self.port,
+            path=self.path,
+            pending_updates=self.pending_updates(),
+            max_queue=self.max_queue,
+            received=self.received,
+            rejected=self.rejected,
+            shed=self.shed,
+        )
+
+    def pending_updates(self) -> int:
+        """
+        Updates received and not yet handled. PTB moves each update off its queue into a task right away, so
+        the processor's own count is most of it
+        """
+        processor = self.application.update_processor
+        handed_over: int = getattr(processor, "pending", processor.current_concurrent_updates)
+        return self.application.update_queue.qsize() + handed_over
+
+    def authorized(self, request: web.Request) -> bool:
+        return hmac.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ""), self.secret_token)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        log_name: str = f"{FILE_NAME}: TelegramWebhook.handle_update"
+        if not self.authorized(request):
+            self.rejected += 1
+            metrics.incr("webhook.rejected", reason="secret")
+            return web.Response(status=403)
+        pending_updates: int = self.pending_updates()
+        metrics.gauge("webhook.pending_updates", pending_updates)
+        if pending_updates >= self.max_queue:
+            self.shed += 1
+            metrics.incr("webhook.shed")
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        try:
+            data: Dict = await request.json()
+            update: Optional[Update] = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError) as exception:
+            self.rejected += 1
+            metrics.incr("webhook.rejected", reason="body")
+            error_bot.log(log_name, f"Bad update body: {exception}")
+            return web.Response(status=400)
+        if not update:
+            self.rejected += 1
+            metrics.incr("webhook.rejected", reason="body")
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        self.received += 1
+        metrics.incr("webhook.received")
+        return web.Response()
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response(self.to_dict())
+
+    async def metrics_snapshot(self, request: web.Request) -> web.Response:
+        return web.json_response(metrics.snapshot())
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=self.max_body_bytes)
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get(f"{self.path}/health", self.health)
+        app.router.add_get(f"{self.path}/metrics", self.metrics_snapshot)
+        return app
+
+    async def start(self):
+        log_name: str = f"{FILE_NAME}: TelegramWebhook.start"
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        debug_bot.log(log_name, f"Listening on http://{self.host}:{self.port}{self.path}")
+        if not self.url:
+            debug_bot.log(log_name, "No webhook url configured, leaving setWebhook to the deploy")
+            return
+        await self.application.bot.set_webhook(
+            url=self.url,
+            secret_token=self.secret_token,
+            max_connections=self.max_connections,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=self.drop_pending_updates,
+        )
+        debug_bot.log(log_name, f"Registered webhook url={self.url} max_connections={self.max_connections}")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def serve(self):
+        """
+        Runs the Application the way run_polling would, with the webhook server in place of the updater,
+        until SIGINT or SIGTERM. The server stops first so updates already queued are handled before shutdown
+        """
+        log_name: str = f"{FILE_NAME}: TelegramWebhook.serve"
+        application: Application = self.application
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopping.set)
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        try:
+            await application.start()
+            await self.start()
+            await stopping.wait()
+            debug_bot.log(log_name, f"Stopping: {self.to_dict()}")
+        finally:
+            await self.stop()
+            if application.running:
+                await application.stop()
+                if application.post_stop:
+                    await application.post_stop(application)
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
@@ -0,0 +1,54 @@
+import time
+import asyncio
+import inspect
+from functools import partial, wraps
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Set
+
+from ..metrics import metrics
+from ..db.mongo import MongoAbbot, mongo_abbot
+from ..abbot.config import BOT_DATABASE_EXECUTOR_WORKERS
+
+FILE_NAME = __name__
+
+# MongoAbbot methods that never touch the network stay synchronous
+LOCAL_METHODS: Set[str] = {"projection", "history_offset", "bucket_entries", "chat_collection", "index_specs"}
+
+
+class AsyncMongoAbbot:
+    """
+    The MongoAbbot API for async handlers: every method that talks to Mongo becomes awaitable and runs on a
+    bounded thread pool, so a round trip no longer blocks the event loop for every other chat. Keep
+    executor_workers at or below the client's max_pool_size so a worker never waits on a connection
+    """
+
+    def __init__(self, mongo: MongoAbbot, executor_workers: int = BOT_DATABASE_EXECUTOR_WORKERS):
+        self.mongo: MongoAbbot = mongo
+        self.executor_workers: int = executor_workers
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="mongo")
+
+    def to_dict(self):
+        return dict(db_name=self.mongo.db_name, executor_workers=self.executor_workers)
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self.mongo, name)
+        if not inspect.ismethod(attribute) or name in LOCAL_METHODS:
+            return attribute
+        return self.offload(name, attribute)
+
+    def offload(self, name: str, method: Callable) -> Callable:
+        @wraps(method)
+        async def offloaded(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, partial(method, *args, **kwargs))
+            finally:
+                metrics.observe("mongo.call_sec", time.perf_counter() - start, method=name)
+
+        return offloaded
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+
+
+async_mongo_abbot = AsyncMongoAbbot(mongo_abbot)
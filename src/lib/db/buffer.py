@@ -0,0 +1,264 @@
+import time
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
+
+from ..logger import debug_bot, error_bot
+from ..metrics import metrics
+from ..utils import try_get
+from ..db.utils import apply_append
+from ..db.cache import GroupStateCache, group_cache
+from ..db.async_mongo import AsyncMongoAbbot, async_mongo_abbot
+from ..abbot.exceptions.exception import PartialAppendError
+from ..abbot.config import (
+    BOT_STORAGE_WRITE_BEHIND_INTERVAL_SEC,
+    BOT_STORAGE_WRITE_BEHIND_MAX_ATTEMPTS,
+    BOT_STORAGE_WRITE_BEHIND_MAX_ENTRIES,
+)
+
+FILE_NAME = __name__
+BUFFERED_OPERATORS: Set[str] = {"$set", "$inc"}
+
+
+class PendingAppend:
+    """
+    Everything buffered for one chat since its last flush, merged into a single append
+    """
+
+    def __init__(self):
+        self.set: Dict = dict()
+        self.inc: Dict = dict()
+        self.history: List[Dict] = []
+        self.messages: List[Dict] = []
+        self.attempts: int = 0
+
+    def to_dict(self):
+        return vars(self)
+
+    def add(self, update: Dict, history: List[Dict], messages: List[Dict]):
+        self.set.update(update.get("$set", {}))
+        for key, value in update.get("$inc", {}).items():
+            self.inc[key] = self.inc.get(key, 0) + value
+        self.history += history
+        self.messages += messages
+
+    def entries(self) -> int:
+        return len(self.history) + len(self.messages)
+
+    def update(self) -> Dict:
+        return {operator: fields for operator, fields in (("$set", self.set), ("$inc", self.inc)) if fields}
+
+
+class WriteBehindBuffer:
+    """
+    Collects logging appends (history and raw messages the bot isn't answering) per chat and writes them with
+    MongoAbbot.append_chats every interval_sec, or sooner once max_entries are waiting. Reads through the
+    buffer see buffered entries, and a direct append to a chat flushes that chat first so history stays in
+    order. Group reads and writes go through the group state cache, which flushes keep up to date. Flushes are
+    serialized; call stop() on shutdown to write whatever is left. Chats a failed flush did not touch are put
+    back for the next one, up to max_attempts flushes
+    """
+
+    def __init__(
+        self,
+        mongo: AsyncMongoAbbot,
+        groups: GroupStateCache,
+        interval_sec: float = BOT_STORAGE_WRITE_BEHIND_INTERVAL_SEC,
+        max_entries: int = BOT_STORAGE_WRITE_BEHIND_MAX_ENTRIES,
+        max_attempts: int = BOT_STORAGE_WRITE_BEHIND_MAX_ATTEMPTS,
+    ):
+        self.mongo: AsyncMongoAbbot = mongo
+        self.groups: GroupStateCache = groups
+        self.interval_sec: float = interval_sec
+        self.max_entries: int = max_entries
+        self.max_attempts: int = max_attempts
+        self.pending: Dict[Tuple[str, int], PendingAppend] = dict()
+        self.flushing: Set[Tuple[str, int]] = set()
+        self.versions: Dict[Tuple[str, int], int] = dict()
+        self.flushed = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+        self.size_flush: Optional[asyncio.Task] = None
+
+    def to_dict(self):
+        return dict(pending_chats=len(self.pending), pending_entries=self.pending_entries())
+
+    def pending_entries(self) -> int:
+        return sum(pending.entries() for pending in self.pending.values())
+
+    def buffer_append(
+        self,
+        bot_type: str,
+        chat_id: int,
+        update: Optional[Dict] = None,
+        history: Optional[List[Dict]] = None,
+        messages: Optional[List[Dict]] = None,
+        document: Optional[Dict] = None,
+    ) -> Optional[Dict]:
+        """
+        Buffers an append_chat; returns document with the append applied when one is given
+        """
+        update: Dict = update or {}
+        history: List[Dict] = history or []
+        messages: List[Dict] = messages or []
+        unsupported: Set[str] = set(update) - BUFFERED_OPERATORS
+        if unsupported:
+            raise ValueError(f"Only {BUFFERED_OPERATORS} can be buffered, got {unsupported}")
+        self.pending.setdefault((bot_type, chat_id), PendingAppend()).add(update, history, messages)
+        metrics.incr("buffer.entries", len(history) + len(messages), bot_type=bot_type)
+        if self.pending_entries() >= self.max_entries and not (self.size_flush and not self.size_flush.done()):
+            self.size_flush = asyncio.create_task(self.flush())
+        return apply_append(document, update, history, messages) if document else None
+
+    def buffer_group(
+        self,
+        chat_id: int,
+        update: Optional[Dict] = None,
+        history: Optional[List[Dict]] = None,
+        messages: Optional[List[Dict]] = None,
+        document: Optional[Dict] = None,
+    ) -> Optional[Dict]:
+        return self.buffer_append("group", chat_id, update, history, messages, document)
+
+    def overlay(self, key: Tuple[str, int], document: Optional[Dict], history_window: Optional[int] = None):
+        pending: Optional[PendingAppend] = self.pending.get(key)
+        if not pending or not document:
+            return document
+        return apply_append(document, pending.update(), pending.history, pending.messages, history_window)
+
+    async def find_one_chat(
+        self, bot_type: str, filter: Dict, fields: Optional[List[str]] = None, history_window: Optional[int] = None
+    ) -> Optional[Dict]:
+        """
+        The stored document plus anything still buffered for it. A read that overlaps a flush of the same chat
+        is retried, since it may or may not have seen the flushed entries
+        """
+        key: Tuple[str, int] = (bot_type, try_get(filter, "id"))
+        while True:
+            while key in self.flushing:
+                await self.flushed.wait()
+            version: int = self.versions.get(key, 0)
+            if bot_type == "dm":
+                document: Optional[Dict] = await self.mongo.find_one_dm(filter, fields, history_window)
+            else:
+                document: Optional[Dict] = await self.groups.find_one_group(filter, fields, history_window)
+            if key not in self.flushing and self.versions.get(key, 0) == version:
+                return self.overlay(key, document, history_window)
+
+    async def find_one_group(
+        self, filter: Dict, fields: Optional[List[str]] = None, history_window: Optional[int] = None
+    ) -> Optional[Dict]:
+        return await self.find_one_chat("group", filter, fields, history_window)
+
+    async def append_group(
+        self,
+        chat_id: int,
+        update: Optional[Dict] = None,
+        history: Optional[List[Dict]] = None,
+        messages: Optional[List[Dict]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> Optional[Dict]:
+        """
+        Writes an append straight through, after whatever is buffered for the chat
+        """
+        await self.flush("group", chat_id)
+        return await self.groups.append_group(chat_id, update, history, messages, fields)
+
+    def requeue(self, key: Tuple[str, int], pending: PendingAppend) -> bool:
+        """
+        Puts back an append a flush didn't write, ahead of anything buffered for the chat since
+        """
+        if pending.attempts >= self.max_attempts:
+            return False
+        newer: Optional[PendingAppend] = self.pending.get(key)
+        if newer:
+            pending.add(newer.update(), newer.history, newer.messages)
+        self.pending[key] = pending
+        return True
+
+    async def flush(self, bot_type: Optional[str] = None, chat_id: Optional[int] = None) -> int:
+        """
+        Writes everything buffered, or only what is buffered for one chat; returns the number of chats written
+        """
+        log_name: str = f"{FILE_NAME}: WriteBehindBuffer.flush"
+        async with self.lock:
+            keys = [key for key in self.pending if bot_type is None or key == (bot_type, chat_id)]
+            if not keys:
+                return 0
+            batch: Dict[Tuple[str, int], PendingAppend] = {key: self.pending.pop(key) for key in keys}
+            self.flushing.update(batch)
+            self.flushed.clear()
+            start = time.perf_counter()
+            written: Set[Tuple[str, int]] = set()
+            # chats append_chats may have written in part, which can't be retried without duplicating history
+            lost: Set[Tuple[str, int]] = set()
+            try:
+                for batch_bot_type in {key[0] for key in batch}:
+                    appends = {
+                        key[1]: (pending.update(), pending.history, pending.messages)
+                        for key, pending in batch.items()
+                        if key[0] == batch_bot_type
+                    }
+                    try:
+                        documents: Dict[int, Optional[Dict]] = await self.mongo.append_chats(batch_bot_type, appends)
+                    except PartialAppendError as partial_append:
+                        unwritten: List[int] = partial_append.unwritten
+                        written.update((batch_bot_type, appended) for appended in appends if appended not in unwritten)
+                        raise
+                    except Exception:
+                        lost.update((batch_bot_type, appended) for appended in appends)
+                        raise
+                    written.update((batch_bot_type, appended) for appended in appends)
+                    if batch_bot_type == "group":
+                        for group_id, (update, history, messages) in appends.items():
+                            self.groups.write_through(group_id, update, history, messages, documents.get(group_id))
+            except Exception as exception:
+                requeued = 0
+                dropped = 0
+                for key, pending in batch.items():
+                    if key[0] == "group":
+                        self.groups.invalidate(key[1])
+                    if key in written:
+                        continue
+                    pending.attempts += 1
+                    if key not in lost and self.requeue(key, pending):
+                        requeued += pending.entries()
+                    else:
+                        dropped += pending.entries()
+                metrics.incr("buffer.requeued", requeued)
+                metrics.incr("buffer.dropped", dropped)
+                counts = f"chats={len(batch)} written={len(written)} requeued={requeued} dropped={dropped}"
+                error_bot.log(log_name, f"{counts} exception={exception}")
+                return len(written)
+            finally:
+                self.flushing.difference_update(batch)
+                for key in batch:
+                    self.versions[key] = self.versions.get(key, 0) + 1
+                self.flushed.set()
+            entries = sum(pending.entries() for pending in batch.values())
+            metrics.observe("buffer.flush_sec", time.perf_counter() - start)
+            metrics.observe("buffer.flush_chats", len(batch))
+            metrics.incr("buffer.writes_saved", entries - len(batch))
+            debug_bot.log(log_name, f"chats={len(batch)} entries={entries}")
+            return len(batch)
+
+    async def run(self):
+        log_name: str = f"{FILE_NAME}: WriteBehindBuffer.run"
+        while True:
+            await asyncio.sleep(self.interval_sec)
+            try:
+                await self.flush()
+            except Exception as exception:
+                error_bot.log(log_name, f"exception={exception}")
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> int:
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        return await self.flush()
+
+
+write_buffer = WriteBehindBuffer(async_mongo_abbot, group_cache)
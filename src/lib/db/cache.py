@@ -0,0 +1,260 @@
+import copy
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+from bson import ObjectId
+from pymongo.results import UpdateResult
+
+from ..logger import debug_bot, error_bot
+from ..metrics import metrics
+from ..utils import try_get
+from ..db.utils import apply_append
+from ..db.async_mongo import AsyncMongoAbbot, async_mongo_abbot
+from ..abbot.config import BOT_GROUP_CACHE_CHANGE_STREAMS, BOT_GROUP_CACHE_MAX_GROUPS, BOT_GROUP_CACHE_REVALIDATE_SEC
+
+FILE_NAME = __name__
+WRITE_THROUGH_OPERATORS: Set[str] = {"$set", "$inc"}
+
+
+class CachedGroup:
+    def __init__(self, document: Dict):
+        self.object_id: Optional[ObjectId] = document.pop("_id", None)
+        self.document: Dict = document
+        self.version: int = document.get("version") or 0
+        self.validated_at: float = time.monotonic()
+
+    def to_dict(self):
+        return dict(id=self.document.get("id"), version=self.version, validated_at=self.validated_at)
+
+
+def project(document: Dict, fields: Optional[List[str]] = None, history_window: Optional[int] = None) -> Dict:
+    """
+    What MongoAbbot.projection(fields, history_window) would return for document, as a copy the caller can keep
+    """
+    if fields is None:
+        projected = {**document}
+    else:
+        projected = {field: document[field] for field in fields if field in document}
+        if history_window is not None:
+            projected["history_count"] = document.get("history_count")
+    if history_window is not None:
+        projected["history"] = document.get("history", [])[-history_window:] if history_window else []
+    return copy.deepcopy(projected)
+
+
+class GroupStateCache:
+    """
+    Bounded LRU of whole group documents in front of AsyncMongoAbbot. This process's writes go through it and
+    are applied to the cached copy when the returned version shows no other writer got in between. Writes from
+    other processes are caught by a change stream on the group collection, or, when change streams are
+    unavailable (standalone servers), by re-checking the document's version once an entry is older than
+    revalidate_sec
+    """
+
+    def __init__(
+        self,
+        mongo: AsyncMongoAbbot,
+        max_groups: int = BOT_GROUP_CACHE_MAX_GROUPS,
+        revalidate_sec: float = BOT_GROUP_CACHE_REVALIDATE_SEC,
+        change_streams: bool = BOT_GROUP_CACHE_CHANGE_STREAMS,
+    ):
+        self.mongo: AsyncMongoAbbot = mongo
+        self.max_groups: int = max_groups
+        self.revalidate_sec: float = revalidate_sec
+        self.change_streams: bool = change_streams
+        self.groups: OrderedDict[int, CachedGroup] = OrderedDict()
+        self.object_ids: Dict[ObjectId, int] = dict()
+        self.generations: Dict[int, int] = dict()
+        self.watching: bool = False
+        self.stopping: bool = False
+        self.watcher: Optional[asyncio.Task] = None
+        self.lookups: int = 0
+        self.hits: int = 0
+
+    def to_dict(self):
+        return dict(groups=len(self.groups), watching=self.watching, hit_rate=self.hit_rate())
+
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def record(self, result: str):
+        self.lookups += 1
+        if result in ("hit", "revalidated"):
+            self.hits += 1
+        metrics.incr("group_cache.lookups", result=result)
+        metrics.gauge("group_cache.hit_rate", self.hit_rate())
+        metrics.gauge("group_cache.groups", len(self.groups))
+
+    def remember(self, chat_id: int, document: Dict) -> CachedGroup:
+        cached = CachedGroup(document)
+        self.groups[chat_id] = cached
+        self.groups.move_to_end(chat_id)
+        if cached.object_id:
+            self.object_ids[cached.object_id] = chat_id
+        while len(self.groups) > self.max_groups:
+            _, evicted = self.groups.popitem(last=False)
+            self.object_ids.pop(evicted.object_id, None)
+            metrics.incr("group_cache.evictions")
+        return cached
+
+    def invalidate(self, chat_id: int, source: str = "write"):
+        self.generations[chat_id] = self.generations.get(chat_id, 0) + 1
+        cached: Optional[CachedGroup] = self.groups.pop(chat_id, None)
+        if cached:
+            self.object_ids.pop(cached.object_id, None)
+            metrics.incr("group_cache.invalidations", source=source)
+
+    async def load(self, chat_id: int) -> Optional[CachedGroup]:
+        """
+        Reads the group; the result is only cached if nothing wrote to the group while the read was in flight
+        """
+        generation: int = self.generations.get(chat_id, 0)
+        document: Optional[Dict] = await self.mongo.find_group_state(chat_id)
+        if not document:
+            return None
+        if self.generations.get(chat_id, 0) != generation:
+            return CachedGroup(document)
+        return self.remember(chat_id, document)
+
+    async def cached_group(self, chat_id: int) -> Optional[CachedGroup]:
+        cached: Optional[CachedGroup] = self.groups.get(chat_id)
+        if not cached:
+            self.record("miss")
+            return await self.load(chat_id)
+        self.groups.move_to_end(chat_id)
+        if self.watching or time.monotonic() - cached.validated_at < self.revalidate_sec:
+            self.record("hit")
+            return cached
+        probe: Optional[Dict] = await self.mongo.find_one_group({"id": chat_id}, ["version"])
+        if probe and (probe.get("version") or 0) == cached.version and self.groups.get(chat_id) is cached:
+            cached.validated_at = time.monotonic()
+            self.record("revalidated")
+            return cached
+        self.record("stale")
+        self.invalidate(chat_id, "version")
+        return await self.load(chat_id)
+
+    def write_through(self, chat_id: int, update: Dict, history: List[Dict], messages: List[Dict], result):
+        """
+        Applies a write this process made to the cached copy, or drops the copy if the write can't be replayed
+        or another writer got in between (the returned version isn't exactly one past the cached one)
+        """
+        self.generations[chat_id] = self.generations.get(chat_id, 0) + 1
+        cached: Optional[CachedGroup] = self.groups.get(chat_id)
+        if not cached:
+            return
+        version: Optional[int] = try_get(result, "version")
+        if version != cached.version + 1 or set(update) - WRITE_THROUGH_OPERATORS:
+            return self.invalidate(chat_id)
+        cached.document = apply_append(cached.document, update, history, messages, existing_only=False)
+        cached.document["version"] = cached.version = version
+        cached.validated_at = time.monotonic()
+        metrics.incr("group_cache.write_through")
+
+    # MongoAbbot surface
+    async def find_one_group(
+        self, filter: Dict, fields: Optional[List[str]] = None, history_window: Optional[int] = None
+    ) -> Optional[Dict]:
+        if set(filter) != {"id"}:
+            return await self.mongo.find_one_group(filter, fields, history_window)
+        cached: Optional[CachedGroup] = await self.cached_group(filter["id"])
+        return project(cached.document, fields, history_window) if cached else None
+
+    async def group_does_exist(self, filter: Dict) -> bool:
+        return await self.find_one_group(filter, ["id"]) is not None
+
+    async def get_group_config(self, filter: Dict) -> Optional[Dict]:
+        return try_get(await self.find_one_group(filter, ["config"]), "config")
+
+    async def append_group(
+        self,
+        chat_id: int,
+        update: Optional[Dict] = None,
+        history: Optional[List[Dict]] = None,
+        messages: Optional[List[Dict]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> Optional[Dict]:
+        result: Optional[Dict] = await self.mongo.append_group(chat_id, update, history, messages, fields)
+        self.write_through(chat_id, update or {}, history or [], messages or [], result)
+        return result
+
+    async def find_one_group_and_update(
+        self, filter: Dict, update: Dict, fields: Optional[List[str]] = None, history_window: Optional[int] = None
+    ) -> Optional[Dict]:
+        requested: Optional[List[str]] = None if fields is None else [*fields, "version"]
+        result: Optional[Dict] = await self.mongo.find_one_group_and_update(filter, update, requested, history_window)
+        self.write_through(try_get(filter, "id"), update, [], [], result)
+        return result
+
+    async def credit_group(self, chat_id: int, amount: int, kind: str, ref: Optional[str] = None) -> Optional[Dict]:
+        result: Optional[Dict] = await self.mongo.credit_group(chat_id, amount, kind, ref)
+        if result:
+            self.write_through(chat_id, {"$inc": {"balance": amount}}, [], [], result)
+        return result
+
+    async def debit_group(self, chat_id: int, amount: int, kind: str, ref: Optional[str] = None) -> Optional[Dict]:
+        result: Optional[Dict] = await self.mongo.debit_group(chat_id, amount, kind, ref)
+        if try_get(result, "applied"):
+            self.write_through(chat_id, {"$inc": {"balance": -result["applied"]}}, [], [], result)
+        return result
+
+    async def update_one_group(self, filter: Dict, update: Dict, upsert: bool = True) -> UpdateResult:
+        result: UpdateResult = await self.mongo.update_one_group(filter, update, upsert)
+        self.invalidate(try_get(filter, "id"))
+        return result
+
+    # change stream invalidation
+    def on_change(self, change: Dict):
+        chat_id: Optional[int] = self.object_ids.get(try_get(change, "documentKey", "_id"))
+        if chat_id is None:
+            return
+        version: Optional[int] = try_get(change, "updateDescription", "updatedFields", "version")
+        cached: Optional[CachedGroup] = self.groups.get(chat_id)
+        if cached and version is not None and version <= cached.version:
+            return
+        self.invalidate(chat_id, "change_stream")
+
+    def watch(self, loop: asyncio.AbstractEventLoop):
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}},
+            {"$project": {"documentKey": 1, "updateDescription.updatedFields.version": 1}},
+        ]
+        with self.mongo.groups.watch(pipeline, max_await_time_ms=1000) as stream:
+            loop.call_soon_threadsafe(setattr, self, "watching", True)
+            while not self.stopping:
+                change: Optional[Dict] = stream.try_next()
+                if change:
+                    loop.call_soon_threadsafe(self.on_change, change)
+
+    async def run_watcher(self):
+        log_name: str = f"{FILE_NAME}: GroupStateCache.run_watcher"
+        try:
+            await asyncio.to_thread(self.watch, asyncio.get_running_loop())
+        except Exception as exception:
+            # standalone servers have no change streams; version checks keep the cache coherent instead
+            debug_bot.log(log_name, f"change stream unavailable, revalidating by version: {exception}")
+        finally:
+            if self.watching:
+                self.groups.clear()
+                self.object_ids.clear()
+            self.watching = False
+
+    def start(self):
+        if self.change_streams and not self.watcher:
+            self.stopping = False
+            self.watcher = asyncio.create_task(self.run_watcher())
+
+    async def stop(self):
+        log_name: str = f"{FILE_NAME}: GroupStateCache.stop"
+        self.stopping = True
+        if self.watcher:
+            try:
+                await self.watcher
+            except Exception as exception:
+                error_bot.log(log_name, f"exception={exception}")
+            self.watcher = None
+
+
+group_cache = GroupStateCache(async_mongo_abbot)
@@ -0,0 +1,65 @@
+from typing import Dict, Iterator, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.cursor import Cursor
+
+from ..logger import debug_bot, error_bot
+from ..utils import success
+from ..db.mongo import btcusd_1m, mongo_abbot
+
+FILE_NAME = __name__
+
+# any chat id works: the winning plan depends on the query shape, not the value
+SAMPLE_CHAT_ID: int = 0
+
+
+def hot_queries() -> List[Tuple[str, Cursor]]:
+    """
+    The query shapes the handlers run on every update, as unexecuted cursors
+    """
+    chat_filter = {"id": SAMPLE_CHAT_ID}
+    queries = [
+        ("group by id", mongo_abbot.groups.find(chat_filter, {"_id": 0, "config": 1}).limit(1)),
+        ("dm by id", mongo_abbot.direct_messages.find(chat_filter, {"_id": 0, "history": {"$slice": -1}}).limit(1)),
+    ]
+    if mongo_abbot.db_name == "telegram":
+        bucket_filter = {"bot_type": "group", "chat_id": SAMPLE_CHAT_ID, "bucket": {"$gte": 0}}
+        queries += [
+            ("history buckets", mongo_abbot.history_buckets.find(bucket_filter).sort("bucket", ASCENDING)),
+            ("message buckets", mongo_abbot.message_buckets.find(bucket_filter).sort("bucket", ASCENDING)),
+            ("latest price", btcusd_1m.find({}).sort("_id", DESCENDING).limit(1)),
+        ]
+    return queries
+
+
+def plan_stages(plan: Dict) -> Iterator[str]:
+    """
+    Every stage name in a winning plan tree (classic inputStage/inputStages or slot-based queryPlan)
+    """
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("queryPlan", "inputStage"):
+        yield from plan_stages(plan.get(key))
+    for input_stage in plan.get("inputStages", []):
+        yield from plan_stages(input_stage)
+
+
+def explain_hot_queries() -> Dict:
+    """
+    Runs explain on each hot query and warns about any that fall back to a collection scan
+    """
+    log_name: str = f"{FILE_NAME}: explain_hot_queries"
+    report: Dict[str, List[str]] = dict()
+    collscans: List[str] = []
+    for name, cursor in hot_queries():
+        winning_plan: Dict = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        stages: List[str] = list(plan_stages(winning_plan))
+        report[name] = stages
+        if "COLLSCAN" in stages:
+            collscans.append(name)
+            error_bot.log(log_name, f"COLLSCAN: query={name} stages={stages}")
+        else:
+            debug_bot.log(log_name, f"query={name} stages={stages}")
+    return success(f"{len(collscans)} of {len(report)} hot queries scan a collection", data=report, collscans=collscans)
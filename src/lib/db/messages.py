@@ -0,0 +1,115 @@
+import zlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from bson.binary import Binary
+
+from ..utils import try_get
+from ..abbot.config import BOT_STORAGE_COMPRESS_MESSAGES, BOT_STORAGE_COMPRESS_MIN_BYTES
+
+FILE_NAME = __name__
+
+USER_FIELDS: List[str] = ["id", "username", "first_name", "last_name", "is_bot", "language_code"]
+CHAT_FIELDS: List[str] = ["id", "title", "type", "username"]
+
+
+def is_compact(message: Dict) -> bool:
+    return "message_id" not in message
+
+
+def compact_message(
+    message: Dict, compress: bool = BOT_STORAGE_COMPRESS_MESSAGES, min_bytes: int = BOT_STORAGE_COMPRESS_MIN_BYTES
+) -> Dict:
+    """
+    The fields we read from a raw telegram message (Message.to_dict()): ids, date, text or caption, the replied
+    to message id, sender id and username and entities as [type, offset, length]. The sender and chat objects
+    go to their own collections (see metadata_records). With compress, text of min_bytes or more is stored
+    zlib-compressed as text_z. Compact records are returned as they are
+    """
+    if is_compact(message):
+        return message
+    text: Optional[str] = try_get(message, "text") or try_get(message, "caption")
+    entities: List[Dict] = try_get(message, "entities") or try_get(message, "caption_entities") or []
+    record = {
+        "seq": try_get(message, "seq"),
+        "id": try_get(message, "message_id"),
+        "date": try_get(message, "date"),
+        "chat_id": try_get(message, "chat", "id"),
+        "from_id": try_get(message, "from", "id"),
+        "username": try_get(message, "from", "username"),
+        "reply_to": try_get(message, "reply_to_message", "message_id"),
+        "entities": [[entity["type"], entity["offset"], entity["length"]] for entity in entities] or None,
+    }
+    encoded: bytes = (text or "").encode()
+    if compress and text and len(encoded) >= min_bytes:
+        record["text_z"] = Binary(zlib.compress(encoded))
+    else:
+        record["text"] = text
+    return {key: value for key, value in record.items() if value is not None}
+
+
+def message_text(record: Dict) -> Optional[str]:
+    text_z: Optional[bytes] = try_get(record, "text_z")
+    if text_z is not None:
+        return zlib.decompress(text_z).decode()
+    return try_get(record, "text")
+
+
+def expand_message(record: Dict) -> Dict:
+    """
+    A compact record with its text decompressed; raw messages stored before compaction are returned as they are
+    """
+    if not is_compact(record) or "text_z" not in record:
+        return record
+    expanded = {key: value for key, value in record.items() if key != "text_z"}
+    expanded["text"] = message_text(record)
+    return expanded
+
+
+def metadata_records(message: Dict) -> List[Tuple[str, Dict]]:
+    """
+    ("user", ...) and ("chat", ...) records for the sender, chat and replied-to sender of a raw message
+    """
+    if is_compact(message):
+        return []
+    records: List[Tuple[str, Dict]] = []
+    for kind, source, fields in (
+        ("user", try_get(message, "from"), USER_FIELDS),
+        ("chat", try_get(message, "chat"), CHAT_FIELDS),
+        ("user", try_get(message, "reply_to_message", "from"), USER_FIELDS),
+    ):
+        if try_get(source, "id") is not None:
+            records.append((kind, {field: source[field] for field in fields if source.get(field) is not None}))
+    return records
+
+
+class MetadataTracker:
+    """
+    The user and chat metadata last written per id, so a sender seen again unchanged costs no write
+    """
+
+    def __init__(self, max_ids: int = 4096):
+        self.max_ids: int = max_ids
+        self.written: OrderedDict[Tuple[str, int], Dict] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        return dict(max_ids=self.max_ids, tracked=len(self.written))
+
+    def changed(self, kind: str, record: Dict) -> bool:
+        key: Tuple[str, int] = (kind, record["id"])
+        with self.lock:
+            unchanged: bool = self.written.get(key) == record
+            self.written[key] = record
+            self.written.move_to_end(key)
+            while len(self.written) > self.max_ids:
+                self.written.popitem(last=False)
+            return not unchanged
+
+    def forget(self, kind: str, chat_or_user_id: int):
+        with self.lock:
+            self.written.pop((kind, chat_or_user_id), None)
+
+
+metadata_tracker = MetadataTracker()
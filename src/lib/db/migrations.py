@@ -0,0 +1,162 @@
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import bson
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+from ..logger import debug_bot
+from ..utils import success
+from ..db.mongo import LEGACY_CHAT_FILTER, PRICE_ROLLUPS, btcusd, btcusd_ticks, mongo_abbot
+from ..db.messages import compact_message
+from ..abbot.context import history_tokens, with_tokens
+from ..abbot.config import BOT_PRICE_TICK_RETENTION_SEC
+
+FILE_NAME = __name__
+
+
+def backfill_collection_history_tokens(collection: Collection, batch_size: int = 100) -> int:
+    """
+    Adds a "tokens" count to every history entry missing one and sets the document's running "tokens" total.
+    Each write is guarded on the history length it was computed from, so entries pushed meanwhile are never lost
+    """
+    log_name: str = f"{FILE_NAME}: backfill_collection_history_tokens"
+    missing_tokens_filter = {"history": {"$elemMatch": {"tokens": {"$exists": False}}}}
+    updated = 0
+    operations: List[UpdateOne] = []
+    for document in collection.find(missing_tokens_filter, {"_id": 1, "history": 1}):
+        history: List[Dict] = [with_tokens(entry) for entry in document.get("history", [])]
+        operations.append(
+            UpdateOne(
+                {"_id": document["_id"], "history": {"$size": len(history)}},
+                {"$set": {"history": history, "tokens": history_tokens(history)}},
+            )
+        )
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    debug_bot.log(log_name, f"collection={collection.full_name} updated={updated}")
+    return updated
+
+
+def backfill_history_tokens(batch_size: int = 100) -> Dict:
+    groups_updated = backfill_collection_history_tokens(mongo_abbot.groups, batch_size)
+    dms_updated = backfill_collection_history_tokens(mongo_abbot.direct_messages, batch_size)
+    return success("History tokens backfilled", groups=groups_updated, dms=dms_updated)
+
+
+def bucket_collection_history(collection: Collection, bot_type: str) -> int:
+    """
+    Moves the full history and messages arrays of every legacy document (one still holding messages, or without
+    a history_count) into the bucket collections, leaving only the recent history window and the counters on it.
+    A document that changed meanwhile is skipped; it still holds its messages, so the next run or the next append
+    to that chat buckets it
+    """
+    log_name: str = f"{FILE_NAME}: bucket_collection_history"
+    migrated = 0
+    projection = {"_id": 1, "id": 1, "history": 1, "messages": 1, "history_count": 1}
+    for document in collection.find(LEGACY_CHAT_FILTER, projection):
+        migrated += mongo_abbot.bucket_legacy_chat(bot_type, document)
+    debug_bot.log(log_name, f"collection={collection.full_name} migrated={migrated}")
+    return migrated
+
+
+def bucket_history() -> Dict:
+    groups_migrated = bucket_collection_history(mongo_abbot.groups, "group")
+    dms_migrated = bucket_collection_history(mongo_abbot.direct_messages, "dm")
+    return success("History and messages bucketed", groups=groups_migrated, dms=dms_migrated)
+
+
+def encoded_size(document: Dict) -> int:
+    return len(bson.encode(document))
+
+
+def compact_message_array(collection: Collection, field: str, raw_filter: Dict) -> Dict[str, int]:
+    """
+    Replaces the raw telegram messages in the field array of every matching document with compact records,
+    writing their sender and chat metadata first. Each write is guarded on the array length it was computed from,
+    so a document appended to meanwhile is skipped and compacted on the next run
+    """
+    log_name: str = f"{FILE_NAME}: compact_message_array"
+    compacted = bytes_before = bytes_after = 0
+    for document in collection.find(raw_filter, {"_id": 1, field: 1}):
+        messages: List[Dict] = document.get(field, [])
+        mongo_abbot.upsert_message_metadata(messages)
+        compact_messages: List[Dict] = [compact_message(message) for message in messages]
+        result = collection.update_one(
+            {"_id": document["_id"], field: {"$size": len(messages)}}, {"$set": {field: compact_messages}}
+        )
+        if result.modified_count:
+            compacted += 1
+            bytes_before += encoded_size({field: messages})
+            bytes_after += encoded_size({field: compact_messages})
+    saved = bytes_before - bytes_after
+    debug_bot.log(log_name, f"collection={collection.full_name} compacted={compacted} bytes_saved={saved}")
+    return dict(documents=compacted, bytes_before=bytes_before, bytes_after=bytes_after, bytes_saved=saved)
+
+
+def compact_messages() -> Dict:
+    """
+    Converts stored raw telegram messages to compact records: message bucket entries and the messages arrays of
+    group and dm documents not yet bucketed. Reports the BSON bytes saved per collection
+    """
+    raw_entries = {"entries.message_id": {"$exists": True}}
+    raw_messages = {"messages.message_id": {"$exists": True}}
+    report = dict(
+        message_buckets=compact_message_array(mongo_abbot.message_buckets, "entries", raw_entries),
+        groups=compact_message_array(mongo_abbot.groups, "messages", raw_messages),
+        dms=compact_message_array(mongo_abbot.direct_messages, "messages", raw_messages),
+    )
+    bytes_saved = sum(collection_report["bytes_saved"] for collection_report in report.values())
+    return success("Messages compacted", bytes_saved=bytes_saved, **report)
+
+
+def rollup_prices(batch_size: int = 1000) -> Dict:
+    """
+    Moves the legacy prices.btcusd documents into the minute and hour rollups, and into the tick collection
+    when still within its retention. Documents are flagged batch by batch, so an interrupted run resumes where
+    it stopped (a batch cut off mid-write is counted again); drop prices.btcusd once this reports nothing left
+    """
+    log_name: str = f"{FILE_NAME}: rollup_prices"
+    tick_cutoff: int = int(time.time()) - BOT_PRICE_TICK_RETENTION_SEC
+    migrated = ticks = 0
+    legacy = btcusd.find({"migrated": {"$exists": False}, "amount": {"$exists": True}}).sort("_id", 1)
+    batch: List[Dict] = []
+    for price in legacy:
+        batch.append(price)
+        if len(batch) < batch_size:
+            continue
+        ticks += rollup_price_batch(batch, tick_cutoff)
+        migrated += len(batch)
+        batch = []
+    if batch:
+        ticks += rollup_price_batch(batch, tick_cutoff)
+        migrated += len(batch)
+    debug_bot.log(log_name, f"migrated={migrated} ticks={ticks}")
+    return success("Prices rolled up", migrated=migrated, ticks=ticks)
+
+
+def rollup_price_batch(batch: List[Dict], tick_cutoff: int) -> int:
+    operations: Dict[int, List[UpdateOne]] = {resolution: [] for resolution in PRICE_ROLLUPS}
+    recent_ticks: List[Dict] = []
+    for price in batch:
+        fetched_at, amount = int(price["_id"]), float(price["amount"])
+        for resolution, operation in mongo_abbot.price_rollup_operations(fetched_at, amount).items():
+            operations[resolution].append(operation)
+        if fetched_at >= tick_cutoff:
+            recent_ticks.append(
+                {
+                    "ts": datetime.fromtimestamp(fetched_at, timezone.utc),
+                    "pair": {"base": price.get("base", "BTC"), "currency": price.get("currency", "USD")},
+                    "amount": amount,
+                }
+            )
+    for resolution, rollup_operations in operations.items():
+        PRICE_ROLLUPS[resolution].bulk_write(rollup_operations)
+    if recent_ticks:
+        btcusd_ticks.insert_many(recent_ticks, ordered=False)
+    btcusd.update_many({"_id": {"$in": [price["_id"] for price in batch]}}, {"$set": {"migrated": True}})
+    return len(recent_ticks)
@@ -1,24 +1,50 @@
 from abc import abstractmethod
-from datetime import datetime
+from datetime import datetime, timezone
 from cli_args import TELEGRAM_MODE, TEST_MODE, DEV_MODE
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 from nostr_sdk import PublicKey, EventId, Event
 
 from telegram import Chat, ChatMember, Message
 
-from pymongo import MongoClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient, ReplaceOne, ReturnDocument, UpdateOne
 from pymongo.collection import Collection
 from pymongo.cursor import Cursor
+from pymongo.errors import OperationFailure
 from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult
 from bson.typings import _DocumentType
 
-from ..logger import debug_bot
-from ..utils import success, to_dict, try_get
+from ..logger import debug_bot, error_bot
+from ..utils import error, success, to_dict, try_get
+from ..db.messages import compact_message, expand_message, metadata_records, metadata_tracker
 from ..abbot.env import DATABASE_CONNECTION_STRING
-from ..abbot.config import BOT_SYSTEM_OBJECT_GROUPS, BOT_SYSTEM_OBJECT_DMS
-
-client = MongoClient(host=DATABASE_CONNECTION_STRING)
+from ..abbot.exceptions.exception import AbbotException, PartialAppendError
+from ..abbot.config import (
+    BOT_DATABASE_CONNECT_TIMEOUT_MS,
+    BOT_DATABASE_MAX_POOL_SIZE,
+    BOT_DATABASE_MIN_POOL_SIZE,
+    BOT_DATABASE_SERVER_SELECTION_TIMEOUT_MS,
+    BOT_DATABASE_SOCKET_TIMEOUT_MS,
+    BOT_DATABASE_WAIT_QUEUE_TIMEOUT_MS,
+    BOT_LEDGER_DEBIT_RETRIES,
+    BOT_LEDGER_REFS_KEPT,
+    BOT_PRICE_MINUTE_RETENTION_SEC,
+    BOT_PRICE_TICK_RETENTION_SEC,
+    BOT_STORAGE_BUCKET_SIZE,
+    BOT_STORAGE_HISTORY_WINDOW,
+    BOT_SYSTEM_OBJECT_DMS,
+    BOT_SYSTEM_OBJECT_GROUPS,
+)
+
+client = MongoClient(
+    host=DATABASE_CONNECTION_STRING,
+    maxPoolSize=BOT_DATABASE_MAX_POOL_SIZE,
+    minPoolSize=BOT_DATABASE_MIN_POOL_SIZE,
+    connectTimeoutMS=BOT_DATABASE_CONNECT_TIMEOUT_MS,
+    serverSelectionTimeoutMS=BOT_DATABASE_SERVER_SELECTION_TIMEOUT_MS,
+    socketTimeoutMS=BOT_DATABASE_SOCKET_TIMEOUT_MS,
+    waitQueueTimeoutMS=BOT_DATABASE_WAIT_QUEUE_TIMEOUT_MS,
+)
 
 if TEST_MODE:
     telegram_db_name = "test_telegram"
@@ -41,12 +67,28 @@ nostr_channel_invites = nostr_db.get_collection("channel_invite")
 telegram_db = client.get_database(telegram_db_name)
 telegram_groups = telegram_db.get_collection("group")
 telegram_dms = telegram_db.get_collection("dm")
-
-bitcoin_prices = client.get_database("bitcoin_prices")
-btcusd = bitcoin_prices.get_collection("btcusd")
+telegram_history_buckets = telegram_db.get_collection("history_bucket")
+telegram_message_buckets = telegram_db.get_collection("message_bucket")
+telegram_ledger = telegram_db.get_collection("ledger")
+telegram_users = telegram_db.get_collection("user")
+telegram_chats = telegram_db.get_collection("chat")
+telegram_invoices = telegram_db.get_collection("invoice")
 
 db_prices = client.get_database("prices")
+# legacy one-document-per-fetch collection, only read by the --rollup-prices migration
 btcusd = db_prices.get_collection("btcusd")
+BTCUSD_TICKS = "btcusd_ticks"
+btcusd_ticks = db_prices.get_collection(BTCUSD_TICKS)
+btcusd_1m = db_prices.get_collection("btcusd_1m")
+btcusd_1h = db_prices.get_collection("btcusd_1h")
+# rollup collection by resolution in seconds; rollup _ids are the epoch second their interval starts at
+PRICE_ROLLUPS: Dict[int, Collection] = {60: btcusd_1m, 3600: btcusd_1h}
+
+# projections for callers that never read history
+COUNTER_FIELDS: List[str] = ["history_count", "message_count", "version"]
+CHAT_STATE_FIELDS: List[str] = ["id", "title", "type", "created_at", "balance", "config", "tokens", "summary"]
+# chat documents still holding their full history and messages arrays, from before bucketing
+LEGACY_CHAT_FILTER: Dict = {"$or": [{"messages": {"$exists": True}}, {"history_count": {"$exists": False}}]}
 
 
 @to_dict
@@ -151,22 +193,159 @@ class MongoAbbot(MongoNostr, MongoTelegram):
         if db_name == "telegram":
             self.groups: Collection[_DocumentType] = telegram_groups
             self.direct_messages: Collection[_DocumentType] = telegram_dms
+            self.history_buckets: Collection[_DocumentType] = telegram_history_buckets
+            self.message_buckets: Collection[_DocumentType] = telegram_message_buckets
+            self.ledger: Collection[_DocumentType] = telegram_ledger
+            self.users: Collection[_DocumentType] = telegram_users
+            self.chats: Collection[_DocumentType] = telegram_chats
+            self.invoices: Collection[_DocumentType] = telegram_invoices
+            # (bot_type, chat_id) of chats known to hold no legacy arrays, so appends skip the check
+            self.bucketed_chats: Set[Tuple[str, int]] = set()
         elif db_name == "nostr":
             self.groups: Collection[_DocumentType] = nostr_channels
             self.direct_messages: Collection[_DocumentType] = nostr_dms
+        # raw ticks are only written once they are known to expire, see ensure_price_collections
+        self.tick_retention: bool = False
+        self.ensure_indexes()
+        if db_name == "telegram":
+            self.ensure_price_collections()
 
     @abstractmethod
     def to_dict(self):
         pass
 
-    def insert_one_price(self, price: Dict) -> InsertOneResult:
-        return btcusd.insert_one(price)
-
-    def find_prices_cursor(self) -> InsertOneResult:
-        return btcusd.find()
-
-    def find_prices(self) -> List:
-        return [price for price in btcusd.find()]
+    # indexes
+    def index_specs(self) -> List[Tuple[Collection, List[IndexModel]]]:
+        id_unique = [IndexModel([("id", ASCENDING)], unique=True)]
+        specs = [(self.groups, id_unique), (self.direct_messages, id_unique)]
+        if self.db_name == "telegram":
+            specs += [(self.users, id_unique), (self.chats, id_unique)]
+            minute_ttl = IndexModel([("at", ASCENDING)], expireAfterSeconds=BOT_PRICE_MINUTE_RETENTION_SEC)
+            specs.append((btcusd_1m, [minute_ttl]))
+            bucket_keys = [("bot_type", ASCENDING), ("chat_id", ASCENDING), ("bucket", ASCENDING)]
+            specs.append((self.history_buckets, [IndexModel(bucket_keys, unique=True)]))
+            specs.append((self.message_buckets, [IndexModel(bucket_keys, unique=True)]))
+            specs.append((self.ledger, [IndexModel([("chat_id", ASCENDING), ("created_at", ASCENDING)])]))
+            invoice_keys = [IndexModel([("invoice_id", ASCENDING)], unique=True), IndexModel([("status", ASCENDING)])]
+            specs.append((self.invoices, invoice_keys))
+        return specs
+
+    def ensure_indexes(self) -> Dict:
+        """
+        Creates any missing index; existing ones with the same keys and options are left alone, so this is safe
+        on every start. A conflict (e.g. duplicate ids blocking a unique index) is logged, not raised
+        """
+        log_name: str = f"{FILE_NAME}: MongoAbbot.ensure_indexes"
+        created: Dict[str, List[str]] = dict()
+        for collection, indexes in self.index_specs():
+            try:
+                created[collection.full_name] = collection.create_indexes(indexes)
+            except OperationFailure as failure:
+                error_bot.log(log_name, f"collection={collection.full_name} failure={failure}")
+        debug_bot.log(log_name, f"created={created}")
+        return success("Indexes ensured", data=created)
+
+    # prices
+    def ensure_price_collections(self) -> Dict:
+        """
+        Creates the raw tick time-series collection, expiring ticks after tick_retention_sec, or brings an
+        existing one's retention in line with the config. Time-series collections need MongoDB 5.0+; without
+        them (or the rights to collMod) ticks go to a plain collection with a TTL index on ts instead, and when
+        that fails too no raw ticks are written at all rather than kept forever
+        """
+        log_name: str = f"{FILE_NAME}: MongoAbbot.ensure_price_collections"
+        try:
+            if BTCUSD_TICKS in db_prices.list_collection_names(filter={"name": BTCUSD_TICKS}):
+                db_prices.command("collMod", BTCUSD_TICKS, expireAfterSeconds=BOT_PRICE_TICK_RETENTION_SEC)
+            else:
+                db_prices.create_collection(
+                    BTCUSD_TICKS,
+                    timeseries={"timeField": "ts", "metaField": "pair", "granularity": "seconds"},
+                    expireAfterSeconds=BOT_PRICE_TICK_RETENTION_SEC,
+                )
+        except OperationFailure as failure:
+            error_bot.log(log_name, f"collection={btcusd_ticks.full_name} time-series failure={failure}")
+            return self.ensure_tick_ttl_index()
+        self.tick_retention = True
+        return success("Price collections ensured", retention_sec=BOT_PRICE_TICK_RETENTION_SEC)
+
+    def ensure_tick_ttl_index(self) -> Dict:
+        """
+        Expires ticks in a plain collection with a TTL index on ts, updating an existing one's retention
+        """
+        log_name: str = f"{FILE_NAME}: MongoAbbot.ensure_tick_ttl_index"
+        try:
+            try:
+                btcusd_ticks.create_index([("ts", ASCENDING)], expireAfterSeconds=BOT_PRICE_TICK_RETENTION_SEC)
+            except OperationFailure:
+                # same keys with another expireAfterSeconds: change it in place
+                index = {"keyPattern": {"ts": 1}, "expireAfterSeconds": BOT_PRICE_TICK_RETENTION_SEC}
+                db_prices.command("collMod", BTCUSD_TICKS, index=index)
+        except OperationFailure as failure:
+            self.tick_retention = False
+            error_bot.log(log_name, f"collection={btcusd_ticks.full_name} failure={failure}: not storing raw ticks")
+            return error("Price collections not ensured", failure=str(failure))
+        self.tick_retention = True
+        debug_bot.log(log_name, f"collection={btcusd_ticks.full_name} expires ticks with a TTL index")
+        return success("Price collections ensured", retention_sec=BOT_PRICE_TICK_RETENTION_SEC, ttl_index=True)
+
+    def price_rollup_operations(self, fetched_at: int, amount: float) -> Dict[int, UpdateOne]:
+        """
+        Per rollup resolution, the upsert folding one tick into its interval's open/high/low/close, count and
+        sum. A pipeline update, so a tick arriving out of order only moves open or close when it is the
+        interval's earliest or latest
+        """
+        operations: Dict[int, UpdateOne] = dict()
+        for resolution in PRICE_ROLLUPS:
+            start: int = fetched_at - fetched_at % resolution
+            fold = {
+                "at": datetime.fromtimestamp(start, timezone.utc),
+                "open": {"$cond": [{"$lte": [fetched_at, {"$ifNull": ["$first_at", fetched_at]}]}, amount, "$open"]},
+                "close": {"$cond": [{"$gte": [fetched_at, {"$ifNull": ["$last_at", fetched_at]}]}, amount, "$close"]},
+                "high": {"$max": ["$high", amount]},
+                "low": {"$min": ["$low", amount]},
+                "first_at": {"$min": ["$first_at", fetched_at]},
+                "last_at": {"$max": ["$last_at", fetched_at]},
+                "count": {"$add": [{"$ifNull": ["$count", 0]}, 1]},
+                "sum": {"$add": [{"$ifNull": ["$sum", 0]}, amount]},
+            }
+            operations[resolution] = UpdateOne({"_id": start}, [{"$set": fold}], upsert=True)
+        return operations
+
+    def insert_one_price(self, price: Dict) -> Optional[InsertOneResult]:
+        """
+        Stores a fetched price ({_id: epoch seconds, amount, base, currency}) as a raw tick and folds it into
+        the minute and hour rollups. The raw tick is skipped when nothing would expire it
+        """
+        fetched_at: int = int(price["_id"])
+        amount: float = float(price["amount"])
+        tick = {
+            "ts": datetime.fromtimestamp(fetched_at, timezone.utc),
+            "pair": {"base": price.get("base", "BTC"), "currency": price.get("currency", "USD")},
+            "amount": amount,
+        }
+        result: Optional[InsertOneResult] = btcusd_ticks.insert_one(tick) if self.tick_retention else None
+        for resolution, operation in self.price_rollup_operations(fetched_at, amount).items():
+            PRICE_ROLLUPS[resolution].bulk_write([operation])
+        return result
+
+    def find_latest_price(self) -> Optional[Dict]:
+        """
+        The newest price, from the close of the latest minute rollup: a single _id index seek however many
+        ticks are stored. Shaped like a fetched price, with _id the epoch second of the newest tick
+        """
+        rollup: Optional[Dict] = btcusd_1m.find_one({}, sort=[("_id", DESCENDING)])
+        if not rollup:
+            return None
+        return {"_id": rollup["last_at"], "amount": rollup["close"], "base": "BTC", "currency": "USD"}
+
+    def find_price_range(self, start: int, end: int, resolution: int = 60) -> List[Dict]:
+        """
+        Rollups (resolution 60 or 3600) whose interval starts in [start, end) epoch seconds, oldest first, each
+        with its average. Reads one rollup document per interval, never the raw ticks
+        """
+        cursor = PRICE_ROLLUPS[resolution].find({"_id": {"$gte": start, "$lt": end}}).sort("_id", ASCENDING)
+        return [{**rollup, "average": rollup["sum"] / rollup["count"]} for rollup in cursor]
 
     # create docs
     def insert_one_group(self, channel: Dict) -> InsertOneResult:
@@ -182,36 +361,67 @@ class MongoAbbot(MongoNostr, MongoTelegram):
         return self.direct_messages.insert_many(direct_messages)
 
     # read
+    def projection(self, fields: Optional[List[str]] = None, history_window: Optional[int] = None) -> Dict:
+        """
+        Projection for the named top-level fields (the whole document when None), optionally with only the
+        last history_window entries of history. A $slice on its own is an exclusion projection, so a sliced
+        field list also takes history_count to stay an inclusion one (and to give callers the window offset)
+        """
+        if fields is not None and not fields and history_window is None:
+            return {"_id": 1}
+        projection: Dict = {"_id": 0}
+        if fields is not None:
+            projection.update({field: 1 for field in fields})
+        if history_window is not None:
+            projection["history"] = {"$slice": -history_window}
+            if fields is not None:
+                projection["history_count"] = 1
+        return projection
+
     def find_groups(self, filter: Dict) -> List[Optional[_DocumentType]]:
         return [channel for channel in self.groups.find(filter, {"_id": 0})]
 
     def find_groups_cursor(self, filter: Dict) -> Cursor:
         return self.groups.find(filter, {"_id": 0})
 
-    def find_one_group(self, filter: Dict) -> Optional[_DocumentType]:
-        return self.groups.find_one(filter, {"_id": 0})
+    def find_one_group(
+        self, filter: Dict, fields: Optional[List[str]] = None, history_window: Optional[int] = None
+    ) -> Optional[_DocumentType]:
+        return self.groups.find_one(filter, self.projection(fields, history_window))
 
-    def find_one_group_and_update(self, filter: Dict, update: Dict) -> Optional[_DocumentType]:
+    def find_one_group_and_update(
+        self, filter: Dict, update: Dict, fields: Optional[List[str]] = None, history_window: Optional[int] = None
+    ) -> Optional[_DocumentType]:
         return self.groups.find_one_and_update(
             filter,
-            update,
-            return_document=True,
+            self.versioned(update),
+            return_document=ReturnDocument.AFTER,
             upsert=True,
-            projection={"_id": 0},
+            projection=self.projection(fields, history_window),
         )
 
-    def find_one_dm(self, filter: Dict) -> Optional[_DocumentType]:
-        return self.direct_messages.find_one(filter, {"_id": 0})
+    def find_one_dm(
+        self, filter: Dict, fields: Optional[List[str]] = None, history_window: Optional[int] = None
+    ) -> Optional[_DocumentType]:
+        return self.direct_messages.find_one(filter, self.projection(fields, history_window))
 
-    def find_one_dm_and_update(self, filter: Dict, update: Dict) -> Optional[_DocumentType]:
+    def find_one_dm_and_update(
+        self, filter: Dict, update: Dict, fields: Optional[List[str]] = None, history_window: Optional[int] = None
+    ) -> Optional[_DocumentType]:
         return self.direct_messages.find_one_and_update(
             filter,
-            update,
-            return_document=True,
+            self.versioned(update),
+            return_document=ReturnDocument.AFTER,
             upsert=True,
-            projection={"_id": 0},
+            projection=self.projection(fields, history_window),
         )
 
+    def find_group_state(self, chat_id: int) -> Optional[_DocumentType]:
+        """
+        The whole group document including _id, which change stream events identify documents by
+        """
+        return self.groups.find_one({"id": chat_id})
+
     def find_dms(self, filter: Dict) -> List[Optional[_DocumentType]]:
         return [dm for dm in self.direct_messages.find(filter, {"_id": 0})]
 
@@ -219,42 +429,488 @@ class MongoAbbot(MongoNostr, MongoTelegram):
         return self.direct_messages.find(filter, {"_id": 0})
 
     # update docs
-    def update_one(self, collection: str, filter: Dict, update: Dict) -> UpdateResult:
+    def versioned(self, update: Dict) -> Dict:
+        """
+        update plus a bump of the document's version, which caches compare to spot writes from other processes
+        """
+        return {**update, "$inc": {**update.get("$inc", {}), "version": 1}}
+
+    def update_one(self, collection: str, filter: Dict, update: Dict, upsert: bool = True) -> UpdateResult:
         if collection == "dm":
-            return self.update_one_dm(filter, update, return_document=True, upsert=True)
+            return self.update_one_dm(filter, update, upsert)
         else:
-            return self.update_one_group(filter, update, return_document=True, upsert=True)
-
-    def update_one_group(self, filter: Dict, update: Dict) -> UpdateResult:
-        return self.groups.update_one(filter, update, return_document=True, upsert=True)
+            return self.update_one_group(filter, update, upsert)
+
+    def update_one_group(self, filter: Dict, update: Dict, upsert: bool = True) -> UpdateResult:
+        return self.groups.update_one(filter, self.versioned(update), upsert=upsert)
+
+    def update_one_dm(self, filter, update: Dict, upsert: bool = True) -> UpdateResult:
+        return self.direct_messages.update_one(filter, self.versioned(update), upsert=upsert)
+
+    # bucketed history and messages
+    def chat_collection(self, bot_type: str) -> Collection:
+        return self.direct_messages if bot_type == "dm" else self.groups
+
+    def bucket_entries(self, start_seq: int, entries: List[Dict]) -> Dict[int, List[Dict]]:
+        """
+        Numbers entries from start_seq and groups them by bucket (seq // bucket_size)
+        """
+        buckets: Dict[int, List[Dict]] = dict()
+        for seq, entry in enumerate(entries, start=start_seq):
+            buckets.setdefault(seq // BOT_STORAGE_BUCKET_SIZE, []).append({**entry, "seq": seq})
+        return buckets
+
+    def bucket_operations(self, bot_type: str, chat_id: int, start_seq: int, entries: List[Dict]) -> List[UpdateOne]:
+        """
+        Upserts appending entries numbered from start_seq to the (bot_type, chat_id, seq // bucket_size) buckets
+        """
+        now = datetime.now().isoformat()
+        return [
+            UpdateOne(
+                {"bot_type": bot_type, "chat_id": chat_id, "bucket": bucket},
+                {
+                    "$push": {"entries": {"$each": entries_in_bucket}},
+                    "$inc": {"count": len(entries_in_bucket)},
+                    "$set": {"updated_at": now},
+                    "$setOnInsert": {"created_at": now},
+                },
+                upsert=True,
+            )
+            for bucket, entries_in_bucket in self.bucket_entries(start_seq, entries).items()
+        ]
+
+    def append_to_buckets(self, buckets: Collection, bot_type: str, chat_id: int, start_seq: int, entries: List[Dict]):
+        operations: List[UpdateOne] = self.bucket_operations(bot_type, chat_id, start_seq, entries)
+        if operations:
+            buckets.bulk_write(operations, ordered=False)
+
+    def upsert_message_metadata(self, messages: List[Dict]) -> int:
+        """
+        Writes the sender and chat metadata carried by raw messages to the user and chat collections, skipping
+        whatever was last written unchanged. Returns the number of upserts
+        """
+        changed: Dict[str, Dict[int, Dict]] = {"user": dict(), "chat": dict()}
+        for message in messages:
+            for kind, record in metadata_records(message):
+                if metadata_tracker.changed(kind, record):
+                    changed[kind][record["id"]] = record
+        now = datetime.now().isoformat()
+        for kind, collection in (("user", self.users), ("chat", self.chats)):
+            if not changed[kind]:
+                continue
+            operations: List[UpdateOne] = [
+                UpdateOne(
+                    {"id": record_id},
+                    {"$set": {**record, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+                    upsert=True,
+                )
+                for record_id, record in changed[kind].items()
+            ]
+            try:
+                collection.bulk_write(operations, ordered=False)
+            except Exception:
+                for record_id in changed[kind]:
+                    metadata_tracker.forget(kind, record_id)
+                raise
+        return len(changed["user"]) + len(changed["chat"])
+
+    def compact_messages(self, messages: List[Dict]) -> List[Dict]:
+        """
+        Compact records of raw telegram messages, after their user and chat metadata is written
+        """
+        if messages:
+            self.upsert_message_metadata(messages)
+        return [compact_message(message) for message in messages]
+
+    def chat_append_update(self, update: Optional[Dict], history: List[Dict], messages: List[Dict]) -> Dict:
+        """
+        update plus the counter increments and the capped $push of history onto the recent window
+        """
+        update: Dict = {**(update or {})}
+        update["$inc"] = {**update.get("$inc", {}), "history_count": len(history), "message_count": len(messages)}
+        update = self.versioned(update)
+        if history:
+            window_push = {"$each": history, "$slice": -BOT_STORAGE_HISTORY_WINDOW}
+            update["$push"] = {**update.get("$push", {}), "history": window_push}
+        return update
+
+    def bucket_replacements(self, bot_type: str, chat_id: int, entries: List[Dict]) -> List[ReplaceOne]:
+        """
+        Upserts writing entries numbered from 0 as whole (bot_type, chat_id, seq // bucket_size) buckets
+        """
+        now = datetime.now().isoformat()
+        return [
+            ReplaceOne(
+                {"bot_type": bot_type, "chat_id": chat_id, "bucket": bucket},
+                {
+                    "bot_type": bot_type,
+                    "chat_id": chat_id,
+                    "bucket": bucket,
+                    "entries": bucket_entries,
+                    "count": len(bucket_entries),
+                    "created_at": now,
+                    "updated_at": now,
+                },
+                upsert=True,
+            )
+            for bucket, bucket_entries in self.bucket_entries(0, entries).items()
+        ]
+
+    def bucket_legacy_chat(self, bot_type: str, document: Dict) -> bool:
+        """
+        Moves a legacy chat document's full history and messages arrays into the bucket collections, leaving the
+        recent history window and the counters on it. The write is guarded on the array lengths it was computed
+        from, so False means the document changed meanwhile and must be read and bucketed again. A document that
+        already has counters (appended to before it was bucketed) keeps its history, which is already windowed,
+        and has its messages appended after the ones counted. Both writes bump the version, so a cached copy of
+        the legacy document is dropped
+        """
+        collection: Collection = self.chat_collection(bot_type)
+        chat_id: int = document.get("id")
+        history: List[Dict] = document.get("history", [])
+        messages: List[Dict] = document.get("messages", [])
+        unchanged_filter: Dict = {"_id": document["_id"], "history": {"$size": len(history)}}
+        if "messages" in document:
+            unchanged_filter["messages"] = {"$size": len(messages)}
+        if "history_count" in document:
+            counted: Optional[_DocumentType] = collection.find_one_and_update(
+                unchanged_filter,
+                self.versioned({"$unset": {"messages": ""}, "$inc": {"message_count": len(messages)}}),
+                return_document=ReturnDocument.AFTER,
+                projection={"_id": 0, "message_count": 1},
+            )
+            if not counted:
+                return False
+            message_start: int = counted["message_count"] - len(messages)
+            self.append_to_buckets(self.message_buckets, bot_type, chat_id, message_start, messages)
+            return True
+        history_operations: List[ReplaceOne] = self.bucket_replacements(bot_type, chat_id, history)
+        if history_operations:
+            self.history_buckets.bulk_write(history_operations, ordered=False)
+        message_operations: List[ReplaceOne] = self.bucket_replacements(bot_type, chat_id, messages)
+        if message_operations:
+            self.message_buckets.bulk_write(message_operations, ordered=False)
+        result: UpdateResult = collection.update_one(
+            unchanged_filter,
+            self.versioned(
+                {
+                    "$set": {
+                        "history": history[-BOT_STORAGE_HISTORY_WINDOW:],
+                        "history_count": len(history),
+                        "message_count": len(messages),
+                    },
+                    "$unset": {"messages": ""},
+                }
+            ),
+        )
+        return bool(result.modified_count)
+
+    def ensure_bucketed(self, bot_type: str, chat_id: int, attempts: int = 3):
+        """
+        Buckets the chat's legacy document before anything is appended to it, so an append never counts from 0
+        over history that was never bucketed nor trims it to the recent window. Checked once per chat per process
+        """
+        log_name: str = f"{FILE_NAME}: MongoAbbot.ensure_bucketed"
+        if (bot_type, chat_id) in self.bucketed_chats:
+            return
+        collection: Collection = self.chat_collection(bot_type)
+        for _ in range(attempts):
+            document: Optional[_DocumentType] = collection.find_one(
+                {"id": chat_id, **LEGACY_CHAT_FILTER},
+                {"_id": 1, "id": 1, "history": 1, "messages": 1, "history_count": 1},
+            )
+            if not document or self.bucket_legacy_chat(bot_type, document):
+                self.bucketed_chats.add((bot_type, chat_id))
+                if document:
+                    debug_bot.log(log_name, f"Bucketed legacy {bot_type} chat_id={chat_id}")
+                return
+        raise AbbotException(f"Legacy {bot_type} chat_id={chat_id} kept changing while being bucketed")
+
+    def append_chat(
+        self,
+        bot_type: str,
+        chat_id: int,
+        update: Optional[Dict] = None,
+        history: Optional[List[Dict]] = None,
+        messages: Optional[List[Dict]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> Optional[_DocumentType]:
+        """
+        Applies update to the chat document, keeping only the last history_window entries of history on it and
+        counting both streams, then appends history and messages to their bucket collections. The counters
+        returned with the updated document number the new entries, so concurrent appends never collide.
+        fields limits the returned document (the counters are always included)
+        """
+        self.ensure_bucketed(bot_type, chat_id)
+        history: List[Dict] = history or []
+        messages: List[Dict] = self.compact_messages(messages or [])
+        document: Optional[_DocumentType] = self.chat_collection(bot_type).find_one_and_update(
+            {"id": chat_id},
+            self.chat_append_update(update, history, messages),
+            return_document=ReturnDocument.AFTER,
+            upsert=True,
+            projection=self.projection(None if fields is None else [*fields, *COUNTER_FIELDS]),
+        )
+        history_count: int = try_get(document, "history_count", default=0)
+        message_count: int = try_get(document, "message_count", default=0)
+        self.append_to_buckets(self.history_buckets, bot_type, chat_id, history_count - len(history), history)
+        self.append_to_buckets(self.message_buckets, bot_type, chat_id, message_count - len(messages), messages)
+        return document
+
+    def append_chats(
+        self, bot_type: str, appends: Dict[int, Tuple[Dict, List[Dict], List[Dict]]]
+    ) -> Dict[int, Optional[_DocumentType]]:
+        """
+        append_chat for many chats ({chat_id: (update, history, messages)}): one counter-returning update per
+        chat, then a single bulk_write per bucket collection for all of their entries. Returns each chat's
+        counters after its append. A chat whose counter update fails is skipped and the rest are still written;
+        PartialAppendError then lists the skipped chats, which were not touched and can be appended again
+        """
+        log_name: str = f"{FILE_NAME}: MongoAbbot.append_chats"
+        documents: Dict[int, Optional[_DocumentType]] = dict()
+        history_operations: List[UpdateOne] = []
+        message_operations: List[UpdateOne] = []
+        unwritten: List[int] = []
+        cause: Optional[Exception] = None
+        try:
+            self.upsert_message_metadata([message for _, _, messages in appends.values() for message in messages])
+        except Exception as exception:
+            raise PartialAppendError(bot_type, list(appends), documents, exception)
+        for chat_id, (update, history, messages) in appends.items():
+            try:
+                self.ensure_bucketed(bot_type, chat_id)
+                messages = [compact_message(message) for message in messages]
+                document: Optional[_DocumentType] = self.chat_collection(bot_type).find_one_and_update(
+                    {"id": chat_id},
+                    self.chat_append_update(update, history, messages),
+                    return_document=ReturnDocument.AFTER,
+                    upsert=True,
+                    projection={"_id": 0, **{field: 1 for field in COUNTER_FIELDS}},
+                )
+            except Exception as exception:
+                error_bot.log(log_name, f"bot_type={bot_type} chat_id={chat_id} exception={exception}")
+                unwritten.append(chat_id)
+                cause = exception
+                continue
+            documents[chat_id] = document
+            history_start: int = try_get(document, "history_count", default=0) - len(history)
+            message_start: int = try_get(document, "message_count", default=0) - len(messages)
+            history_operations += self.bucket_operations(bot_type, chat_id, history_start, history)
+            message_operations += self.bucket_operations(bot_type, chat_id, message_start, messages)
+        if history_operations:
+            self.history_buckets.bulk_write(history_operations, ordered=False)
+        if message_operations:
+            self.message_buckets.bulk_write(message_operations, ordered=False)
+        if unwritten:
+            raise PartialAppendError(bot_type, unwritten, documents, cause)
+        return documents
+
+    def append_group(
+        self,
+        chat_id: int,
+        update: Optional[Dict] = None,
+        history: Optional[List[Dict]] = None,
+        messages: Optional[List[Dict]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> Optional[_DocumentType]:
+        return self.append_chat("group", chat_id, update, history, messages, fields)
+
+    def append_dm(
+        self,
+        chat_id: int,
+        update: Optional[Dict] = None,
+        history: Optional[List[Dict]] = None,
+        messages: Optional[List[Dict]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> Optional[_DocumentType]:
+        return self.append_chat("dm", chat_id, update, history, messages, fields)
+
+    def history_offset(self, document: Optional[Dict]) -> int:
+        """
+        Sequence number of the first entry in the document's recent history window
+        """
+        window: List[Dict] = try_get(document, "history", default=[])
+        history_count: int = try_get(document, "history_count", default=len(window))
+        return max(0, history_count - len(window))
+
+    def find_bucket_entries(
+        self, buckets: Collection, bot_type: str, chat_id: int, start_seq: int = 0, end_seq: Optional[int] = None
+    ) -> List[Dict]:
+        bucket_filter: Dict = {"$gte": start_seq // BOT_STORAGE_BUCKET_SIZE}
+        if end_seq is not None:
+            bucket_filter["$lte"] = max(start_seq, end_seq - 1) // BOT_STORAGE_BUCKET_SIZE
+        cursor = buckets.find(
+            {"bot_type": bot_type, "chat_id": chat_id, "bucket": bucket_filter}, {"_id": 0, "entries": 1}
+        ).sort("bucket", ASCENDING)
+        entries = sorted((entry for bucket in cursor for entry in bucket["entries"]), key=lambda entry: entry["seq"])
+        return [entry for entry in entries if entry["seq"] >= start_seq and (end_seq is None or entry["seq"] < end_seq)]
+
+    def find_history_range(self, bot_type: str, chat_id: int, start_seq: int, end_seq: int) -> List[Dict]:
+        return self.find_bucket_entries(self.history_buckets, bot_type, chat_id, start_seq, end_seq)
+
+    def find_recent_history(self, bot_type: str, chat_id: int, n: int) -> List[Dict]:
+        """
+        Last n history entries, oldest first: from the document's recent window when it holds enough, otherwise
+        from the newest history buckets
+        """
+        document: Optional[_DocumentType] = self.chat_collection(bot_type).find_one(
+            {"id": chat_id}, {"_id": 0, "history": {"$slice": -n}, "history_count": 1}
+        )
+        window: List[Dict] = try_get(document, "history", default=[])
+        history_count: int = try_get(document, "history_count", default=len(window))
+        if len(window) >= n or len(window) >= history_count:
+            return window
+        entries: List[Dict] = []
+        cursor = self.history_buckets.find({"bot_type": bot_type, "chat_id": chat_id}, {"_id": 0, "entries": 1}).sort(
+            "bucket", DESCENDING
+        )
+        for bucket in cursor:
+            entries = sorted(bucket["entries"], key=lambda entry: entry["seq"]) + entries
+            if len(entries) >= n:
+                break
+        return entries[-n:]
+
+    def find_recent_messages(self, bot_type: str, chat_id: int, n: int) -> List[Dict]:
+        message_count: int = try_get(
+            self.chat_collection(bot_type).find_one({"id": chat_id}, {"_id": 0, "message_count": 1}),
+            "message_count",
+            default=0,
+        )
+        start_seq = max(0, message_count - n)
+        entries: List[Dict] = self.find_bucket_entries(self.message_buckets, bot_type, chat_id, start_seq)
+        return [expand_message(entry) for entry in entries]
+
+    # invoices
+    def insert_one_invoice(self, invoice: Dict) -> InsertOneResult:
+        return self.invoices.insert_one({**invoice, "status": "open", "created_at": datetime.now().isoformat()})
+
+    def find_open_invoices(self) -> List[_DocumentType]:
+        return list(self.invoices.find({"status": "open"}, {"_id": 0}))
+
+    def close_invoice(self, invoice_id: str, status: str) -> Optional[_DocumentType]:
+        """
+        Marks an open invoice paid or expired. None when it was not open, i.e. another settle got there first
+        """
+        return self.invoices.find_one_and_update(
+            {"invoice_id": invoice_id, "status": "open"},
+            {"$set": {"status": status, "closed_at": datetime.now().isoformat()}},
+            projection={"_id": 0},
+        )
 
-    def update_one_dm(self, filter, update: Dict) -> UpdateResult:
-        return self.direct_messages.update_one(filter, update, return_document=True, upsert=True)
+    # ledger
+    def record_ledger_entry(
+        self, chat_id: int, kind: str, amount: int, applied: int, balance: Optional[int], ref: Optional[str] = None
+    ) -> Optional[InsertOneResult]:
+        """
+        Inserts the immutable record of a balance change that has already been applied to the group. A failed
+        insert is logged rather than raised: the balance has moved either way
+        """
+        log_name: str = f"{FILE_NAME}: MongoAbbot.record_ledger_entry"
+        entry = {
+            "bot_type": "group",
+            "chat_id": chat_id,
+            "kind": kind,
+            "amount": amount,
+            "applied": applied,
+            "balance": balance,
+            "ref": ref,
+            "created_at": datetime.now().isoformat(),
+        }
+        try:
+            return self.ledger.insert_one(entry)
+        except Exception as exception:
+            error_bot.log(log_name, f"entry={entry} exception={exception}")
+            return None
+
+    def credit_group(self, chat_id: int, amount: int, kind: str, ref: Optional[str] = None) -> Optional[_DocumentType]:
+        """
+        Adds amount sats to the group's balance with a single $inc and records the ledger entry. A ref (e.g. an
+        invoice id) is credited at most once: the $inc only matches while the ref isn't among the group's last
+        refs_kept. Returns the new balance and version, or None when the group is missing or ref was credited
+        """
+        filter: Dict = {"id": chat_id}
+        update: Dict = {"$inc": {"balance": amount}}
+        if ref:
+            filter["ledger_refs"] = {"$ne": ref}
+            update["$push"] = {"ledger_refs": {"$each": [ref], "$slice": -BOT_LEDGER_REFS_KEPT}}
+        document: Optional[_DocumentType] = self.groups.find_one_and_update(
+            filter,
+            self.versioned(update),
+            return_document=ReturnDocument.AFTER,
+            projection={"_id": 0, "balance": 1, "version": 1},
+        )
+        if not document:
+            return None
+        self.record_ledger_entry(chat_id, kind, amount, amount, document["balance"], ref)
+        return {**document, "applied": amount}
+
+    def debit_group(self, chat_id: int, amount: int, kind: str, ref: Optional[str] = None) -> Optional[_DocumentType]:
+        """
+        Takes amount sats from the group's balance, clamped at 0, and records the ledger entry. The full debit is
+        a $inc conditional on balance >= amount; otherwise whatever is left is taken with a $inc conditional on
+        the balance just read, retried if another debit or credit lands in between. Returns the new balance,
+        version and the applied (sats actually taken), or None when the group is missing
+        """
+        log_name: str = f"{FILE_NAME}: MongoAbbot.debit_group"
+        projection = {"_id": 0, "balance": 1, "version": 1}
+        for _ in range(BOT_LEDGER_DEBIT_RETRIES):
+            document: Optional[_DocumentType] = self.groups.find_one_and_update(
+                {"id": chat_id, "balance": {"$gte": amount}},
+                self.versioned({"$inc": {"balance": -amount}}),
+                return_document=ReturnDocument.AFTER,
+                projection=projection,
+            )
+            applied: int = amount
+            if not document:
+                current: Optional[_DocumentType] = self.groups.find_one({"id": chat_id}, projection)
+                if not current:
+                    return None
+                remaining = try_get(current, "balance", default=0) or 0
+                if remaining <= 0:
+                    document, applied = current, 0
+                else:
+                    document = self.groups.find_one_and_update(
+                        {"id": chat_id, "balance": remaining},
+                        self.versioned({"$inc": {"balance": -remaining}}),
+                        return_document=ReturnDocument.AFTER,
+                        projection=projection,
+                    )
+                    applied = remaining
+            if document:
+                self.record_ledger_entry(chat_id, kind, -amount, -applied, try_get(document, "balance"), ref)
+                return {**document, "applied": applied}
+        error_bot.log(log_name, f"chat_id={chat_id} amount={amount} gave up after {BOT_LEDGER_DEBIT_RETRIES} retries")
+        return None
+
+    def ledger_balance(self, chat_id: int) -> int:
+        """
+        Sum of the group's ledger entries, to audit the materialized balance against
+        """
+        pipeline = [{"$match": {"chat_id": chat_id}}, {"$group": {"_id": None, "balance": {"$sum": "$applied"}}}]
+        return try_get(next(self.ledger.aggregate(pipeline), None), "balance", default=0)
 
     # custom reads
     def get_group_config(self, filter: {}) -> Optional[_DocumentType]:
-        group: TelegramGroup = self.find_one_group(filter)
+        group: TelegramGroup = self.find_one_group(filter, ["config"])
         return try_get(group, "config")
 
     def get_group_balance(self, filter: {}) -> int:
-        group: TelegramGroup = self.find_one_group(filter)
+        group: TelegramGroup = self.find_one_group(filter, ["balance"])
         return try_get(group, "balance")
 
-    def get_group_history(self, filter: {}) -> int:
-        group: TelegramGroup = self.find_one_group(filter)
+    def get_group_history(self, filter: {}, history_window: Optional[int] = None) -> List[Dict]:
+        group: TelegramGroup = self.find_one_group(filter, ["history"], history_window)
         return try_get(group, "history", default=[])
 
-    def get_dm_history(self, filter) -> int:
-        dm: TelegramDM = self.find_one_dm(filter)
+    def get_dm_history(self, filter, history_window: Optional[int] = None) -> List[Dict]:
+        dm: TelegramDM = self.find_one_dm(filter, ["history"], history_window)
         return try_get(dm, "history", default=[])
 
-    def group_does_exist(self, filter) -> int:
-        group: TelegramGroup = self.find_one_group(filter)
-        return group != None
+    def group_does_exist(self, filter) -> bool:
+        return self.groups.find_one(filter, {"_id": 1}) != None
 
-    def dm_does_exist(self, filter) -> int:
-        dm: TelegramDM = self.find_one_dm(filter)
-        return dm != None
+    def dm_does_exist(self, filter) -> bool:
+        return self.direct_messages.find_one(filter, {"_id": 1}) != None
 
 
 db_name = "telegram" if TELEGRAM_MODE else "nostr"
@@ -1,8 +1,9 @@
 from functools import wraps
-from typing import Callable
+from typing import Callable, Dict, List, Optional
 from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult
 
 from lib.utils import try_get
+from lib.abbot.config import BOT_STORAGE_HISTORY_WINDOW
 
 
 def successful_update_one(result: UpdateResult) -> bool:
@@ -51,3 +52,46 @@ def decorator_successful_insert_many(func: Callable) -> bool:
         return successful_insert_many(func(*args, **kwargs))
 
     return wrapper
+
+
+def apply_update(document: Dict, update: Dict, existing_only: bool = True) -> Dict:
+    """
+    A copy of document with the update's $set and $inc applied, dotted paths included. With existing_only,
+    top-level fields the document doesn't have (e.g. projected away) are left out
+    """
+    document = {**document}
+    for operator in ("$set", "$inc"):
+        for path, value in update.get(operator, {}).items():
+            *parents, key = path.split(".")
+            target: Optional[Dict] = document
+            for parent in parents:
+                if not isinstance(try_get(target, parent), dict):
+                    target = None
+                    break
+                target[parent] = {**target[parent]}
+                target = target[parent]
+            if target is None or (existing_only and not parents and key not in target):
+                continue
+            target[key] = value if operator == "$set" else (target.get(key) or 0) + value
+    return document
+
+
+def apply_append(
+    document: Dict,
+    update: Dict,
+    history: List[Dict],
+    messages: List[Dict],
+    history_window: Optional[int] = None,
+    existing_only: bool = True,
+) -> Dict:
+    """
+    document as it will read once the append is written (see apply_update for existing_only)
+    """
+    document = apply_update(document, update, existing_only)
+    if "history" in document:
+        document["history"] = [*document["history"], *history][-(history_window or BOT_STORAGE_HISTORY_WINDOW) :]
+    if "history_count" in document:
+        document["history_count"] += len(history)
+    if "message_count" in document:
+        document["message_count"] += len(messages)
+    return document
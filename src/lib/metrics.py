@@ -0,0 +1,92 @@
+import asyncio
+from collections import defaultdict, deque
+from typing import Deque, Dict, Optional
+
+from lib.logger import debug_bot
+
+FILE_NAME = __name__
+MAX_OBSERVATIONS = 1000
+
+
+def metric_key(name: str, **labels) -> str:
+    if not labels:
+        return name
+    label_str = ",".join(f"{key}={value}" for key, value in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+class Metrics:
+    """
+    Process-local counters, gauges and bounded observation windows
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.gauges: Dict[str, float] = dict()
+        self.observations: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=MAX_OBSERVATIONS))
+        self.task: Optional[asyncio.Task] = None
+
+    def to_dict(self):
+        return self.snapshot()
+
+    def incr(self, name: str, value: int = 1, **labels) -> int:
+        key = metric_key(name, **labels)
+        self.counters[key] += value
+        return self.counters[key]
+
+    def gauge(self, name: str, value: float, **labels) -> float:
+        self.gauges[metric_key(name, **labels)] = value
+        return value
+
+    def observe(self, name: str, value: float, **labels) -> float:
+        self.observations[metric_key(name, **labels)].append(value)
+        return value
+
+    def summary(self, name: str, **labels) -> Dict:
+        values = sorted(self.observations.get(metric_key(name, **labels), []))
+        if not values:
+            return dict(count=0)
+        count = len(values)
+        return dict(
+            count=count,
+            mean=sum(values) / count,
+            p50=values[int(count * 0.50)],
+            p95=values[min(count - 1, int(count * 0.95))],
+            max=values[-1],
+        )
+
+    def snapshot(self) -> Dict:
+        return dict(
+            counters=dict(self.counters),
+            gauges=dict(self.gauges),
+            observations={key: self.summary(key) for key in list(self.observations.keys())},
+        )
+
+    def log(self):
+        log_name: str = f"{FILE_NAME}: Metrics.log"
+        debug_bot.log(log_name, f"metrics={self.snapshot()}")
+
+    def start(self, interval_sec: float):
+        """
+        Logs a snapshot every interval_sec; 0 disables it
+        """
+        if interval_sec > 0 and not self.task:
+            self.task = asyncio.create_task(self.log_every(interval_sec))
+
+    async def log_every(self, interval_sec: float):
+        while True:
+            await asyncio.sleep(interval_sec)
+            self.log()
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self.log()
+
+
+metrics = Metrics()
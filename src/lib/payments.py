@@ -1,27 +1,42 @@
-from typing import Dict
+from typing import Dict, Iterable, List, Optional, Set
 from abc import ABC, abstractmethod
 
+import hmac
 import time
 import httpx
+import asyncio
+import hashlib
+from urllib.parse import urlencode
 from httpx import Response
 from pymongo.results import InsertOneResult
 
-from lib.db.mongo import mongo_abbot
+from lib.db.async_mongo import async_mongo_abbot
 from lib.logger import debug_bot, error_bot
 from lib.db.utils import successful_insert_one
-from lib.abbot.env import PAYMENT_PROCESSOR_KIND, PRICE_PROVIDER_KIND, LNBITS_BASE_URL
+from lib.abbot.env import PAYMENT_PROCESSOR_KIND, PRICE_PROVIDER_KIND, LNBITS_BASE_URL, PAYMENT_WEBHOOK_SECRET
+from lib.abbot.config import BOT_INVOICES_STRIKE_PAGE_SIZE, BOT_PAYMENT_WEBHOOKS_ENABLED, BOT_PAYMENT_WEBHOOKS_URL
 from lib.utils import error, success, successful_response, try_get
 
 FILE_NAME = __name__
 
 
+def hmac_hex(secret: str, message: str | bytes) -> str:
+    """
+    Hex HMAC-SHA256, the signature Strike, OpenNode and the LNbits webhook token use
+    """
+    message: bytes = message.encode() if isinstance(message, str) else message
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
 class PaymentProcessor(ABC):
     """
     An abstract class that all payment processors should implement.
     """
 
+    CHAT_ID_INVOICE_ID_MAP = {}
+
     @abstractmethod
-    def get_invoice(self, correlation_id, description):
+    def get_invoice(self, correlation_id, description, amount, chat_id):
         pass
 
     @abstractmethod
@@ -32,17 +47,39 @@ class PaymentProcessor(ABC):
     def expire_invoice(self, invoice_id):
         pass
 
+    async def register_webhook(self):
+        """
+        Processors whose settlement webhooks are an account-wide subscription set it up here
+        """
+        pass
+
+    async def invoices_paid(self, invoice_ids: Iterable[str]) -> Set[str]:
+        """
+        Which of invoice_ids are paid, checked concurrently; an invoice whose check fails counts as unpaid
+        """
+        log_name: str = f"{FILE_NAME}: PaymentProcessor.invoices_paid"
+        invoice_ids: List[str] = list(invoice_ids)
+        checks = [self.invoice_is_paid(invoice_id) for invoice_id in invoice_ids]
+        results = await asyncio.gather(*checks, return_exceptions=True)
+        paid: Set[str] = set()
+        for invoice_id, is_paid in zip(invoice_ids, results):
+            if isinstance(is_paid, Exception):
+                error_bot.log(log_name, f"invoice_id={invoice_id} exception={is_paid}")
+            elif is_paid:
+                paid.add(invoice_id)
+        return paid
+
 
 class Strike(PaymentProcessor):
     """
     A Strike payment processor
     """
 
-    CHAT_ID_INVOICE_ID_MAP = {}
-
-    def __init__(self, api_key):
+    def __init__(self, api_key, webhook_url: Optional[str] = None, webhook_secret: Optional[str] = None):
         super().__init__()
         assert api_key is not None, "a Strike API key must be supplied"
+        self.webhook_url: Optional[str] = webhook_url
+        self.webhook_secret: Optional[str] = webhook_secret
         self._client = httpx.AsyncClient(
             base_url="https://api.strike.me/v1",
             headers={
@@ -90,11 +127,55 @@ class Strike(PaymentProcessor):
         resp_data: Dict = resp.json()
         return try_get(resp_data, "state") == "PAID"
 
+    async def invoices_paid(self, invoice_ids: Iterable[str]) -> Set[str]:
+        """
+        One request for the newest paid invoices covers every open one paid since; ids it cannot account for
+        (the page was full, or the request failed) are checked one by one
+        """
+        log_name: str = f"{FILE_NAME}: Strike.invoices_paid"
+        invoice_ids: Set[str] = set(invoice_ids)
+        params = {"$filter": "state eq 'PAID'", "$orderby": "created desc", "$top": BOT_INVOICES_STRIKE_PAGE_SIZE}
+        try:
+            resp: Response = await self._client.get("/invoices", params=params)
+            items: List[Dict] = try_get(resp.json(), "items", default=[]) if successful_response(resp) else None
+        except (httpx.HTTPError, ValueError) as exception:
+            error_bot.log(log_name, f"exception={exception}")
+            items = None
+        if items is None:
+            return await super().invoices_paid(invoice_ids)
+        paid: Set[str] = {try_get(item, "invoiceId") for item in items} & invoice_ids
+        if len(items) < BOT_INVOICES_STRIKE_PAGE_SIZE:
+            return paid
+        return paid | await super().invoices_paid(invoice_ids - paid)
+
     async def expire_invoice(self, invoice_id):
         resp: Response = await self._client.patch(f"/invoices/{invoice_id}/cancel")
         resp_data: Dict = resp.json()
         return try_get(resp_data, "state") == "CANCELLED"
 
+    async def register_webhook(self):
+        """
+        Subscribes webhook_url to invoice.updated events unless a subscription for it already exists
+        """
+        log_name: str = f"{FILE_NAME}: Strike.register_webhook"
+        if not self.webhook_url:
+            return
+        resp: Response = await self._client.get("/subscriptions")
+        subscriptions: List[Dict] = resp.json() if successful_response(resp) else []
+        if any(try_get(subscription, "webhookUrl") == self.webhook_url for subscription in subscriptions):
+            return debug_bot.log(log_name, f"Already subscribed webhook_url={self.webhook_url}")
+        resp = await self._client.post(
+            "/subscriptions",
+            json={
+                "webhookUrl": self.webhook_url,
+                "webhookVersion": "v1",
+                "secret": self.webhook_secret,
+                "enabled": True,
+                "eventTypes": ["invoice.updated"],
+            },
+        )
+        debug_bot.log(log_name, f"Subscribed webhook_url={self.webhook_url} status={resp.status_code}")
+
     async def get_bitcoin_price(self):
         # TODO: implement
         raise NotImplementedError("")
@@ -117,10 +198,12 @@ class LNbits(PaymentProcessor):
     An LNbits payment processor
     """
 
-    def __init__(self, base_url, api_key):
+    def __init__(self, base_url, api_key, webhook_url: Optional[str] = None, webhook_secret: Optional[str] = None):
         super().__init__()
         assert base_url is not None, "an LNbits base URL must be supplied"
         assert api_key is not None, "an LNbits API key must be supplied"
+        self.webhook_url: Optional[str] = webhook_url
+        self.webhook_secret: Optional[str] = webhook_secret
         self._client = httpx.AsyncClient(
             base_url=f"{base_url}/api/v1",
             headers={
@@ -129,32 +212,54 @@ class LNbits(PaymentProcessor):
             },
         )
 
-    async def get_invoice(self, correlation_id, description):
-        create_resp = await self._client.post(
+    async def get_invoice(self, correlation_id, description, amount, chat_id):
+        log_name: str = f"{FILE_NAME}: LNbits.get_invoice()"
+        create_resp: Response = await self._client.post(
             "/payments",
             json={
                 "out": False,
-                "amount": 1,
+                "amount": amount,
                 "unit": "USD",
                 "unhashed_description": description.encode("utf-8").hex(),
                 "extra": {
                     "correlationId": correlation_id,
                 },
+                **self.webhook(correlation_id),
             },
         )
-        payment_request = try_get(create_resp, "payment_request")
-        payment_hash = try_get(create_resp, "payment_hash")
-        payment_resp = await self._client.get(f"/payments/{payment_hash}")
-
-        return (
-            payment_hash,
-            payment_request,
-            int(try_get(payment_resp, "details", "expiry")),
+        debug_bot.log(log_name, f"lnbits => get_invoice => create_resp={create_resp.text}")
+        if not create_resp.is_success:
+            return error("Failed to create invoice", data=create_resp.text)
+        create_data: Dict = create_resp.json()
+        payment_hash = try_get(create_data, "payment_hash")
+        self.CHAT_ID_INVOICE_ID_MAP[chat_id] = payment_hash
+
+        payment_resp: Response = await self._client.get(f"/payments/{payment_hash}")
+        payment_data: Dict = payment_resp.json()
+        debug_bot.log(log_name, f"lnbits => get_invoice => payment_data={payment_data}")
+        expiry = try_get(payment_data, "details", "expiry")
+
+        return success(
+            "Invoice created",
+            invoice_id=payment_hash,
+            ln_invoice=try_get(create_data, "payment_request"),
+            expiration_in_sec=int(expiry) if expiry is not None else None,
         )
 
+    def webhook(self, correlation_id: str) -> Dict:
+        """
+        LNbits calls the webhook set on each invoice and does not sign it, so the url carries a token only this
+        process can derive from the correlation id
+        """
+        if not self.webhook_url:
+            return dict()
+        token: str = hmac_hex(self.webhook_secret, correlation_id)
+        return dict(webhook=f"{self.webhook_url}?{urlencode(dict(correlation_id=correlation_id, token=token))}")
+
     async def invoice_is_paid(self, payment_hash):
-        resp = await self._client.get(f"/payments/{payment_hash}")
-        return try_get(resp, "paid")
+        resp: Response = await self._client.get(f"/payments/{payment_hash}")
+        resp_data: Dict = resp.json()
+        return try_get(resp_data, "paid") is True
 
     async def expire_invoice(self, invoice_id):
         """LNbits doesn't seem to have an explicit way to expire an invoice"""
@@ -166,9 +271,10 @@ class OpenNode(PaymentProcessor):
     An OpenNode payment processor
     """
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, webhook_url: Optional[str] = None):
         super().__init__()
         assert api_key is not None, "an OpenNode API key with invoice permissions must be supplied"
+        self.webhook_url: Optional[str] = webhook_url
         self._client = httpx.AsyncClient(
             base_url="https://api.opennode.com",
             headers={
@@ -178,26 +284,38 @@ class OpenNode(PaymentProcessor):
             },
         )
 
-    async def get_invoice(self, correlation_id, description):
-        resp = await self._client.post(
+    async def get_invoice(self, correlation_id, description, amount, chat_id):
+        log_name: str = f"{FILE_NAME}: OpenNode.get_invoice()"
+        resp: Response = await self._client.post(
             "/v1/charges",
             json={
-                "amount": 1,
+                "amount": amount,
                 "currency": "USD",
                 "order_id": correlation_id,
                 "description": description,
+                **(dict(callback_url=self.webhook_url) if self.webhook_url else dict()),
             },
         )
+        debug_bot.log(log_name, f"opennode => get_invoice => resp={resp.text}")
+        if not resp.is_success:
+            return error("Failed to create invoice", data=resp.text)
+        charge: Dict = try_get(resp.json(), "data")
+        invoice_id = try_get(charge, "id")
+        self.CHAT_ID_INVOICE_ID_MAP[chat_id] = invoice_id
+        # a charge's ttl is in minutes
+        ttl = try_get(charge, "ttl")
 
-        return (
-            try_get(resp, "data", "id"),
-            try_get(resp, "data", "lightning_invoice", "payreq"),
-            try_get(resp, "data", "ttl"),
+        return success(
+            "Invoice created",
+            invoice_id=invoice_id,
+            ln_invoice=try_get(charge, "lightning_invoice", "payreq"),
+            expiration_in_sec=int(ttl) * 60 if ttl is not None else None,
         )
 
     async def invoice_is_paid(self, invoice_id):
-        resp = await self._client.get(f"/v2/charge/{invoice_id}")
-        return try_get(resp, "data", "status") == "paid"
+        resp: Response = await self._client.get(f"/v2/charge/{invoice_id}")
+        resp_data: Dict = resp.json()
+        return try_get(resp_data, "data", "status") == "paid"
 
     async def expire_invoice(self, invoice_id):
         """OpenNode doesn't seem to have an explicit way to expire an invoice"""
@@ -257,8 +375,9 @@ class Coinbase(Provider):
             return error("No response data", data=json)
         price_data = {**resp_data, "_id": int(time.time())}
         price_doc: CoinbasePrice = CoinbasePrice(**price_data).to_dict()
-        insert_result: InsertOneResult = mongo_abbot.insert_one_price(price_doc)
-        if not successful_insert_one(insert_result):
+        insert_result: Optional[InsertOneResult] = await async_mongo_abbot.insert_one_price(price_doc)
+        # no result when raw ticks are not stored (see MongoAbbot.ensure_price_collections)
+        if insert_result is not None and not successful_insert_one(insert_result):
             error_message = f"response={response} \n json={json} \n resp_data={resp_data}"
             error_message = f"{error_message} \n price_data={price_data} \n price_doc={price_doc}"
             error_message = f"{error_message} \n insert_result={insert_result}"
@@ -274,9 +393,12 @@ def init_payment_processor() -> Strike | LNbits | OpenNode:
         raise Exception(f"PAYMENT_PROCESSOR_KIND must be one of {', '.join(available_processors)}")
     if not PAYMENT_PROCESSOR_TOKEN.strip():
         raise Exception("PAYMENT_PROCESSOR_TOKEN must be a valid API token")
+    webhook_url: Optional[str] = None
+    if BOT_PAYMENT_WEBHOOKS_ENABLED and BOT_PAYMENT_WEBHOOKS_URL:
+        webhook_url = f"{BOT_PAYMENT_WEBHOOKS_URL.rstrip('/')}/{PAYMENT_PROCESSOR_KIND}"
     if PAYMENT_PROCESSOR_KIND == "strike":
-        return Strike(PAYMENT_PROCESSOR_TOKEN)
+        return Strike(PAYMENT_PROCESSOR_TOKEN, webhook_url, PAYMENT_WEBHOOK_SECRET)
     elif PAYMENT_PROCESSOR_KIND == "lnbits":
-        return LNbits(LNBITS_BASE_URL, PAYMENT_PROCESSOR_TOKEN)
+        return LNbits(LNBITS_BASE_URL, PAYMENT_PROCESSOR_TOKEN, webhook_url, PAYMENT_WEBHOOK_SECRET)
     elif PAYMENT_PROCESSOR_KIND == "opennode":
-        return OpenNode(PAYMENT_PROCESSOR_TOKEN)
+        return OpenNode(PAYMENT_PROCESSOR_TOKEN, webhook_url)
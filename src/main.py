@@ -1,4 +1,15 @@
-from cli_args import DEV_MODE, TEST_MODE, TELEGRAM_MODE, NOSTR_MODE
+from cli_args import (
+    BACKFILL_TOKENS_MODE,
+    BUCKET_HISTORY_MODE,
+    COMPACT_MESSAGES_MODE,
+    DEV_MODE,
+    EXPLAIN_MODE,
+    TEST_MODE,
+    TELEGRAM_MODE,
+    NOSTR_MODE,
+    ROLLUP_PRICES_MODE,
+    WEBHOOK_MODE,
+)
 from lib.abbot.exceptions.exception import AbbotException
 from lib.logger import debug_bot
 
@@ -13,9 +24,29 @@ if __name__ == "__main__":
         #     raise AbbotException(
         #         "Do not run in production mode unless you are sure: python src/main.py [--telegram | --nostr] [--dev | --test]"
         #     )
-        if TELEGRAM_MODE:
+        if BACKFILL_TOKENS_MODE:
+            from lib.db.migrations import backfill_history_tokens
+
+            debug_bot.log(FILE_NAME, f"{backfill_history_tokens()}")
+        elif BUCKET_HISTORY_MODE:
+            from lib.db.migrations import bucket_history
+
+            debug_bot.log(FILE_NAME, f"{bucket_history()}")
+        elif COMPACT_MESSAGES_MODE:
+            from lib.db.migrations import compact_messages
+
+            debug_bot.log(FILE_NAME, f"{compact_messages()}")
+        elif ROLLUP_PRICES_MODE:
+            from lib.db.migrations import rollup_prices
+
+            debug_bot.log(FILE_NAME, f"{rollup_prices()}")
+        elif EXPLAIN_MODE:
+            from lib.db.explain import explain_hot_queries
+
+            debug_bot.log(FILE_NAME, f"{explain_hot_queries()}")
+        elif TELEGRAM_MODE:
             telegram_abbot: TelegramBotBuilder = TelegramBotBuilder()
-            telegram_abbot.run()
+            telegram_abbot.run(webhook=WEBHOOK_MODE)
         # elif NOSTR_MODE:
         #     nostr_abbot: NostrBotBuilder = NostrBotBuilder()
         #     nostr_abbot.add_relays_connect_and_start_client()
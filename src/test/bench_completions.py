@@ -0,0 +1,65 @@
+"""
+Throughput of Abbot.chat_completion (blocking, on the default thread pool) vs Abbot.async_chat_completion
+(pooled async client) vs Abbot.stream_chat_completion for N concurrent chats against the local fake OpenAI server.
+
+Run from the repo root with a populated src/.env:
+    PYTHONPATH=src python src/test/bench_completions.py --chats 50 --latency 0.5
+"""
+import time
+import asyncio
+import argparse
+
+from lib.api.fake_openai import FakeOpenAI
+from lib.abbot.core import Abbot, new_async_client, new_client
+from lib.abbot.config import BOT_SYSTEM_OBJECT_GROUPS
+from lib.abbot.limiter import admission_controller
+
+
+def new_abbot(chat_id: int) -> Abbot:
+    history = [BOT_SYSTEM_OBJECT_GROUPS, {"role": "user", "content": f"@bench{chat_id} said: what is lightning?"}]
+    return Abbot(chat_id, "group", history)
+
+
+async def blocking_chat(chat_id: int):
+    # off the event loop, which also hosts the fake server: called inline it would wait on a reply never served
+    await asyncio.to_thread(new_abbot(chat_id).chat_completion, "bench")
+
+
+async def async_chat(chat_id: int):
+    await new_abbot(chat_id).async_chat_completion("bench")
+
+
+async def stream_chat(chat_id: int):
+    await new_abbot(chat_id).stream_chat_completion("bench")
+
+
+async def run(chats: int, runner) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*[runner(chat_id) for chat_id in range(chats)])
+    return time.perf_counter() - start
+
+
+async def main(args: argparse.Namespace):
+    fake_openai = FakeOpenAI(latency_sec=args.latency, tokens_per_sec=args.tokens_per_sec)
+    server = await fake_openai.start(args.host, args.port)
+    base_url = f"http://{args.host}:{args.port}/v1"
+    Abbot.client = new_client(base_url)
+    Abbot.async_client = new_async_client(base_url)
+    admission_controller.max_in_flight = args.max_in_flight
+    try:
+        for name, runner in (("blocking", blocking_chat), ("async", async_chat), ("stream", stream_chat)):
+            elapsed = await run(args.chats, runner)
+            print(f"{name:>8}: chats={args.chats} elapsed={elapsed:.2f}s throughput={args.chats / elapsed:.1f} chats/s")
+    finally:
+        await server.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--max-in-flight", type=int, default=50, help="admission controller in-flight limit")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    asyncio.run(main(parser.parse_args()))
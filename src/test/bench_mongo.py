@@ -0,0 +1,96 @@
+"""
+Handler throughput with the blocking MongoAbbot vs AsyncMongoAbbot for N concurrent group updates. Each simulated
+update does what handle_group_default does against Mongo (existence check, projected append) plus a simulated
+Telegram reply, while a ticker measures how long the event loop was blocked.
+
+Uses the test database and cleans up its chats afterwards. Run from the repo root with a populated src/.env:
+    PYTHONPATH=src python src/test/bench_mongo.py --telegram --test --updates 500 --reply-latency 0.05
+"""
+import time
+import asyncio
+import argparse
+from typing import Dict, List
+
+from lib.db.mongo import CHAT_STATE_FIELDS, mongo_abbot
+from lib.db.async_mongo import AsyncMongoAbbot
+from lib.abbot.context import new_history_entry
+
+BENCH_CHAT_ID_BASE: int = -9_000_000_000_000
+
+
+def bench_chat_id(update_id: int, chats: int) -> int:
+    return BENCH_CHAT_ID_BASE - update_id % chats
+
+
+def group_update(chat_id: int, history_entry: Dict) -> Dict:
+    return {
+        "$set": {"id": chat_id, "title": "bench", "type": "group", "balance": 5000},
+        "$inc": {"tokens": history_entry["tokens"]},
+    }
+
+
+async def blocking_update(update_id: int, args: argparse.Namespace):
+    chat_id = bench_chat_id(update_id, args.chats)
+    history_entry = new_history_entry("user", f"@bench said: message {update_id}")
+    mongo_abbot.group_does_exist({"id": chat_id})
+    mongo_abbot.append_group(chat_id, group_update(chat_id, history_entry), [history_entry], [], CHAT_STATE_FIELDS)
+    await asyncio.sleep(args.reply_latency)
+
+
+async def async_update(update_id: int, args: argparse.Namespace, async_mongo: AsyncMongoAbbot):
+    chat_id = bench_chat_id(update_id, args.chats)
+    history_entry = new_history_entry("user", f"@bench said: message {update_id}")
+    await async_mongo.group_does_exist({"id": chat_id})
+    await async_mongo.append_group(
+        chat_id, group_update(chat_id, history_entry), [history_entry], [], CHAT_STATE_FIELDS
+    )
+    await asyncio.sleep(args.reply_latency)
+
+
+async def loop_lag(stop: asyncio.Event, lags: List[float], interval_sec: float = 0.005):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval_sec)
+        lags.append(time.perf_counter() - start - interval_sec)
+
+
+async def run(name: str, args: argparse.Namespace, runner) -> Dict:
+    stop = asyncio.Event()
+    lags: List[float] = []
+    ticker = asyncio.create_task(loop_lag(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*[runner(update_id) for update_id in range(args.updates)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    max_lag_ms = max(lags, default=0.0) * 1000
+    print(f"{name:>8}: updates={args.updates} elapsed={elapsed:.2f}s throughput={args.updates / elapsed:.1f} updates/s")
+    print(f"{'':>8}  max event loop lag={max_lag_ms:.1f}ms")
+    return dict(elapsed=elapsed, max_lag_ms=max_lag_ms)
+
+
+def cleanup(chats: int):
+    chat_ids = [BENCH_CHAT_ID_BASE - offset for offset in range(chats)]
+    mongo_abbot.groups.delete_many({"id": {"$in": chat_ids}})
+    for buckets in (mongo_abbot.history_buckets, mongo_abbot.message_buckets):
+        buckets.delete_many({"bot_type": "group", "chat_id": {"$in": chat_ids}})
+
+
+async def main(args: argparse.Namespace):
+    async_mongo = AsyncMongoAbbot(mongo_abbot, executor_workers=args.executor_workers)
+    try:
+        await run("blocking", args, lambda update_id: blocking_update(update_id, args))
+        await run("async", args, lambda update_id: async_update(update_id, args, async_mongo))
+    finally:
+        async_mongo.shutdown()
+        cleanup(args.chats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--reply-latency", type=float, default=0.05, help="simulated Telegram reply seconds")
+    parser.add_argument("--executor-workers", type=int, default=16)
+    args, _ = parser.parse_known_args()
+    asyncio.run(main(args))
@@ -0,0 +1,116 @@
+"""
+Drives OutboundRateLimiter with a burst of replies, edits and squawks across chats against a fake Bot API that
+enforces Telegram-like limits and answers 429 with retry_after when they are exceeded, then reports throughput,
+429s and send wait per priority. --no-limiter sends the same burst unpaced for comparison.
+
+Run from the repo root with a populated src/.env:
+    PYTHONPATH=src python src/test/bench_outbound.py --telegram --test --chats 20 --messages 5 --global-per-sec 30
+"""
+import sys
+import time
+import random
+import asyncio
+import argparse
+from collections import defaultdict, deque
+from typing import Deque, Dict, Optional
+
+from telegram.error import RetryAfter
+
+from constants import ABBOT_SQUAWKS
+from lib.metrics import metrics
+from lib.abbot.telegram.outbound import PRIORITY_NAMES, OutboundRateLimiter
+
+
+class FakeBotApi:
+    """
+    Answers after latency_sec, or raises RetryAfter when a chat got more than chat_limit sends in the last
+    chat_window_sec or all chats more than global_limit in the last second
+    """
+
+    def __init__(self, global_limit: int, chat_limit: int, chat_window_sec: float, latency_sec: float):
+        self.global_limit: int = global_limit
+        self.chat_limit: int = chat_limit
+        self.chat_window_sec: float = chat_window_sec
+        self.latency_sec: float = latency_sec
+        self.sent: Deque[float] = deque()
+        self.chat_sent: Dict[int, Deque[float]] = defaultdict(deque)
+        self.retry_afters: int = 0
+        self.delivered: int = 0
+
+    async def post(self, endpoint: str, data: Dict):
+        now = time.monotonic()
+        chat_sent: Deque[float] = self.chat_sent[data["chat_id"]]
+        while self.sent and now - self.sent[0] > 1:
+            self.sent.popleft()
+        while chat_sent and now - chat_sent[0] > self.chat_window_sec:
+            chat_sent.popleft()
+        if len(self.sent) >= self.global_limit or len(chat_sent) >= self.chat_limit:
+            self.retry_afters += 1
+            raise RetryAfter(1)
+        self.sent.append(now)
+        chat_sent.append(now)
+        await asyncio.sleep(self.latency_sec)
+        self.delivered += 1
+        return True
+
+
+async def send(limiter: Optional[OutboundRateLimiter], api: FakeBotApi, endpoint: str, chat_id: int):
+    data = {"chat_id": chat_id, "text": "gm"}
+    try:
+        if not limiter:
+            return await api.post(endpoint, data)
+        return await limiter.process_request(api.post, (endpoint, data), {}, endpoint, data, None)
+    except RetryAfter:
+        metrics.incr("bench.failed")
+
+
+async def main(args: argparse.Namespace) -> int:
+    random.seed(args.seed)
+    api = FakeBotApi(args.api_global_limit, args.api_chat_limit, args.api_chat_window_sec, args.latency)
+    limiter: Optional[OutboundRateLimiter] = None
+    if not args.no_limiter:
+        limiter = OutboundRateLimiter(
+            global_per_sec=args.global_per_sec,
+            group_per_min=args.group_per_min,
+            chat_burst=args.chat_burst,
+            max_retries=args.max_retries,
+        )
+    sends = []
+    for index in range(args.chats * args.messages):
+        chat_id = -(index % args.chats) - 1
+        roll = random.random()
+        if roll < args.squawk_rate:
+            sends.append(send(limiter, api, "sendMessage", ABBOT_SQUAWKS))
+        elif roll < args.squawk_rate + args.edit_rate:
+            sends.append(send(limiter, api, "editMessageText", chat_id))
+        else:
+            sends.append(send(limiter, api, "sendMessage", chat_id))
+    start = time.perf_counter()
+    await asyncio.gather(*sends)
+    elapsed = time.perf_counter() - start
+    failed: int = metrics.counters.get("bench.failed", 0)
+    print(f"limiter={'off' if args.no_limiter else 'on'} sends={len(sends)} elapsed={elapsed:.2f}s")
+    print(f"delivered={api.delivered} failed={failed} retry_afters={api.retry_afters}")
+    for name in PRIORITY_NAMES.values():
+        print(f"wait_sec[{name}]={metrics.summary('outbound.wait_sec', priority=name)}")
+    return 0 if not failed else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=5, help="messages per chat")
+    parser.add_argument("--squawk-rate", type=float, default=0.05)
+    parser.add_argument("--edit-rate", type=float, default=0.2)
+    parser.add_argument("--global-per-sec", type=float, default=30)
+    parser.add_argument("--group-per-min", type=float, default=20)
+    parser.add_argument("--chat-burst", type=float, default=3)
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--api-global-limit", type=int, default=30, help="fake Bot API sends per second")
+    parser.add_argument("--api-chat-limit", type=int, default=20, help="fake Bot API sends per chat window")
+    parser.add_argument("--api-chat-window-sec", type=float, default=60)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake Bot API seconds per send")
+    parser.add_argument("--no-limiter", action="store_true")
+    parser.add_argument("--seed", type=int, default=25)
+    args, _ = parser.parse_known_args()
+    sys.exit(asyncio.run(main(args)))
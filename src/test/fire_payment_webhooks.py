@@ -0,0 +1,263 @@
+"""
+Stand-in for the payment processors' settlement webhooks. Builds Strike, LNbits and OpenNode webhooks signed
+the way each processor signs them.
+
+With no --url it checks the whole path in-process for each processor: get_invoice creates an invoice against a
+fake processor API (so the LNbits webhook url and the OpenNode callback_url are the ones the bot would send),
+an InvoiceWatcher watches it and PaymentWebhooks serves its settle_webhook on a free port. It then fires a
+tampered webhook and one that must not credit (not a payment, or for LNbits a token from another secret), marks
+the invoice paid, and for LNbits fires a validly signed webhook for another correlation id naming this invoice.
+Then it fires the signed paid webhook while crediting fails (which must answer 500) and twice more, and checks
+the invoice was credited exactly once. Exits non-zero on any mismatch.
+
+With --url it fires one signed paid webhook at a running bot for an invoice /fund just issued in your test
+group (for Strike the bot still asks Strike whether the invoice is paid):
+    PYTHONPATH=src python src/test/fire_payment_webhooks.py --dev
+    PYTHONPATH=src python src/test/fire_payment_webhooks.py --dev --url http://127.0.0.1:8444/payments \\
+        --processor opennode --invoice-id <charge id> --correlation-id <order id>
+"""
+
+import sys
+import json
+import uuid
+import asyncio
+import argparse
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+import httpx
+import aiohttp
+
+from lib.utils import successful, try_get
+from lib.payments import LNbits, OpenNode, PaymentProcessor, Strike, hmac_hex
+from lib.abbot.env import PAYMENT_PROCESSOR_TOKEN, PAYMENT_WEBHOOK_SECRET
+from lib.abbot.invoice_watcher import InvoiceWatcher, PendingInvoice
+from lib.api.payment_webhooks import (
+    OPENNODE_PAID,
+    STRIKE_INVOICE_UPDATED,
+    STRIKE_SIGNATURE_HEADER,
+    PaymentWebhooks,
+)
+
+# (path suffix with query, headers, body)
+Webhook = Tuple[str, Dict[str, str], bytes]
+TEST_CHAT_ID: int = -1
+
+
+def strike_webhook(invoice_id: str, secret: str, event_type: str = STRIKE_INVOICE_UPDATED) -> Webhook:
+    event = {
+        "id": str(uuid.uuid4()),
+        "eventType": event_type,
+        "webhookVersion": "v1",
+        "data": {"entityId": invoice_id, "changes": ["state"]},
+    }
+    body: bytes = json.dumps(event).encode()
+    headers = {"Content-Type": "application/json", STRIKE_SIGNATURE_HEADER: hmac_hex(secret, body).upper()}
+    return "/strike", headers, body
+
+
+def lnbits_webhook(payment_hash: str, correlation_id: str, secret: str) -> Webhook:
+    query: str = urlencode(dict(correlation_id=correlation_id, token=hmac_hex(secret, correlation_id)))
+    return lnbits_webhook_at(f"/lnbits?{query}", payment_hash)
+
+
+def lnbits_webhook_at(suffix: str, payment_hash: str) -> Webhook:
+    body: bytes = json.dumps({"payment_hash": payment_hash, "amount": 1000, "extra": {}}).encode()
+    return suffix, {"Content-Type": "application/json"}, body
+
+
+def opennode_webhook(charge_id: str, order_id: str, api_key: str, status: str = OPENNODE_PAID) -> Webhook:
+    charge = dict(id=charge_id, order_id=order_id, status=status, hashed_order=hmac_hex(api_key, charge_id))
+    return "/opennode", {"Content-Type": "application/x-www-form-urlencoded"}, urlencode(charge).encode()
+
+
+def tampered(webhook: Webhook) -> Webhook:
+    suffix, headers, body = webhook
+    if STRIKE_SIGNATURE_HEADER in headers:
+        return suffix, headers, body.replace(b"invoice.updated", b"invoice.updatee")
+    if suffix.startswith("/lnbits"):
+        return suffix.replace("token=", "token=0"), headers, body
+    return suffix, headers, body.replace(b"hashed_order=", b"hashed_order=0")
+
+
+async def fire(session: aiohttp.ClientSession, base_url: str, webhook: Webhook) -> int:
+    suffix, headers, body = webhook
+    async with session.post(f"{base_url}{suffix}", data=body, headers=headers) as response:
+        return response.status
+
+
+class FakeProcessorApi:
+    """
+    Answers the invoice calls each PaymentProcessor makes, with the invoice unpaid until paid is set, and keeps
+    the body of every invoice it was asked to create
+    """
+
+    def __init__(self, kind: str):
+        self.kind: str = kind
+        self.invoice_id: str = uuid.uuid4().hex
+        self.paid: bool = False
+        self.created: List[Dict] = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        path: str = request.url.path
+        if request.method == "POST" and path.rstrip("/").endswith(("/invoices", "/payments", "/charges")):
+            self.created.append(json.loads(request.content))
+            return httpx.Response(201 if self.kind != "strike" else 200, json=self.invoice())
+        if path.endswith("/quote"):
+            return httpx.Response(200, json={"lnInvoice": f"lnbc{self.invoice_id}", "expirationInSec": 600})
+        if path.endswith("/invoices"):
+            return httpx.Response(200, json={"items": [{"invoiceId": self.invoice_id}] if self.paid else []})
+        if path.endswith(self.invoice_id):
+            return httpx.Response(200, json=self.status())
+        return httpx.Response(404, json={})
+
+    def invoice(self) -> Dict:
+        if self.kind == "strike":
+            return {"invoiceId": self.invoice_id}
+        if self.kind == "lnbits":
+            return {"payment_hash": self.invoice_id, "payment_request": f"lnbc{self.invoice_id}"}
+        charge = {"id": self.invoice_id, "lightning_invoice": {"payreq": f"lnbc{self.invoice_id}"}, "ttl": 10}
+        return {"data": charge}
+
+    def status(self) -> Dict:
+        if self.kind == "strike":
+            return {"state": "PAID" if self.paid else "UNPAID"}
+        if self.kind == "lnbits":
+            return {"paid": self.paid, "details": {"expiry": 600}}
+        return {"data": {"status": OPENNODE_PAID if self.paid else "unpaid"}}
+
+
+def fake_processor(kind: str, api: FakeProcessorApi, webhook_url: str, secret: str, api_key: str) -> PaymentProcessor:
+    if kind == "strike":
+        processor = Strike(api_key, webhook_url, secret)
+    elif kind == "lnbits":
+        processor = LNbits("http://lnbits.invalid", api_key, webhook_url, secret)
+    else:
+        processor = OpenNode(api_key, webhook_url)
+    processor._client = httpx.AsyncClient(
+        base_url=processor._client.base_url,
+        headers=processor._client.headers,
+        transport=httpx.MockTransport(api.handle),
+    )
+    return processor
+
+
+async def check_processor(session: aiohttp.ClientSession, kind: str, secret: str, api_key: str) -> List[str]:
+    api = FakeProcessorApi(kind)
+    watcher: Optional[InvoiceWatcher] = None
+    credited: List[str] = []
+    credit_failures: List[int] = [1]
+
+    async def settle_webhook(invoice_id: Optional[str], correlation_id: Optional[str], confirmed: bool) -> bool:
+        return await watcher.settle_webhook(invoice_id, correlation_id, confirmed)
+
+    async def on_paid(invoice: PendingInvoice):
+        if credit_failures[0]:
+            credit_failures[0] -= 1
+            raise RuntimeError("credit failed")
+        credited.append(invoice.invoice_id)
+
+    async def on_expired(invoice: PendingInvoice):
+        failures.append(f"{kind} invoice_id={invoice.invoice_id} expired")
+
+    webhooks = PaymentWebhooks(settle_webhook, processor_kind=kind, secret=secret, api_key=api_key, port=0)
+    await webhooks.start()
+    port: int = webhooks.runner.addresses[0][1]
+    base_url = f"http://127.0.0.1:{port}{webhooks.path}"
+    processor: PaymentProcessor = fake_processor(kind, api, f"{base_url}/{kind}", secret, api_key)
+    # long intervals: after its first check the invoice is only settled by a webhook
+    watcher = InvoiceWatcher(processor, min_interval_sec=3600, max_interval_sec=3600)
+    failures: List[str] = []
+    try:
+        correlation_id = str(uuid.uuid1())
+        invoice: Dict = await processor.get_invoice(correlation_id, "webhook check", 1, TEST_CHAT_ID)
+        invoice_id: Optional[str] = try_get(invoice, "invoice_id")
+        expiration_in_sec = try_get(invoice, "expiration_in_sec")
+        if not successful(invoice) or None in (invoice_id, try_get(invoice, "ln_invoice"), expiration_in_sec):
+            return [f"{kind} get_invoice returned {invoice}"]
+        pending = PendingInvoice(
+            TEST_CHAT_ID,
+            "webhook check",
+            invoice_id,
+            1000,
+            expiration_in_sec,
+            None,
+            None,
+            correlation_id=correlation_id,
+        )
+        watcher.watch(pending, on_paid, on_expired)
+        # LNbits only calls its webhook once paid, so its other case is a token derived with another secret
+        if kind == "strike":
+            paid = strike_webhook(invoice_id, secret)
+            other = strike_webhook(invoice_id, secret, event_type="invoice.created")
+        elif kind == "lnbits":
+            webhook_url: str = try_get(api.created, 0, "webhook", default="")
+            if not webhook_url.startswith(f"{base_url}/lnbits?"):
+                failures.append(f"lnbits invoice created with webhook={webhook_url}")
+            webhook_parts = urlsplit(webhook_url)
+            paid = lnbits_webhook_at(f"{webhook_parts.path[len(webhooks.path):]}?{webhook_parts.query}", invoice_id)
+            other = lnbits_webhook(invoice_id, correlation_id, "not the secret")
+        else:
+            callback_url: str = try_get(api.created, 0, "callback_url", default="")
+            if callback_url != f"{base_url}/opennode":
+                failures.append(f"opennode charge created with callback_url={callback_url}")
+            paid = opennode_webhook(invoice_id, correlation_id, api_key)
+            other = opennode_webhook(invoice_id, correlation_id, api_key, status="processing")
+        expected = [(tampered(paid), 401, 0), (other, 401 if kind == "lnbits" else 200, 0)]
+        for index, (webhook, status, credits) in enumerate(expected):
+            got: int = await fire(session, base_url, webhook)
+            if got != status or len(credited) != credits:
+                failures.append(f"{kind} webhook {index}: status={got} credits={len(credited)} want {status} {credits}")
+        api.paid = True
+        paid_expected = [(paid, 500, 0), (paid, 200, 1), (paid, 200, 1)]
+        if kind == "lnbits":
+            # a token is only good for its own correlation id, whatever payment_hash the body names
+            paid_expected.insert(0, (lnbits_webhook(invoice_id, str(uuid.uuid1()), secret), 200, 0))
+        for index, (webhook, status, credits) in enumerate(paid_expected, start=len(expected)):
+            got: int = await fire(session, base_url, webhook)
+            if got != status or len(credited) != credits:
+                failures.append(f"{kind} webhook {index}: status={got} credits={len(credited)} want {status} {credits}")
+    finally:
+        await watcher.stop()
+        await webhooks.stop()
+    if credited and credited[0] != invoice_id:
+        failures.append(f"{kind} credited {credited[0]} instead of invoice_id={invoice_id}")
+    print(f"{kind}: invoice_id={invoice_id} credited={credited} failures={len(failures)}")
+    return failures
+
+
+async def main(args: argparse.Namespace) -> int:
+    secret: str = args.secret or uuid.uuid4().hex
+    api_key: str = args.api_key or uuid.uuid4().hex
+    async with aiohttp.ClientSession() as session:
+        if args.url:
+            webhook_for = dict(
+                strike=lambda: strike_webhook(args.invoice_id, secret),
+                lnbits=lambda: lnbits_webhook(args.invoice_id, args.correlation_id, secret),
+                opennode=lambda: opennode_webhook(args.invoice_id, args.correlation_id, api_key),
+            )
+            status: int = await fire(session, args.url, webhook_for[args.processor]())
+            print(f"{args.processor} invoice_id={args.invoice_id} status={status}")
+            return 0 if status == 200 else 1
+        failures: List[str] = []
+        for kind in ("strike", "lnbits", "opennode"):
+            failures += await check_processor(session, kind, secret, api_key)
+    for failure in failures:
+        print(f"FAILURE {failure}")
+    print("payment webhooks ok" if not failures else f"{len(failures)} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="a running bot's payment webhook base, e.g. http://127.0.0.1:8444/payments")
+    parser.add_argument("--processor", choices=["strike", "lnbits", "opennode"], default="strike")
+    parser.add_argument("--invoice-id", default="")
+    parser.add_argument("--correlation-id", default="")
+    parser.add_argument("--secret", default=None, help="defaults to PAYMENT_WEBHOOK_SECRET with --url")
+    parser.add_argument("--api-key", default=None, help="defaults to PAYMENT_PROCESSOR_TOKEN with --url")
+    args, _ = parser.parse_known_args()
+    if args.url:
+        args.secret = args.secret or PAYMENT_WEBHOOK_SECRET
+        args.api_key = args.api_key or PAYMENT_PROCESSOR_TOKEN
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,101 @@
+"""
+POSTs Telegram updates to a bot running with --webhook and reports throughput, latency and status codes.
+Updates come from --file (one recorded update JSON per line) or are synthesized as plain group messages in
+--chat-ids, which Abbot stores without replying, so point them at your test group. 503s are the webhook
+shedding load once max_queue updates are pending.
+
+Run from the repo root against `python src/main.py --dev --telegram --webhook`:
+    PYTHONPATH=src python src/test/post_updates.py --dev --chat-ids -1001234567890 --updates 2000 --concurrency 40
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+from typing import Dict, List
+
+import aiohttp
+
+from lib.metrics import metrics
+from lib.abbot.env import BOT_TELEGRAM_WEBHOOK_SECRET
+from lib.abbot.config import BOT_TELEGRAM_WEBHOOK_HOST, BOT_TELEGRAM_WEBHOOK_PATH, BOT_TELEGRAM_WEBHOOK_PORT
+from lib.api.telegram_webhook import SECRET_TOKEN_HEADER
+
+SYNTHETIC_USER_ID: int = 777000001
+FIRST_UPDATE_ID: int = 900000000
+
+
+def load_updates(path: str) -> List[Dict]:
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def synthetic_updates(count: int, chat_ids: List[int]) -> List[Dict]:
+    now = int(time.time())
+    updates: List[Dict] = []
+    for index in range(count):
+        chat_id = chat_ids[index % len(chat_ids)]
+        message = {
+            "message_id": index + 1,
+            "date": now,
+            "chat": {"id": chat_id, "type": "supergroup", "title": "abbot webhook load test"},
+            "from": {"id": SYNTHETIC_USER_ID, "is_bot": False, "first_name": "loadtest"},
+            "text": f"webhook load test message {index}",
+        }
+        updates.append({"update_id": FIRST_UPDATE_ID + index, "message": message})
+    return updates
+
+
+async def post_all(args: argparse.Namespace, updates: List[Dict]) -> Counter:
+    statuses: Counter = Counter()
+    pending: asyncio.Queue = asyncio.Queue()
+    for update in updates:
+        pending.put_nowait(update)
+    headers = {SECRET_TOKEN_HEADER: args.secret}
+
+    async def worker(session: aiohttp.ClientSession):
+        while not pending.empty():
+            update = pending.get_nowait()
+            started_at = time.perf_counter()
+            try:
+                async with session.post(args.url, json=update, headers=headers) as response:
+                    statuses[response.status] += 1
+            except aiohttp.ClientError as exception:
+                statuses[type(exception).__name__] += 1
+            metrics.observe("post_updates.latency_sec", time.perf_counter() - started_at)
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*[worker(session) for _ in range(args.concurrency)])
+    return statuses
+
+
+async def main(args: argparse.Namespace) -> int:
+    if args.file:
+        updates = load_updates(args.file)
+    elif args.chat_ids:
+        updates = synthetic_updates(args.updates, args.chat_ids)
+    else:
+        print("Pass --file with recorded updates or --chat-ids to synthesize them")
+        return 1
+    start = time.perf_counter()
+    statuses = await post_all(args, updates)
+    elapsed = time.perf_counter() - start
+    print(f"posted={len(updates)} concurrency={args.concurrency} elapsed={elapsed:.2f}s")
+    print(f"throughput={len(updates) / elapsed:.1f} updates/s")
+    print(f"latency_sec={metrics.summary('post_updates.latency_sec')}")
+    print(f"statuses={dict(statuses)}")
+    return 0 if statuses.get(200) else 1
+
+
+if __name__ == "__main__":
+    default_url = f"http://{BOT_TELEGRAM_WEBHOOK_HOST}:{BOT_TELEGRAM_WEBHOOK_PORT}{BOT_TELEGRAM_WEBHOOK_PATH}"
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=default_url)
+    parser.add_argument("--secret", default=BOT_TELEGRAM_WEBHOOK_SECRET)
+    parser.add_argument("--file", help="recorded updates, one JSON object per line")
+    parser.add_argument("--chat-ids", type=int, nargs="*", default=[], help="chats to synthesize messages in")
+    parser.add_argument("--updates", type=int, default=1000, help="how many updates to synthesize")
+    parser.add_argument("--concurrency", type=int, default=40, help="requests in flight, like max_connections")
+    args, _ = parser.parse_known_args()
+    sys.exit(asyncio.run(main(args)))
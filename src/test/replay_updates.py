@@ -0,0 +1,93 @@
+"""
+Replays interleaved updates from several chats through ChatOrderedUpdateProcessor the way Application does (one
+task per update, created in arrival order) with random handler latency, then checks that every chat's updates
+ran one at a time in arrival order, that different chats overlapped and that no more than --workers ran at once.
+Exits non-zero on any violation.
+
+Run from the repo root with a populated src/.env:
+    PYTHONPATH=src python src/test/replay_updates.py --telegram --test --updates 400 --chats 12 --workers 4
+"""
+import sys
+import time
+import random
+import asyncio
+import argparse
+from types import SimpleNamespace
+from typing import Dict, List
+
+from lib.metrics import metrics
+from lib.abbot.telegram.scheduler import ChatOrderedUpdateProcessor
+
+
+class Replay:
+    def __init__(self):
+        self.started: Dict[int, List[int]] = dict()
+        self.active: Dict[int, int] = dict()
+        self.running: int = 0
+        self.max_running: int = 0
+        self.violations: List[str] = []
+
+    async def handle(self, chat_id: int, seq: int, latency: float):
+        if self.active.get(chat_id):
+            self.violations.append(f"chat={chat_id} seq={seq} started while seq={self.active[chat_id]} was running")
+        self.active[chat_id] = seq
+        self.started.setdefault(chat_id, []).append(seq)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(latency)
+        self.running -= 1
+        self.active[chat_id] = 0
+
+
+def new_update(chat_id: int) -> SimpleNamespace:
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), effective_user=None)
+
+
+async def main(args: argparse.Namespace) -> int:
+    random.seed(args.seed)
+    processor = ChatOrderedUpdateProcessor(workers=args.workers, max_pending=args.max_pending)
+    replay = Replay()
+    sent: Dict[int, List[int]] = dict()
+    tasks: List[asyncio.Task] = []
+    await processor.initialize()
+    start = time.perf_counter()
+    for seq in range(1, args.updates + 1):
+        chat_id = -random.randrange(1, args.chats + 1)
+        sent.setdefault(chat_id, []).append(seq)
+        latency = random.uniform(0, args.max_latency)
+        coroutine = replay.handle(chat_id, seq, latency)
+        tasks.append(asyncio.create_task(processor.process_update(new_update(chat_id), coroutine)))
+        if random.random() < 0.2:
+            await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    await processor.shutdown()
+
+    for chat_id, seqs in sent.items():
+        if replay.started.get(chat_id) != seqs:
+            replay.violations.append(f"chat={chat_id} ran {replay.started.get(chat_id)} but received {seqs}")
+    if replay.max_running > args.workers:
+        replay.violations.append(f"{replay.max_running} handlers ran at once with workers={args.workers}")
+    if args.workers > 1 and args.chats > 1 and replay.max_running < 2:
+        replay.violations.append("updates from different chats never overlapped")
+    serial_sec = args.updates * args.max_latency / 2
+    print(f"updates={args.updates} chats={args.chats} workers={args.workers} elapsed={elapsed:.2f}s")
+    print(f"max concurrent handlers={replay.max_running} (one at a time would take ~{serial_sec:.1f}s)")
+    print(f"handler_sec={metrics.summary('updates.handler_sec')}")
+    print(f"queue_wait_sec={metrics.summary('updates.queue_wait_sec')}")
+    for violation in replay.violations:
+        print(f"VIOLATION {violation}")
+    print("ordering ok" if not replay.violations else f"{len(replay.violations)} violations")
+    return 1 if replay.violations else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=400)
+    parser.add_argument("--chats", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-pending", type=int, default=1024)
+    parser.add_argument("--max-latency", type=float, default=0.02, help="max simulated handler seconds")
+    parser.add_argument("--seed", type=int, default=21)
+    args, _ = parser.parse_known_args()
+    sys.exit(asyncio.run(main(args)))